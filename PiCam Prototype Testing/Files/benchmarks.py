@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import shutil
+import tempfile
+import socket
+import asyncio
+import logging
+import argparse
+import threading
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def report(name, latencies, elapsed):
+    print(f"{name:<24} {len(latencies) / elapsed:>10.0f} req/s   "
+          f"p50 {percentile(latencies, 50) * 1000:>7.2f} ms   "
+          f"p99 {percentile(latencies, 99) * 1000:>7.2f} ms   "
+          f"max {max(latencies) * 1000:>7.2f} ms")
+
+def describe(label, values, unit="ms", scale=1000):
+    print(f"{label:<24} n {len(values):>6}   "
+          f"p50 {percentile(values, 50) * scale:>8.2f} {unit}   "
+          f"p99 {percentile(values, 99) * scale:>8.2f} {unit}   "
+          f"max {max(values, default=0) * scale:>8.2f} {unit}")
+
+def use_backend(backend):
+    os.environ["PICAM_BACKEND"] = backend
+    # Claiming the root logger first turns the scripts' basicConfig calls (which log under
+    # /home/picam and /home/pi) into no-ops, so they import on a machine without those paths
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(message)s")
+
+def synthetic_frames(seconds, fps, bitrate, iperiod):
+    # (frame, keyframe, timestamp_us) from the fake encoder, without the camera thread's real-time pacing
+    import fake_hardware
+    frames = []
+    class Collect(fake_hardware.Output):
+        def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+            frames.append((frame, keyframe, timestamp))
+    encoder = fake_hardware.H264Encoder(bitrate=bitrate, repeat=True, iperiod=iperiod)
+    encoder.output = [Collect()]
+    encoder._start((1920, 1080), fps)
+    for i in range(int(seconds * fps)):
+        encoder.encode(int(i * 1000000 / fps))
+    return frames
+
+def make_recorder(video_dir, fps, bitrate):
+    import recording_script
+    from segment_catalog import SegmentCatalog
+    recording_script.VIDEO_DIR = video_dir
+    recording_script.STATUS_FILE = os.path.join(video_dir, "status.json")
+    recording_script.BITRATE = bitrate
+    return recording_script.CameraController(SegmentCatalog(video_dir), pre_event_seconds=0,
+                                             control_path=os.path.join(video_dir, "control.sock"), frame_rate=fps)
+
+async def legacy_client(host, port, command, count, latencies):
+    for _ in range(count):
+        start = time.perf_counter()
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(command.encode())
+        await reader.read()
+        writer.close()
+        await writer.wait_closed()
+        latencies.append(time.perf_counter() - start)
+
+async def session_client(host, port, command, count, depth, latencies):
+    import serial_server
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"{serial_server.SESSION_HELLO}\n".encode())
+    await reader.readline()
+    sent = []
+    received = 0
+    while received < count:
+        # Keep up to depth requests in flight on the one connection
+        while len(sent) - received < depth and len(sent) < count:
+            sent.append(time.perf_counter())
+            writer.write(f"{command}\n".encode())
+        await writer.drain()
+        await reader.readline()
+        latencies.append(time.perf_counter() - sent[received])
+        received += 1
+    writer.close()
+    await writer.wait_closed()
+
+async def bench_serial(args):
+    import serial_server
+    server = await serial_server.start_server("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    per_client = args.requests // args.clients
+    async with server:
+        for name, make in (
+            ("one-shot connections", lambda lat: legacy_client("127.0.0.1", port, args.command, per_client, lat)),
+            ("persistent sessions", lambda lat: session_client("127.0.0.1", port, args.command, per_client, 1, lat)),
+            (f"pipelined (depth {args.depth})",
+             lambda lat: session_client("127.0.0.1", port, args.command, per_client, args.depth, lat)),
+        ):
+            latencies = []
+            start = time.perf_counter()
+            await asyncio.gather(*(make(latencies) for _ in range(args.clients)))
+            report(name, latencies, time.perf_counter() - start)
+
+async def http_get(host, port, path, byte_range=None):
+    # Returns (time to first byte, total time, body length, status code)
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n"
+    if byte_range:
+        request += f"Range: bytes={byte_range[0]}-{byte_range[1]}\r\n"
+    writer.write((request + "\r\n").encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    first_byte = time.perf_counter() - start
+    received = 0
+    while True:
+        chunk = await reader.read(262144)
+        if not chunk:
+            break
+        received += len(chunk)
+    writer.close()
+    return first_byte, time.perf_counter() - start, received, head.split(b" ", 2)[1]
+
+async def bench_download(args):
+    from clip_server import start_clip_server
+    with tempfile.TemporaryDirectory() as video_dir:
+        name = "Recording_bench.mp4"
+        with open(os.path.join(video_dir, name), "wb") as f:
+            f.write(os.urandom(args.size_mb * 1024 * 1024))
+        server = await start_clip_server(video_dir, "127.0.0.1", 0, args.transfers)
+        port = server.sockets[0].getsockname()[1]
+        size = args.size_mb * 1024 * 1024
+        async with server:
+            for label, byte_range in (("full downloads", None), ("resumed (2nd half)", (size // 2, size - 1))):
+                results = []
+                start = time.perf_counter()
+                for _ in range(args.rounds):
+                    results += await asyncio.gather(*(http_get("127.0.0.1", port, f"/clips/{name}", byte_range)
+                                                      for _ in range(args.clients)))
+                elapsed = time.perf_counter() - start
+                served = [r for r in results if r[1] != b"503"]
+                total = sum(r[2] for r in served)
+                print(f"{label:<20} {total / elapsed / 1024 ** 2:>8.1f} MB/s   "
+                      f"ttfb p50 {percentile([r[0] for r in served], 50) * 1000:>7.2f} ms   "
+                      f"p99 {percentile([r[0] for r in served], 99) * 1000:>7.2f} ms   "
+                      f"done p99 {percentile([r[1] for r in served], 99) * 1000:>8.1f} ms   "
+                      f"503s {len(results) - len(served)}")
+
+def bench_rotation(args):
+    with tempfile.TemporaryDirectory() as video_dir:
+        camera = make_recorder(video_dir, args.fps, args.bitrate)
+        opened = []
+        segment_opened = camera.output.on_open
+        def on_open(path):
+            opened.append(time.perf_counter())
+            segment_opened(path)
+        camera.output.on_open = on_open
+        camera.start_recording()
+        time.sleep(1)
+        requested = []
+        for _ in range(args.rotations):
+            time.sleep(args.interval)
+            requested.append(time.perf_counter())
+            camera.rotate_recording()
+        time.sleep(args.interval)
+        # Read before stop_recording, which drains the gaps into the log
+        gaps = [gap_ms / 1000 for _, gap_ms in camera.output.rotation_gaps]
+        camera.stop_recording()
+        delays = [opened[i + 1] - t for i, t in enumerate(requested) if i + 1 < len(opened)]
+        describe("rotation gap", gaps)
+        describe("cut-over delay", delays)
+        print(f"camera frames {camera.picam2.frames}, dropped {camera.picam2.dropped}")
+        camera.shutdown()
+
+def bench_remux(args):
+    from remux_queue import RemuxQueue
+    from fmp4_muxer import FragmentedMP4Writer
+    frames = synthetic_frames(args.seconds, args.fps, args.bitrate, args.fps)
+    size = sum(len(frame) for frame, _, _ in frames)
+    with tempfile.TemporaryDirectory() as video_dir:
+        start = time.perf_counter()
+        with open(os.path.join(video_dir, "native.mp4"), "wb") as f:
+            muxer = FragmentedMP4Writer(f, 1920, 1080)
+            for frame, keyframe, timestamp in frames:
+                muxer.write_frame(frame, keyframe, timestamp)
+            muxer.close()
+        elapsed = time.perf_counter() - start
+        print(f"{'native fMP4 mux':<24} {size / elapsed / 1024 ** 2:>8.1f} MB/s   "
+              f"{args.seconds / elapsed:>6.0f}x realtime")
+        if not shutil.which("ffmpeg"):
+            print("ffmpeg not found, skipping remux")
+            return
+        queue = RemuxQueue(video_dir, args.fps)
+        times = []
+        for i in range(args.files):
+            path = os.path.join(video_dir, f"Recording_bench_{i}.h264")
+            with open(path, "wb") as f:
+                for frame, _, _ in frames:
+                    f.write(frame)
+            start = time.perf_counter()
+            queue.remux(path)
+            times.append(time.perf_counter() - start)
+        print(f"{'ffmpeg remux':<24} {size * len(times) / sum(times) / 1024 ** 2:>8.1f} MB/s   "
+              f"{args.seconds * len(times) / sum(times):>6.0f}x realtime")
+        describe("remux per segment", times, "s", 1)
+
+def bench_health(args):
+    import serial_server
+    with tempfile.TemporaryDirectory() as video_dir:
+        serial_server.VIDEO_DIR = video_dir
+        checker = serial_server.HealthChecker()
+        cold = []
+        for _ in range(args.rounds):
+            checker.cache.clear()
+            start = time.perf_counter()
+            checker.perform_full_check(buzz=False)
+            cold.append(time.perf_counter() - start)
+        warm = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            checker.perform_full_check(buzz=False)
+            warm.append(time.perf_counter() - start)
+        describe("health check (cold)", cold)
+        describe("health check (cached)", warm)
+
+def control_request(path, command):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(f"{command}\n".encode())
+        reply = b""
+        while not reply.endswith(b"\n"):
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            reply += chunk
+        return reply
+
+def bench_control(args):
+    with tempfile.TemporaryDirectory() as video_dir:
+        camera = make_recorder(video_dir, args.fps, args.bitrate)
+        path = os.path.join(video_dir, "control.sock")
+        camera.start_recording()
+        loop = threading.Thread(target=camera.scheduler.run, name="recorder")
+        loop.start()
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            sent = time.perf_counter()
+            control_request(path, args.command)
+            latencies.append(time.perf_counter() - sent)
+        report(f"control '{args.command}'", latencies, time.perf_counter() - start)
+        control_request(path, "stop")
+        loop.join()
+        print(f"recorder loop wakeups {camera.scheduler.wakeups}")
+        camera.shutdown()
+
+def bench_disk(args):
+    import recording_script
+    frames = synthetic_frames(min(args.seconds, 10), args.fps, args.bitrate, args.fps)
+    interval = 1 / args.fps
+    with tempfile.TemporaryDirectory(dir=args.dir) as video_dir:
+        output = recording_script.SegmentOutput()
+        latencies = []
+        start = time.perf_counter()
+        for i in range(int(args.seconds * args.fps)):
+            if i % int(args.segment_seconds * args.fps) == 0:
+                output.start_segment(os.path.join(video_dir, f"Recording_bench_{i}.mp4"))
+            frame, keyframe, _ = frames[i % len(frames)]
+            if args.pace:
+                time.sleep(max(0.0, start + i * interval - time.perf_counter()))
+            sent = time.perf_counter()
+            output.outputframe(frame, keyframe, int(i * 1000000 / args.fps))
+            latencies.append(time.perf_counter() - sent)
+        output.stop()
+        output.drain()
+        elapsed = time.perf_counter() - start
+        describe("frame write", latencies)
+        stats = output.writer_stage.stats()
+        for name in ("write_ms", "sync_ms"):
+            print(f"{'card ' + name[:-3]:<24} n {stats[name]['count']:>6}   max {stats[name]['max_ms']:>8.2f} ms   "
+                  + "  ".join(f"{bucket} ms: {count}" for bucket, count in stats[name]["buckets"].items()))
+        print(f"encoder waits on full writer queue: {stats['backpressure_waits']}")
+        stalls = sum(1 for latency in latencies if latency > interval)
+        print(f"written {output.bytes_written / 1024 ** 2:.1f} MB in {elapsed:.1f} s, "
+              f"{stalls} writes longer than a frame interval ({interval * 1000:.0f} ms)")
+
+def synthetic_lores(count, size, moving_from, noise=4):
+    # Grey YUV420 frames with sensor noise; from frame moving_from a bright square crosses the scene
+    import numpy
+    width, height = size
+    rng = numpy.random.default_rng(1)
+    base = numpy.full((height * 3 // 2, width), 100, dtype=numpy.int16)
+    frames = []
+    for i in range(count):
+        frame = base + rng.integers(-noise, noise + 1, base.shape, dtype=numpy.int16)
+        if i >= moving_from:
+            x = (i - moving_from) * 6 % (width - 40)
+            frame[height // 3:height // 3 + 40, x:x + 40] = 220
+        frames.append(frame.clip(0, 255).astype(numpy.uint8))
+    return frames
+
+def bench_motion(args):
+    import motion
+    import recording_script
+    size = recording_script.LORES_SIZE
+    still = args.frames // 2
+    frames = synthetic_lores(args.frames, size, still)
+    detector = motion.MotionDetector(size, sensitivity=args.sensitivity, fps=1000000)
+    detector.set_enabled(True)
+    latencies = []
+    first_detection = None
+    for i, frame in enumerate(frames):
+        start = time.perf_counter()
+        detector.on_lores(frame)
+        latencies.append(time.perf_counter() - start)
+        if detector.active and first_detection is None:
+            first_detection = i
+    describe("motion analysis", latencies)
+    busy = percentile(latencies, 50) * motion.MOTION_FPS * 100
+    print(f"grid {detector.grid[1]}x{detector.grid[0]} blocks, {busy:.2f}% of one core at {motion.MOTION_FPS} fps (p50)")
+    if first_detection is None or first_detection < still:
+        print(f"detection WRONG: first motion at frame {first_detection}, scene moves from frame {still}")
+    else:
+        print(f"motion detected {first_detection - still + 1} frames after it started, no false triggers on noise")
+
+def fake_wpa_supplicant(path, status, refreshes):
+    # Answers STATUS/SCAN_RESULTS like wpa_supplicant's control socket; returns it and the attached clients
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    server.bind(path)
+    attached = []
+    def serve():
+        while True:
+            data, address = server.recvfrom(4096)
+            command = data.decode()
+            if command == "ATTACH":
+                attached.append(address)
+                server.sendto(b"OK\n", address)
+            elif command == "STATUS":
+                refreshes.append(time.perf_counter())
+                server.sendto(status.encode(), address)
+            else:
+                server.sendto(b"bssid / frequency / signal level / flags / ssid\n", address)
+    threading.Thread(target=serve, daemon=True).start()
+    return server, attached
+
+def bench_wifi(args):
+    # Event-to-refresh latency; every watched event, not only scan results, must be handled on the
+    # wpa_supplicant path without the monitor falling back to iwlist
+    import wifi_presence
+    ctrl_dir = tempfile.mkdtemp(prefix="picam-wpa-")
+    refreshes = []
+    try:
+        server, attached = fake_wpa_supplicant(os.path.join(ctrl_dir, "wlan0"),
+                                               "wpa_state=COMPLETED\nssid=bench\n", refreshes)
+        monitor = wifi_presence.WifiPresenceMonitor("bench", ctrl_dir=ctrl_dir, refresh_interval=3600)
+        monitor.start()
+        deadline = time.monotonic() + 5
+        while not attached and time.monotonic() < deadline:
+            time.sleep(0.01)
+        latencies = []
+        for i in range(args.events):
+            event = wifi_presence.WATCHED_EVENTS[i % len(wifi_presence.WATCHED_EVENTS)]
+            count = len(refreshes)
+            start = time.perf_counter()
+            server.sendto(f"<3>{event} bssid=00:00:00:00:00:00".encode(), attached[-1])
+            while len(refreshes) == count and time.perf_counter() - start < 3:
+                time.sleep(0.001)
+            if len(refreshes) == count:
+                print(f"event WRONG: {event} did not cause a refresh")
+                break
+            latencies.append(refreshes[-1] - start)
+        monitor.stop(timeout=2)
+        server.close()
+        describe("event to refresh", latencies)
+        if monitor.source != "wpa_supplicant":
+            print(f"event WRONG: monitor fell back to {monitor.source}")
+        else:
+            print(f"all {len(wifi_presence.WATCHED_EVENTS)} watched events handled over wpa_supplicant")
+    finally:
+        shutil.rmtree(ctrl_dir, ignore_errors=True)
+
+def bus_reader(name):
+    # A subscriber that polls as fast as it can, the worst case for contention with the publisher
+    import frame_bus
+    bus = frame_bus.FrameSubscriber(name)
+    while True:
+        frame = bus.latest()
+        if frame is not None:
+            sum(frame.data[::97])
+            frame.valid()
+            frame.release()
+
+def bench_bus(args):
+    import subprocess
+    import frame_bus
+    import recording_script
+    width, height = recording_script.LORES_SIZE
+    frames = synthetic_lores(args.frames, (width, height), args.frames // 2)
+    name = f"picam_bench_{os.getpid()}"
+    here = os.path.dirname(os.path.abspath(__file__))
+    for subscribers in (0, args.subscribers):
+        publisher = frame_bus.FramePublisher(name, frames[0].nbytes)
+        # Separate interpreters like the real subscribers, not children sharing this process's state
+        readers = [subprocess.Popen([sys.executable, "-c", f"import benchmarks; benchmarks.bus_reader({name!r})"],
+                                    cwd=here) for _ in range(subscribers)]
+        time.sleep(1)
+        latencies = []
+        for frame in frames:
+            start = time.perf_counter()
+            publisher.publish(frame, width, height, width, time.monotonic_ns())
+            latencies.append(time.perf_counter() - start)
+            time.sleep(1 / args.fps)
+        for reader in readers:
+            reader.terminate()
+            reader.wait()
+        publisher.close()
+        describe(f"publish, {subscribers} readers", latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description="PiCam benchmarks")
+    parser.add_argument("--backend", default=os.environ.get("PICAM_BACKEND", "fake"),
+                        help="hardware backend, 'fake' runs on any Linux machine")
+    sub = parser.add_subparsers(dest="benchmark", required=True)
+
+    serial = sub.add_parser("serial", help="serial_server request throughput and latency over loopback")
+    serial.add_argument("--clients", type=int, default=8)
+    serial.add_argument("--requests", type=int, default=4000)
+    serial.add_argument("--depth", type=int, default=8)
+    serial.add_argument("--command", default="sendserialnumber")
+
+    download = sub.add_parser("download", help="clip_server download throughput and tail latency over loopback")
+    download.add_argument("--clients", type=int, default=2)
+    download.add_argument("--rounds", type=int, default=5)
+    download.add_argument("--size-mb", type=int, default=64)
+    download.add_argument("--transfers", type=int, default=2)
+
+    rotation = sub.add_parser("rotation", help="footage lost and cut-over delay at segment rotation")
+    rotation.add_argument("--rotations", type=int, default=10)
+    rotation.add_argument("--interval", type=float, default=2.0)
+    rotation.add_argument("--fps", type=int, default=25)
+    rotation.add_argument("--bitrate", type=int, default=10000000)
+
+    remux = sub.add_parser("remux", help="native fMP4 muxing and ffmpeg remux throughput")
+    remux.add_argument("--files", type=int, default=3)
+    remux.add_argument("--seconds", type=int, default=60)
+    remux.add_argument("--fps", type=int, default=25)
+    remux.add_argument("--bitrate", type=int, default=10000000)
+
+    health = sub.add_parser("health", help="health check latency, cold and cached")
+    health.add_argument("--rounds", type=int, default=20)
+
+    control = sub.add_parser("control", help="control socket round trip while recording")
+    control.add_argument("--requests", type=int, default=500)
+    control.add_argument("--command", default="status")
+    control.add_argument("--fps", type=int, default=25)
+    control.add_argument("--bitrate", type=int, default=10000000)
+
+    disk = sub.add_parser("disk", help="segment write latency and stalls at the recording bitrate")
+    disk.add_argument("--dir", default=None, help="directory on the card to test, defaults to the temp dir")
+    disk.add_argument("--seconds", type=int, default=60)
+    disk.add_argument("--segment-seconds", type=int, default=20)
+    disk.add_argument("--fps", type=int, default=25)
+    disk.add_argument("--bitrate", type=int, default=10000000)
+    disk.add_argument("--no-pace", dest="pace", action="store_false", help="write flat out instead of in real time")
+
+    motion = sub.add_parser("motion", help="parking-mode motion analysis time per lores frame")
+    motion.add_argument("--frames", type=int, default=1000)
+    motion.add_argument("--sensitivity", type=int, default=5)
+
+    wifi = sub.add_parser("wifi", help="wpa_supplicant event to presence refresh latency")
+    wifi.add_argument("--events", type=int, default=50)
+
+    bus = sub.add_parser("bus", help="shared-memory lores publish time with and without subscribers")
+    bus.add_argument("--frames", type=int, default=250)
+    bus.add_argument("--subscribers", type=int, default=4)
+    bus.add_argument("--fps", type=int, default=25)
+
+    args = parser.parse_args()
+    use_backend(args.backend)
+    if args.benchmark == "serial":
+        asyncio.run(bench_serial(args))
+    elif args.benchmark == "download":
+        asyncio.run(bench_download(args))
+    elif args.benchmark == "rotation":
+        bench_rotation(args)
+    elif args.benchmark == "remux":
+        bench_remux(args)
+    elif args.benchmark == "health":
+        bench_health(args)
+    elif args.benchmark == "control":
+        bench_control(args)
+    elif args.benchmark == "disk":
+        bench_disk(args)
+    elif args.benchmark == "motion":
+        bench_motion(args)
+    elif args.benchmark == "wifi":
+        bench_wifi(args)
+    elif args.benchmark == "bus":
+        bench_bus(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
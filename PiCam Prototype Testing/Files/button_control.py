@@ -1,57 +1,172 @@
 import time
+import queue
 import subprocess
 import os
 import signal
-from gpiozero import Button
+import threading
+from hardware import Button, Buzzer
 import sys
+from control_script import control_request
+from segment_catalog import CATALOG_NAME
+from settings import VIDEO_DIR
 
 # Configuration
 BUTTON_PIN = 24
+BUZZER_PIN = 11  # shared with serial_server's health check, so it is only claimed while beeping
 REBOOT_HOLD = 3  # seconds
 DELETE_HOLD = 10  # seconds
-PRESS_TIMEOUT = 2  # seconds between presses
+PRESS_TIMEOUT = 1  # seconds after the last release before a click count is acted on
+WIPE_PAUSE = 600  # seconds the recorder stays paused if this script dies mid-wipe
+PAUSE_READY_WAIT = 5  # seconds to wait for the recorder to close and catalogue its last segment
+WIPE_PROGRESS_EVERY = 250  # files between progress reports
+
+# Buzzer patterns, seconds on for each beep
+BEEP_ACK = (0.05,)
+BEEP_ARMED = (0.2,)
+BEEP_DONE = (0.4,)
+BEEP_CANCELLED = (0.05, 0.05, 0.05)
+BEEP_ERROR = (1.0,)
 
 # Global state
-press_count = 0
-last_press_time = 0
-press_start_time = 0
 running = True
+events = queue.Queue()  # ("press" | "release", monotonic time) from the gpiozero threads
+actions = queue.Queue()  # (name, function) run one at a time by the executor
+queued = set()
+current_action = None
+wipe_cancel = threading.Event()
+beep_lock = threading.Lock()
 
-# Set up button
-button = Button(BUTTON_PIN)
+def beep(pattern):
+    # Own thread so feedback never delays the state machine or an action
+    def play():
+        with beep_lock:
+            buzzer = None
+            try:
+                buzzer = Buzzer(BUZZER_PIN)
+                for duration in pattern:
+                    buzzer.on()
+                    time.sleep(duration)
+                    buzzer.off()
+                    time.sleep(0.1)
+            except Exception as e:
+                print(f"Buzzer error: {str(e)}")
+            finally:
+                if buzzer is not None:
+                    buzzer.close()
+    threading.Thread(target=play, daemon=True).start()
 
 def button_pressed():
-    global press_start_time
-    press_start_time = time.time()
+    events.put(("press", time.monotonic()))
 
 def button_released():
-    global press_count, last_press_time
-    duration = time.time() - press_start_time
-    current_time = time.time()
-    
-    # Check hold actions first
-    if duration >= DELETE_HOLD:
-        delete_video_files()
-        return
-    elif duration >= REBOOT_HOLD:
-        reboot_pi()
+    events.put(("release", time.monotonic()))
+
+def submit(name, function):
+    # A second request for an action that is already waiting or running is dropped
+    if name in queued or name == current_action:
+        print(f"{name} already queued")
         return
-    
-    # Handle press count
-    if current_time - last_press_time < PRESS_TIMEOUT:
-        press_count += 1
-    else:
-        press_count = 1
-    
-    last_press_time = current_time
-    
-    print(f"Button pressed {press_count} times")
-    
-    if press_count == 3:
-        toggle_hotspot()
-        press_count = 0
-    elif press_count >= 5:
-        shutdown_script()
+    queued.add(name)
+    actions.put((name, function))
+    beep(BEEP_ACK)
+
+def run_actions():
+    global current_action
+    while True:
+        name, function = actions.get()
+        queued.discard(name)
+        current_action = name
+        try:
+            function()
+        except Exception as e:
+            print(f"{name} failed: {str(e)}")
+            beep(BEEP_ERROR)
+        finally:
+            current_action = None
+
+class ButtonStateMachine:
+    # idle -> pressed -> (released) counting -> idle once PRESS_TIMEOUT passes without another press.
+    # Holds are resolved on release; a beep marks each hold threshold as it is crossed.
+    def __init__(self):
+        self.state = "idle"
+        self.pressed_at = None
+        self.released_at = None
+        self.clicks = 0
+        self.armed = 0  # hold thresholds crossed during the current press
+
+    def deadline(self):
+        if self.state == "pressed" and self.armed < 2:
+            return self.pressed_at + (REBOOT_HOLD if self.armed == 0 else DELETE_HOLD)
+        if self.state == "counting":
+            return self.released_at + PRESS_TIMEOUT
+        return None
+
+    def run(self):
+        while running:
+            deadline = self.deadline()
+            timeout = 0.5 if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                kind, at = events.get(timeout=timeout)
+            except queue.Empty:
+                self.on_timeout()
+                continue
+            if kind == "press":
+                self.on_press(at)
+            elif self.state == "pressed":
+                self.on_release(at)
+            elif self.state == "cancelling":
+                self.reset()
+
+    def on_press(self, at):
+        if current_action == "wipe" and not wipe_cancel.is_set():
+            # Any press stops a wipe in progress; it does not count as a click
+            print("Cancelling delete...")
+            wipe_cancel.set()
+            self.state = "cancelling"
+            return
+        self.state = "pressed"
+        self.pressed_at = at
+        self.armed = 0
+
+    def on_release(self, at):
+        duration = at - self.pressed_at
+        if duration >= DELETE_HOLD:
+            self.reset()
+            submit("wipe", delete_video_files)
+        elif duration >= REBOOT_HOLD:
+            self.reset()
+            submit("reboot", reboot_pi)
+        else:
+            self.clicks += 1
+            self.released_at = at
+            self.state = "counting"
+
+    def on_timeout(self):
+        if self.state == "pressed" and self.armed < 2:
+            # Each threshold beeps once; past DELETE_HOLD this just waits for the release
+            self.armed += 1
+            print("Release to " + ("reboot" if self.armed == 1 else "delete all video files"))
+            beep(BEEP_ARMED * self.armed)
+        elif self.state == "counting":
+            clicks = self.clicks
+            self.reset()
+            print(f"Button pressed {clicks} times")
+            if clicks == 1:
+                submit("event", save_event_clip)
+            elif clicks == 3:
+                submit("hotspot", toggle_hotspot)
+            elif clicks >= 5:
+                shutdown_script()
+
+    def reset(self):
+        self.state = "idle"
+        self.clicks = 0
+        self.armed = 0
+
+def save_event_clip():
+    print("Saving event clip...")
+    response = control_request("event")  # failures are reported by run_actions
+    print(f"Event clip: {response.get('file')}")
 
 def toggle_hotspot():
     print("Toggling hotspot...")
@@ -65,17 +180,80 @@ def toggle_hotspot():
         print(result.stdout)
     except subprocess.CalledProcessError as e:
         print(f"Hotspot error: {e.stderr}")
+        beep(BEEP_ERROR)
+
+def wipe_directory(path, cancel, report=print):
+    # Unlinks relative to an open directory fd, so each file costs one syscall and no path lookup.
+    # Checked for cancellation between files; returns (deleted, failed, cancelled).
+    deleted = failed = 0
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        with os.scandir(fd) as entries:
+            names = [(entry.name, entry.is_dir(follow_symlinks=False)) for entry in entries
+                     if not entry.name.startswith(CATALOG_NAME)]
+        total = len(names)
+        for number, (name, is_dir) in enumerate(names, 1):
+            if cancel.is_set():
+                return deleted, failed, True
+            if is_dir:
+                sub_deleted, sub_failed, cancelled = wipe_directory(os.path.join(path, name), cancel, lambda line: None)
+                deleted += sub_deleted
+                failed += sub_failed
+                if cancelled:
+                    return deleted, failed, True
+            else:
+                try:
+                    os.unlink(name, dir_fd=fd)
+                    deleted += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    failed += 1
+                    if failed == 1:
+                        report(f"Delete error: {name}: {str(e)}")
+            if number % WIPE_PROGRESS_EVERY == 0:
+                report(f"Deleted {number}/{total} entries ({number * 100 // total}%)")
+    finally:
+        os.close(fd)
+    return deleted, failed, False
 
 def delete_video_files():
     print("Deleting video files...")
+    wipe_cancel.clear()
+    start = time.monotonic()
+    # The recorder stops writing into VIDEO_DIR and resyncs its catalog when resumed
     try:
-        subprocess.run(
-            ["sudo", "rm", "-rf", "/home/picam/videos/*"],
-            check=True
-        )
-        print("All video files deleted")
-    except subprocess.CalledProcessError as e:
-        print(f"Delete error: {str(e)}")
+        control_request(f"pause {WIPE_PAUSE}")
+        paused = True
+    except (OSError, RuntimeError) as e:
+        print(f"Recorder not paused: {str(e)}")
+        paused = False
+    deadline = time.monotonic() + PAUSE_READY_WAIT
+    while paused and time.monotonic() < deadline:
+        try:
+            if control_request("status").get("pause_ready"):
+                break
+        except (OSError, RuntimeError):
+            break
+        time.sleep(0.1)
+    try:
+        deleted, failed, cancelled = wipe_directory(VIDEO_DIR, wipe_cancel)
+    finally:
+        if paused:
+            try:
+                control_request("resume")
+            except (OSError, RuntimeError) as e:
+                print(f"Resume failed, recorder resumes after {WIPE_PAUSE} s: {str(e)}")
+    elapsed = time.monotonic() - start
+    if cancelled:
+        print(f"Delete cancelled after {deleted} files in {elapsed:.1f} s")
+        beep(BEEP_CANCELLED)
+    elif failed:
+        print(f"Deleted {deleted} files in {elapsed:.1f} s, {failed} could not be deleted")
+        beep(BEEP_ERROR)
+    else:
+        print(f"All video files deleted ({deleted} files in {elapsed:.1f} s)")
+        beep(BEEP_DONE)
 
 def reboot_pi():
     print("Rebooting system...")
@@ -83,6 +261,7 @@ def reboot_pi():
         subprocess.run(["sudo", "reboot"], check=True)
     except subprocess.CalledProcessError as e:
         print(f"Reboot failed: {str(e)}")
+        beep(BEEP_ERROR)
 
 def shutdown_script():
     global running
@@ -98,18 +277,21 @@ def shutdown_script():
         running = False
         sys.exit(0)
 
-# Configure button events
-button.when_pressed = button_pressed
-button.when_released = button_released
+if __name__ == "__main__":
+    # Set up button; the callbacks only queue the edge, everything else happens off the GPIO thread
+    button = Button(BUTTON_PIN)
+    button.when_pressed = button_pressed
+    button.when_released = button_released
+    threading.Thread(target=run_actions, name="button-actions", daemon=True).start()
 
-print("Button control system ready:")
-print("- Triple click: Toggle hotspot")
-print("- 5 clicks: Full shutdown")
-print("- Hold 3s: Reboot")
-print("- Hold 10s: Delete files")
+    print("Button control system ready:")
+    print("- Single click: Save event clip")
+    print("- Triple click: Toggle hotspot")
+    print("- 5 clicks: Full shutdown")
+    print("- Hold 3s: Reboot")
+    print("- Hold 10s: Delete files (press again to cancel)")
 
-try:
-    while running:
-        time.sleep(0.1)
-except KeyboardInterrupt:
-    shutdown_script()
+    try:
+        ButtonStateMachine().run()
+    except KeyboardInterrupt:
+        shutdown_script()
@@ -0,0 +1,176 @@
+import os
+import json
+import asyncio
+import logging
+from email.utils import formatdate
+
+CLIP_PORT = 8080
+MAX_TRANSFERS = 2  # concurrent downloads, kept low so SD reads never starve the recorder's writes
+TRANSFER_WAIT = 2  # seconds a request waits for a free slot before getting 503
+MAX_HEADER = 8192
+IDLE_TIMEOUT = 30
+CLIP_PREFIXES = ("Recording_", "Event_")
+THUMB_DIR_NAME = ".thumbs"
+THUMB_TYPES = {".jpg": "image/jpeg", ".json": "application/json"}
+
+STATUS_TEXT = {200: "OK", 206: "Partial Content", 304: "Not Modified", 400: "Bad Request",
+               404: "Not Found", 405: "Method Not Allowed", 416: "Range Not Satisfiable",
+               503: "Service Unavailable"}
+
+def is_clip_name(name):
+    return name.startswith(CLIP_PREFIXES) and name.endswith(".mp4") and os.path.basename(name) == name
+
+def is_thumb_name(name):
+    return (name.startswith(CLIP_PREFIXES) and os.path.splitext(name)[1] in THUMB_TYPES
+            and os.path.basename(name) == name)
+
+def parse_range(header, size):
+    # Single "bytes=" ranges only; returns (start, end inclusive), None for no range, or False if unsatisfiable
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            length = int(last)
+            if length <= 0:
+                return False
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+class ClipServer:
+    # Minimal HTTP/1.1 server for listing and downloading clips from VIDEO_DIR with
+    # Range/If-Range so interrupted hotspot downloads can resume where they stopped
+    def __init__(self, video_dir, max_transfers=MAX_TRANSFERS):
+        self.video_dir = video_dir
+        self.transfers = asyncio.Semaphore(max_transfers)
+        self.bytes_sent = 0
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ")
+                except ValueError:
+                    await self.respond(writer, 400, close=True)
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        key, _, value = line.partition(":")
+                        headers[key.strip().lower()] = value.strip()
+                close = headers.get("connection", "").lower() == "close" or version == "HTTP/1.0"
+                await self.route(writer, method, target, headers, close)
+                if close:
+                    return
+        except (ConnectionError, asyncio.LimitOverrunError) as e:
+            logging.info(f"Clip connection ended: {type(e).__name__}")
+        finally:
+            writer.close()
+
+    async def route(self, writer, method, target, headers, close):
+        if method not in ("GET", "HEAD"):
+            await self.respond(writer, 405, close=close)
+            return
+        path = target.split("?", 1)[0]
+        if path in ("/clips", "/clips/"):
+            await self.respond(writer, 200, self.listing(), "application/json", close=close, head=method == "HEAD")
+        elif path.startswith("/clips/") and is_clip_name(path[len("/clips/"):]):
+            await self.send_file(writer, os.path.join(self.video_dir, path[len("/clips/"):]), "video/mp4",
+                                 headers, close, method == "HEAD")
+        elif path.startswith("/thumbs/") and is_thumb_name(path[len("/thumbs/"):]):
+            # Per-segment thumbnails and <segment>.json keyframe/thumbnail indexes for the gallery
+            name = path[len("/thumbs/"):]
+            await self.send_file(writer, os.path.join(self.video_dir, THUMB_DIR_NAME, name),
+                                 THUMB_TYPES[os.path.splitext(name)[1]], headers, close, method == "HEAD", capped=False)
+        else:
+            await self.respond(writer, 404, close=close)
+
+    def listing(self):
+        clips = []
+        for entry in os.scandir(self.video_dir):
+            if is_clip_name(entry.name):
+                st = entry.stat()
+                clips.append({"name": entry.name, "size": st.st_size, "mtime": int(st.st_mtime)})
+        clips.sort(key=lambda clip: clip["mtime"])
+        return json.dumps(clips).encode()
+
+    async def send_file(self, writer, path, content_type, headers, close, head, capped=True):
+        # Thumbnails are tiny, so only clip downloads count against the transfer cap
+        try:
+            f = open(path, "rb")
+        except OSError:
+            await self.respond(writer, 404, close=close)
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            etag = f'"{st.st_size:x}-{int(st.st_mtime):x}"'
+            byte_range = parse_range(headers.get("range"), size)
+            if byte_range and headers.get("if-range") not in (None, etag):
+                byte_range = None  # the clip changed since the partial download started; send it whole
+            if byte_range is False:
+                await self.respond(writer, 416, extra={"Content-Range": f"bytes */{size}"}, close=close)
+                return
+            start, end = byte_range or (0, size - 1)
+            extra = {"Accept-Ranges": "bytes", "ETag": etag,
+                     "Last-Modified": formatdate(st.st_mtime, usegmt=True)}
+            status = 200
+            if byte_range:
+                status = 206
+                extra["Content-Range"] = f"bytes {start}-{end}/{size}"
+            count = max(0, end - start + 1)
+            if head:
+                await self.respond(writer, status, length=count, extra=extra, close=close, head=True)
+                return
+            if capped:
+                try:
+                    await asyncio.wait_for(self.transfers.acquire(), TRANSFER_WAIT)
+                except asyncio.TimeoutError:
+                    await self.respond(writer, 503, extra={"Retry-After": "5"}, close=close)
+                    return
+            try:
+                writer.write(self.header(status, count, content_type, extra, close))
+                await writer.drain()
+                # loop.sendfile hands the socket to os.sendfile, so clip data never passes through Python.
+                # It rejects a zero count, which an empty clip (a segment that never got a frame) gives.
+                if count:
+                    await asyncio.get_running_loop().sendfile(writer.transport, f, start, count)
+                    self.bytes_sent += count
+            finally:
+                if capped:
+                    self.transfers.release()
+
+    def header(self, status, length, content_type, extra, close):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}",
+                 f"Content-Length: {length}",
+                 f"Content-Type: {content_type}",
+                 f"Connection: {'close' if close else 'keep-alive'}"]
+        lines += [f"{key}: {value}" for key, value in (extra or {}).items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def respond(self, writer, status, body=b"", content_type="text/plain", extra=None, close=False,
+                      head=False, length=None):
+        writer.write(self.header(status, len(body) if length is None else length, content_type, extra, close))
+        if not head:
+            writer.write(body)
+        await writer.drain()
+
+async def start_clip_server(video_dir, host, port=CLIP_PORT, max_transfers=MAX_TRANSFERS):
+    clips = ClipServer(video_dir, max_transfers)
+    server = await asyncio.start_server(clips.handle, host, port, limit=MAX_HEADER, reuse_address=True)
+    logging.info(f"Clip server started on {host}:{port}")
+    return server
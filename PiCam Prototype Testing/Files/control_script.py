@@ -1,26 +1,56 @@
 #!/usr/bin/env python3
-import os
-import signal
+import sys
+import json
+import socket
 
-COMMAND_PIPE = "/tmp/camera_commands"
-PID_FILE = "/tmp/recording_script.pid"
+CONTROL_SOCKET = "/tmp/picam_control.sock"
 
-def send_stop_command():
+def control_request(command, timeout=5):
+    # For other scripts and daemons: prints nothing, returns the reply dict or raises.
+    # OSError (FileNotFoundError/ConnectionRefusedError when no recorder is running) if it cannot
+    # be reached, RuntimeError with the recorder's message if the command failed.
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(CONTROL_SOCKET)
+        sock.sendall(f"{command}\n".encode())
+        reply = b""
+        while not reply.endswith(b"\n"):
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            reply += chunk
+    try:
+        response = json.loads(reply)
+    except ValueError:
+        raise OSError("No reply from recorder")
+    if not response.get("ok"):
+        raise RuntimeError(response.get("error") or "command failed")
+    return response
+
+def send_command(command, timeout=5):
+    # Command-line use: returns the recorder's JSON reply as a dict, or None if it could not be reached
     try:
-        # Send stop command
-        with open(COMMAND_PIPE, 'w') as pipe:
-            pipe.write("stop\n")
-        
-        # Send signal to trigger immediate processing
-        if os.path.exists(PID_FILE):
-            with open(PID_FILE, 'r') as f:
-                pid = int(f.read().strip())
-            os.kill(pid, signal.SIGUSR1)
-            print("UNE005 Stop command sent successfully")
+        try:
+            response = control_request(command, timeout)
+        except RuntimeError as e:
+            response = {"ok": False, "error": str(e)}
+        if response.get("ok"):
+            print(f"UNE005 {command.split(' ')[0].capitalize()} command sent successfully")
         else:
-            print("UNE002 Error: No running instance found")
+            print(f"UNE003 Error sending command: {response.get('error')}")
+        return response
+    except (FileNotFoundError, ConnectionRefusedError):
+        print("UNE002 Error: No running instance found")
+        return None
     except Exception as e:
         print(f"UNE003 Error sending command: {str(e)}")
+        return None
+
+def send_stop_command():
+    return send_command("stop")
 
 if __name__ == "__main__":
-    send_stop_command()
+    response = send_command(" ".join(sys.argv[1:]) or "stop")
+    if response is not None:
+        print(json.dumps(response))
+    sys.exit(0 if response and response.get("ok") else 1)
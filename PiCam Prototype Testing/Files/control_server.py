@@ -0,0 +1,102 @@
+import os
+import json
+import socket
+import logging
+import selectors
+
+CONTROL_SOCKET = "/tmp/picam_control.sock"
+MAX_REQUEST = 4096
+
+class ControlServer:
+    # Non-blocking Unix socket control plane. The recorder loop calls poll(), which only
+    # handles sockets that are ready, so a stuck or slow client can never stall recording.
+    # Requests are one command per line; each gets one JSON line back.
+    def __init__(self, handlers, path=CONTROL_SOCKET, selector=None):
+        self.handlers = handlers
+        self.path = path
+        # Sharing the recorder scheduler's selector lets one select() call wait on both
+        self.owns_selector = selector is None
+        self.selector = selector or selectors.DefaultSelector()
+        if os.path.exists(path):
+            os.remove(path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        os.chmod(path, 0o660)
+        self.listener.listen(8)
+        self.listener.setblocking(False)
+        self.selector.register(self.listener, selectors.EVENT_READ, self._accept)
+        self.buffers = {}  # connection -> [pending input, pending output]
+
+    def poll(self, timeout=0):
+        for key, mask in self.selector.select(timeout):
+            key.data(key.fileobj, mask)
+
+    def _accept(self, listener, mask):
+        try:
+            conn, _ = listener.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        self.buffers[conn] = [b"", b""]
+        self.selector.register(conn, selectors.EVENT_READ, self._service)
+
+    def _service(self, conn, mask):
+        buffers = self.buffers[conn]
+        if mask & selectors.EVENT_READ:
+            try:
+                data = conn.recv(MAX_REQUEST)
+            except (BlockingIOError, InterruptedError):
+                data = None
+            except OSError:
+                data = b""
+            if data == b"":
+                self._close(conn)
+                return
+            if data:
+                buffers[0] += data
+                while b"\n" in buffers[0]:
+                    line, _, buffers[0] = buffers[0].partition(b"\n")
+                    buffers[1] += (json.dumps(self.dispatch(line.decode(errors="replace").strip())) + "\n").encode()
+                if len(buffers[0]) > MAX_REQUEST:
+                    self._close(conn)
+                    return
+        if buffers[1]:
+            try:
+                sent = conn.send(buffers[1])
+                buffers[1] = buffers[1][sent:]
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                self._close(conn)
+                return
+        # Only watch for writability while a reply is still queued
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if buffers[1] else 0)
+        self.selector.modify(conn, events, self._service)
+
+    def dispatch(self, request):
+        name, _, args = request.partition(" ")
+        handler = self.handlers.get(name)
+        if handler is None:
+            return {"ok": False, "error": f"Unknown command: {name}"}
+        logging.info(f"Control command: {request}")
+        try:
+            result = handler(args.strip())
+            return {"ok": True, **(result or {})}
+        except Exception as e:
+            logging.error(f"CTL001: Control command {name} failed: {str(e)}")
+            return {"ok": False, "error": str(e)}
+
+    def _close(self, conn):
+        self.selector.unregister(conn)
+        self.buffers.pop(conn, None)
+        conn.close()
+
+    def close(self):
+        for conn in list(self.buffers):
+            self._close(conn)
+        self.selector.unregister(self.listener)
+        self.listener.close()
+        if self.owns_selector:
+            self.selector.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
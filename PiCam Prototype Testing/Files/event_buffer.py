@@ -0,0 +1,159 @@
+import os
+import queue
+import datetime
+import threading
+import collections
+import logging
+from hardware import Output
+from fmp4_muxer import FragmentedMP4Writer
+from segment_writer import unique_path
+
+EVENT_BUFFER_BYTES = 24 * 1024 * 1024  # ~20 s of 1080p25 at 10 Mbps, small next to the Pi Zero's 512 MB
+MAX_EVENT_SECONDS = 120  # repeated triggers extend a clip up to this length, then the next one starts a new clip
+
+class EventClip:
+    # Writes one event clip on its own thread so flushing the pre-event buffer never stalls the encoder.
+    # Frames waiting for the card are bounded by max_bytes; a clip that overflows it is dropped.
+    def __init__(self, path, size, frames, end_timestamp, max_bytes, on_saved=None):
+        self.path = path
+        self.on_saved = on_saved
+        self.start_timestamp = frames[0][2] if frames else end_timestamp
+        self.end_timestamp = end_timestamp
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.queued_bytes = 0
+        self.dropped = False
+        self.frame_count = 0
+        for frame in frames:
+            self.put(frame)
+        self.thread = threading.Thread(target=self._run, args=(size,), name="event-clip", daemon=True)
+        self.thread.start()
+
+    def put(self, frame):
+        # Returns False once the card has fallen max_bytes behind, after discarding what was queued
+        with self.lock:
+            if self.queued_bytes + len(frame[0]) > self.max_bytes:
+                self.dropped = True
+                while True:
+                    try:
+                        self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                self.queued_bytes = 0
+                return False
+            self.queued_bytes += len(frame[0])
+        self.queue.put(frame)
+        return True
+
+    def finish(self):
+        self.queue.put(None)
+
+    def _run(self, size):
+        try:
+            with open(self.path, 'wb') as f:
+                muxer = FragmentedMP4Writer(f, *size)
+                while True:
+                    item = self.queue.get()
+                    if item is None or self.dropped:
+                        break
+                    with self.lock:
+                        self.queued_bytes -= len(item[0])
+                    muxer.write_frame(*item)
+                    self.frame_count += 1
+                if not self.dropped:
+                    muxer.close()
+                    os.fsync(f.fileno())
+            if self.dropped:
+                os.remove(self.path)
+                logging.error(f"EVT001: Event clip {self.path} dropped, the card fell more than "
+                              f"{self.max_bytes // (1024 * 1024)} MB behind")
+                return
+            logging.info(f"Saved event clip {self.path} ({self.frame_count} frames)")
+            if self.on_saved is not None:
+                self.on_saved(self.path)
+        except Exception as e:
+            logging.error(f"EVT001: Event clip failed: {str(e)}")
+
+class PreEventBuffer(Output):
+    # Keeps the last pre_seconds of encoded frames in RAM, bounded by max_bytes, and
+    # turns a trigger into a clip of that history plus the next post_seconds
+    def __init__(self, clip_dir, size, pre_seconds=10, post_seconds=20, max_bytes=EVENT_BUFFER_BYTES,
+                 on_saved=None, max_clip_seconds=MAX_EVENT_SECONDS):
+        super().__init__()
+        self.on_saved = on_saved
+        self.lock = threading.Lock()
+        self.clip_dir = clip_dir
+        self.size = size
+        self.pre_us = pre_seconds * 1000000
+        self.post_us = post_seconds * 1000000
+        self.max_bytes = max_bytes
+        self.max_clip_us = max_clip_seconds * 1000000
+        self.frames = collections.deque()  # (frame, keyframe, timestamp)
+        self.bytes = 0
+        self.last_timestamp = None
+        self.clip = None
+        self.finished_clips = []
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        if timestamp is None:
+            return
+        item = (bytes(frame), keyframe, timestamp)
+        with self.lock:
+            self.frames.append(item)
+            self.bytes += len(item[0])
+            self.last_timestamp = timestamp
+            self._trim()
+            if self.clip is not None:
+                if not self.clip.put(item):
+                    self.clip.finish()
+                    self.finished_clips.append(self.clip)
+                    self.clip = None
+                elif timestamp >= self.clip.end_timestamp:
+                    self.clip.finish()
+                    self.finished_clips.append(self.clip)
+                    self.clip = None
+
+    def _trim(self):
+        oldest_allowed = self.last_timestamp - self.pre_us
+        while self.frames and (self.bytes > self.max_bytes or self.frames[0][2] < oldest_allowed):
+            self._drop_oldest()
+        # A clip has to open on a keyframe, so anything before the first one is dead weight
+        while self.frames and not self.frames[0][1]:
+            self._drop_oldest()
+
+    def _drop_oldest(self):
+        frame, _, _ = self.frames.popleft()
+        self.bytes -= len(frame)
+
+    def trigger(self):
+        with self.lock:
+            if self.last_timestamp is None:
+                logging.warning("EVT002: Event trigger ignored, no frames buffered yet")
+                return None
+            end_timestamp = self.last_timestamp + self.post_us
+            if self.clip is not None:
+                # A trigger during an open clip extends it rather than starting an overlapping one
+                self.clip.end_timestamp = min(end_timestamp, self.clip.start_timestamp + self.max_clip_us)
+                return self.clip.path
+            self.finished_clips = [clip for clip in self.finished_clips if clip.thread.is_alive()]
+            stem = datetime.datetime.now().strftime("Event_%d-%m-%y_%H-%M-%S")
+            path = unique_path(self.clip_dir, stem, "mp4", [clip.path for clip in self.finished_clips])
+            self.clip = EventClip(path, self.size, list(self.frames), end_timestamp, self.max_bytes, self.on_saved)
+            logging.info(f"Event triggered, saving {path}")
+            return path
+
+    def stop(self):
+        super().stop()
+        with self.lock:
+            if self.clip is not None:
+                self.clip.finish()
+                self.finished_clips.append(self.clip)
+                self.clip = None
+            # Let clips still being written reach the card before the process exits
+            for clip in self.finished_clips:
+                clip.thread.join(10)
+            self.finished_clips = []
+            self.frames.clear()
+            self.bytes = 0
+            self.last_timestamp = None
@@ -0,0 +1,374 @@
+import os
+import time
+import logging
+import threading
+
+# Simulated camera, GPIO and firmware probes, selected with PICAM_BACKEND=fake (see hardware.py).
+# The camera produces a syntactically valid H.264 stream (real SPS/PPS, filler slices) at the
+# encoder's bitrate and the configured frame rate, so muxing, remuxing and rotation behave as on a Pi.
+FAKE_FPS = float(os.environ.get("PICAM_FAKE_FPS", 0))  # overrides the FrameRate control when set
+FAKE_BITRATE = int(os.environ.get("PICAM_FAKE_BITRATE", 0))  # overrides the encoder bitrate when set
+KEYFRAME_RATIO = 4  # IDR frames are this many times larger than P frames
+DEFAULT_FPS = 30
+DEFAULT_BITRATE = 10000000
+DEFAULT_IPERIOD = 30
+
+# Values the fake system probes report; benchmarks and experiments change them in place
+SYSTEM = {
+    "temp_c": float(os.environ.get("PICAM_FAKE_TEMP", 45.0)),
+    "throttled": int(os.environ.get("PICAM_FAKE_THROTTLED", "0"), 0),
+    "mem_percent": 30.0,
+    "motion": False  # a bright square moves across the lores frames while set
+}
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class BitWriter:
+    def __init__(self):
+        self.bits = []
+
+    def u(self, count, value):
+        self.bits += [(value >> shift) & 1 for shift in range(count - 1, -1, -1)]
+
+    def ue(self, value):
+        value += 1
+        self.u(2 * value.bit_length() - 1, value)
+
+    def se(self, value):
+        self.ue(2 * value - 1 if value > 0 else -2 * value)
+
+    def rbsp(self):
+        self.bits.append(1)
+        self.bits += [0] * (-len(self.bits) % 8)
+        data = bytes(int("".join(map(str, self.bits[i:i + 8])), 2) for i in range(0, len(self.bits), 8))
+        # Emulation prevention, in case a header happens to contain 00 00 0x
+        out = bytearray()
+        zeros = 0
+        for byte in data:
+            if zeros >= 2 and byte <= 3:
+                out.append(3)
+                zeros = 0
+            out.append(byte)
+            zeros = zeros + 1 if byte == 0 else 0
+        return bytes(out)
+
+def make_sps(width, height):
+    mbs_wide, mbs_high = (width + 15) // 16, (height + 15) // 16
+    bits = BitWriter()
+    bits.u(8, 100)  # High profile
+    bits.u(8, 0)
+    bits.u(8, 40)  # level 4.0
+    bits.ue(0)  # seq_parameter_set_id
+    bits.ue(1)  # 4:2:0
+    bits.ue(0)
+    bits.ue(0)
+    bits.u(1, 0)
+    bits.u(1, 0)  # no scaling matrices
+    bits.ue(4)  # log2_max_frame_num_minus4
+    bits.ue(2)  # pic_order_cnt_type 2, output order follows decode order
+    bits.ue(1)  # max_num_ref_frames
+    bits.u(1, 0)
+    bits.ue(mbs_wide - 1)
+    bits.ue(mbs_high - 1)
+    bits.u(1, 1)  # frame_mbs_only
+    bits.u(1, 1)  # direct_8x8_inference
+    crop_right, crop_bottom = (mbs_wide * 16 - width) // 2, (mbs_high * 16 - height) // 2
+    bits.u(1, int(bool(crop_right or crop_bottom)))
+    if crop_right or crop_bottom:
+        bits.ue(0)
+        bits.ue(crop_right)
+        bits.ue(0)
+        bits.ue(crop_bottom)
+    bits.u(1, 0)  # no VUI
+    return b"\x00\x00\x00\x01\x67" + bits.rbsp()
+
+def make_pps():
+    bits = BitWriter()
+    bits.ue(0)
+    bits.ue(0)
+    bits.u(1, 0)  # CAVLC
+    bits.u(1, 0)
+    bits.ue(0)
+    bits.ue(0)
+    bits.ue(0)
+    bits.u(1, 0)
+    bits.u(2, 0)
+    bits.se(0)
+    bits.se(0)
+    bits.se(0)
+    bits.u(1, 1)
+    bits.u(1, 0)
+    bits.u(1, 0)
+    return b"\x00\x00\x00\x01\x68" + bits.rbsp()
+
+def make_filler(size):
+    # Random bytes with no zeros can never contain a start code
+    return os.urandom(size).replace(b"\x00", b"\x01")
+
+class Output:
+    # Same contract as picamera2.outputs.Output
+    def __init__(self, pts=None):
+        self.recording = False
+        self.ptsoutput = pts
+
+    def start(self):
+        self.recording = True
+
+    def stop(self):
+        self.recording = False
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        pass
+
+class H264Encoder:
+    def __init__(self, bitrate=None, repeat=False, iperiod=None, framerate=None, qp=None, **kwargs):
+        self.bitrate = FAKE_BITRATE or bitrate or DEFAULT_BITRATE
+        self.repeat = repeat
+        self.iperiod = iperiod or DEFAULT_IPERIOD
+        self.output = []
+        self.frame_index = 0
+        self.headers = None
+        self.filler = b""
+        self.filler_pos = 0
+        self.frames_encoded = 0
+
+    def _start(self, size, fps):
+        self.headers = make_sps(*size) + make_pps()
+        average = self.bitrate / 8 / fps
+        self.p_size = max(16, int(self.iperiod * average / (KEYFRAME_RATIO + self.iperiod - 1)))
+        self.i_size = self.p_size * KEYFRAME_RATIO
+        self.filler = make_filler(self.i_size * 4)
+        self.frame_index = 0
+        for output in self.output:
+            output.start()
+
+    def _stop(self):
+        for output in self.output:
+            output.stop()
+
+    def _payload(self, size):
+        if self.filler_pos + size > len(self.filler):
+            self.filler_pos = 0
+        self.filler_pos += size
+        return self.filler[self.filler_pos - size:self.filler_pos]
+
+    def encode(self, timestamp_us):
+        keyframe = self.frame_index % self.iperiod == 0
+        self.frame_index += 1
+        if keyframe:
+            frame = (self.headers if self.repeat or self.frames_encoded == 0 else b"") + \
+                b"\x00\x00\x00\x01\x65\x88" + self._payload(self.i_size)
+        else:
+            frame = b"\x00\x00\x00\x01\x41\x9a" + self._payload(self.p_size)
+        self.frames_encoded += 1
+        for output in self.output:
+            output.outputframe(frame, keyframe, timestamp_us)
+
+class CompletedRequest:
+    def __init__(self, camera, timestamp_ns):
+        self.camera = camera
+        self.timestamp_ns = timestamp_ns
+
+    def make_array(self, name):
+        if numpy is None:
+            raise RuntimeError("numpy is needed for fake lores frames")
+        width, height = self.camera.config[name]["size"]
+        if name == "lores":
+            frame = numpy.full((height * 3 // 2, width), 128, dtype=numpy.uint8)
+            if SYSTEM["motion"]:
+                x = (self.timestamp_ns // 20000000) % max(1, width - height // 4)
+                frame[height // 4:height // 2, x:x + height // 4] = 250
+            return frame
+        return numpy.full((height, width, 3), 128, dtype=numpy.uint8)
+
+    def get_metadata(self):
+        return {"SensorTimestamp": self.timestamp_ns, "FrameDuration": int(1000000 / self.camera.fps)}
+
+    def save(self, name, path):
+        width, height = self.camera.config[name]["size"]
+        try:
+            import simplejpeg
+            data = simplejpeg.encode_jpeg(numpy.full((height, width, 3), 128, dtype=numpy.uint8))
+        except Exception:
+            data = b"\xff\xd8\xff\xd9"  # empty JPEG when simplejpeg or numpy are missing
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def release(self):
+        pass
+
+class MappedArray:
+    # picamera2.MappedArray stand-in; the real one maps the request's buffer without copying
+    def __init__(self, request, stream, write=False):
+        self.request = request
+        self.stream = stream
+
+    def __enter__(self):
+        self.array = self.request.make_array(self.stream)
+        return self
+
+    def __exit__(self, *exc):
+        self.array = None
+
+class Picamera2:
+    # Delivers frames on a background thread at the configured rate, calling post_callback and
+    # then the running encoder, the way picamera2's camera and encoder threads do on a Pi
+    def __init__(self, camera_num=0):
+        self.config = {"main": {"size": (1920, 1080)}, "lores": {"size": (320, 240)}}
+        self.fps = FAKE_FPS or DEFAULT_FPS
+        self.post_callback = None
+        self.encoder = None
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.frames = 0
+        self.dropped = 0
+        self.callback_failed = False
+
+    def create_video_configuration(self, main=None, lores=None, controls=None, **kwargs):
+        config = {"main": dict(main or {"size": (1920, 1080)}), "controls": dict(controls or {})}
+        if lores:
+            config["lores"] = dict(lores)
+        return config
+
+    def create_still_configuration(self, main=None, **kwargs):
+        return {"main": dict(main or {"size": (1920, 1080)}), "controls": {}}
+
+    def configure(self, config):
+        self.config = config
+        self.fps = FAKE_FPS or config.get("controls", {}).get("FrameRate", DEFAULT_FPS)
+
+    def start(self):
+        if self.thread is None:
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name="fake-camera", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_encoder()
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        self.stop()
+
+    def start_encoder(self, encoder=None, output=None, pts=None, quality=None, name="main"):
+        with self.lock:
+            encoder.output = output if isinstance(output, list) else [output]
+            encoder._start(self.config["main"]["size"], self.fps)
+            self.encoder = encoder
+
+    def stop_encoder(self, encoders=None):
+        with self.lock:
+            encoder, self.encoder = self.encoder, None
+        if encoder is not None:
+            encoder._stop()
+
+    def capture_request(self):
+        return CompletedRequest(self, time.monotonic_ns())
+
+    def capture_file(self, path, name="main", **kwargs):
+        self.capture_request().save(name, path)
+
+    def _run(self):
+        interval = 1 / self.fps
+        next_frame = time.monotonic()
+        while not self.stop_event.wait(max(0.0, next_frame - time.monotonic())):
+            now = time.monotonic()
+            if now - next_frame > interval:
+                # Fell behind (a slow consumer or writer); skip frames like a real sensor would
+                missed = int((now - next_frame) / interval)
+                self.dropped += missed
+                next_frame += missed * interval
+            timestamp_ns = int(next_frame * 1e9)
+            next_frame += interval
+            self.frames += 1
+            try:
+                if self.post_callback is not None:
+                    self.post_callback(CompletedRequest(self, timestamp_ns))
+            except Exception as e:
+                # Logged once; a broken consumer should not stop the encoded stream
+                if not self.callback_failed:
+                    logging.error(f"Fake camera post_callback failed: {str(e)}")
+                    self.callback_failed = True
+            with self.lock:
+                if self.encoder is not None:
+                    self.encoder.encode(timestamp_ns // 1000)
+
+class Button:
+    # gpiozero.Button stand-in; press() and release() simulate the physical button
+    def __init__(self, pin=None, pull_up=True, bounce_time=None, hold_time=1, hold_repeat=False, **kwargs):
+        self.pin = pin
+        self.hold_time = hold_time
+        self.is_pressed = False
+        self.when_pressed = None
+        self.when_released = None
+        self.when_held = None
+        self.hold_timer = None
+
+    def press(self):
+        self.is_pressed = True
+        if self.when_held is not None:
+            self.hold_timer = threading.Timer(self.hold_time, self._held)
+            self.hold_timer.start()
+        if self.when_pressed is not None:
+            self.when_pressed()
+
+    def release(self):
+        self.is_pressed = False
+        if self.hold_timer is not None:
+            self.hold_timer.cancel()
+            self.hold_timer = None
+        if self.when_released is not None:
+            self.when_released()
+
+    def _held(self):
+        if self.is_pressed and self.when_held is not None:
+            self.when_held()
+
+    def close(self):
+        self.release()
+
+class Buzzer:
+    # gpiozero.Buzzer stand-in that records (monotonic time, state) instead of making noise
+    def __init__(self, pin=None, active_high=True, initial_value=False, **kwargs):
+        self.pin = pin
+        self.value = 0
+        self.events = []
+
+    def on(self):
+        self.value = 1
+        self.events.append((time.monotonic(), 1))
+
+    def off(self):
+        self.value = 0
+        self.events.append((time.monotonic(), 0))
+
+    def beep(self, on_time=1, off_time=1, n=None, background=True):
+        def run():
+            for _ in range(n or 1):
+                self.on()
+                time.sleep(on_time)
+                self.off()
+                time.sleep(off_time)
+        if background:
+            threading.Thread(target=run, daemon=True).start()
+        else:
+            run()
+
+    def close(self):
+        self.off()
+
+def read_throttled():
+    return SYSTEM["throttled"]
+
+def read_temperature():
+    return SYSTEM["temp_c"]
+
+def memory_percent():
+    return SYSTEM["mem_percent"]
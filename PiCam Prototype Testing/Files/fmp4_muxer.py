@@ -0,0 +1,130 @@
+import struct
+
+TIMESCALE = 90000
+MATRIX = struct.pack(">9I", 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+KEYFRAME_FLAGS = 0x02000000  # sample_depends_on=2 (does not depend on others)
+DELTA_FLAGS = 0x01010000  # sample_depends_on=1, sample_is_non_sync_sample=1
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+
+def box(kind, *payload):
+    data = b"".join(payload)
+    return struct.pack(">I4s", 8 + len(data), kind) + data
+
+def full_box(kind, version, flags, *payload):
+    return box(kind, struct.pack(">I", (version << 24) | flags), *payload)
+
+def split_nals(frame):
+    # Annex-B access unit -> list of NAL payloads without start codes
+    frame = bytes(frame)
+    nals = []
+    pos = frame.find(b"\x00\x00\x01")
+    while pos != -1:
+        start = pos + 3
+        pos = frame.find(b"\x00\x00\x01", start)
+        end = len(frame) if pos == -1 else pos
+        if pos != -1 and frame[end - 1] == 0:
+            end -= 1
+        if end > start:
+            nals.append(frame[start:end])
+    return nals
+
+class FragmentedMP4Writer:
+    # Writes H.264 access units straight into a fragmented MP4, one fragment per GOP,
+    # so everything up to the last complete fragment survives a power cut
+    def __init__(self, fileobj, width, height):
+        self.file = fileobj
+        self.width = width
+        self.height = height
+        self.sps = None
+        self.pps = None
+        self.sequence = 0
+        self.base_ts = None
+        self.samples = []  # (decode time, payload, keyframe)
+        self.last_duration = TIMESCALE // 25
+        self.fragment_offsets = []  # (decode time, byte offset of moof) for each keyframe
+
+    def write_frame(self, frame, keyframe, timestamp_us):
+        nals = split_nals(frame)
+        payload = []
+        for nal in nals:
+            nal_type = nal[0] & 0x1f
+            if nal_type == NAL_SPS:
+                self.sps = nal
+            elif nal_type == NAL_PPS:
+                self.pps = nal
+            elif nal_type != NAL_AUD:
+                payload.append(struct.pack(">I", len(nal)) + nal)
+        if self.base_ts is None:
+            if not keyframe or self.sps is None or self.pps is None:
+                return
+            self.base_ts = timestamp_us
+            self.file.write(self._init_segment())
+        dts = (timestamp_us - self.base_ts) * TIMESCALE // 1000000
+        if keyframe and self.samples:
+            self._flush_fragment(dts)
+        self.samples.append((dts, b"".join(payload), keyframe))
+
+    def close(self):
+        if self.samples:
+            self._flush_fragment(self.samples[-1][0] + self.last_duration)
+        self.file.flush()
+
+    def _flush_fragment(self, next_dts):
+        samples = self.samples
+        self.samples = []
+        entries = []
+        for i, (dts, payload, keyframe) in enumerate(samples):
+            end = samples[i + 1][0] if i + 1 < len(samples) else next_dts
+            duration = max(1, end - dts)
+            entries.append(struct.pack(">III", duration, len(payload), KEYFRAME_FLAGS if keyframe else DELTA_FLAGS))
+        self.last_duration = duration
+        self.sequence += 1
+        trun_size = 8 + 4 + 4 + 4 + 12 * len(entries)
+        moof_size = 8 + 16 + 8 + 16 + 20 + trun_size
+        traf = box(b"traf",
+                   full_box(b"tfhd", 0, 0x020000, struct.pack(">I", 1)),
+                   full_box(b"tfdt", 1, 0, struct.pack(">Q", samples[0][0])),
+                   full_box(b"trun", 0, 0x000701, struct.pack(">Ii", len(entries), moof_size + 8), *entries))
+        moof = box(b"moof", full_box(b"mfhd", 0, 0, struct.pack(">I", self.sequence)), traf)
+        mdat_size = 8 + sum(len(payload) for _, payload, _ in samples)
+        self.fragment_offsets.append((samples[0][0], self.file.tell()))
+        self.file.write(moof)
+        self.file.write(struct.pack(">I4s", mdat_size, b"mdat"))
+        for _, payload, _ in samples:
+            self.file.write(payload)
+        self.file.flush()
+
+    def _init_segment(self):
+        ftyp = box(b"ftyp", b"isom", struct.pack(">I", 0x200), b"isom", b"iso6", b"avc1", b"mp41")
+        mvhd = full_box(b"mvhd", 0, 0, struct.pack(">IIII", 0, 0, 1000, 0),
+                        struct.pack(">IH", 0x00010000, 0x0100), bytes(10), MATRIX, bytes(24),
+                        struct.pack(">I", 2))
+        tkhd = full_box(b"tkhd", 0, 3, struct.pack(">IIIII", 0, 0, 1, 0, 0), bytes(8),
+                        struct.pack(">HHHH", 0, 0, 0, 0), MATRIX,
+                        struct.pack(">II", self.width << 16, self.height << 16))
+        mdhd = full_box(b"mdhd", 0, 0, struct.pack(">IIIIHH", 0, 0, TIMESCALE, 0, 0x55c4, 0))
+        hdlr = full_box(b"hdlr", 0, 0, struct.pack(">I", 0), b"vide", bytes(12), b"VideoHandler\0")
+        dinf = box(b"dinf", full_box(b"dref", 0, 0, struct.pack(">I", 1), full_box(b"url ", 0, 1)))
+        stbl = box(b"stbl",
+                   full_box(b"stsd", 0, 0, struct.pack(">I", 1), self._avc1()),
+                   full_box(b"stts", 0, 0, struct.pack(">I", 0)),
+                   full_box(b"stsc", 0, 0, struct.pack(">I", 0)),
+                   full_box(b"stsz", 0, 0, struct.pack(">II", 0, 0)),
+                   full_box(b"stco", 0, 0, struct.pack(">I", 0)))
+        minf = box(b"minf", full_box(b"vmhd", 0, 1, bytes(8)), dinf, stbl)
+        trak = box(b"trak", tkhd, box(b"mdia", mdhd, hdlr, minf))
+        mvex = box(b"mvex", full_box(b"trex", 0, 0, struct.pack(">IIIII", 1, 1, 0, 0, 0)))
+        return ftyp + box(b"moov", mvhd, trak, mvex)
+
+    def _avc1(self):
+        profile = self.sps[1]
+        avcc = struct.pack(">BBBBBBH", 1, profile, self.sps[2], self.sps[3], 0xff, 0xe1, len(self.sps))
+        avcc += self.sps + struct.pack(">BH", 1, len(self.pps)) + self.pps
+        if profile in (100, 110, 122, 144):
+            avcc += bytes([0xfd, 0xf8, 0xf8, 0])  # 4:2:0, 8-bit luma/chroma, no SPS extensions
+        return box(b"avc1", bytes(6), struct.pack(">H", 1), bytes(16),
+                   struct.pack(">HHIII", self.width, self.height, 0x00480000, 0x00480000, 0),
+                   struct.pack(">H", 1), bytes(32), struct.pack(">Hh", 0x0018, -1),
+                   box(b"avcC", avcc))
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import struct
+import logging
+import argparse
+from multiprocessing import shared_memory, resource_tracker
+
+# The recorder owns the camera and publishes into two shared-memory rings under /dev/shm; any number
+# of processes read them. The publisher never waits for or even knows about subscribers, so the
+# recording path costs the same with none or ten: one copy per lores frame and one per packet.
+LORES_BUS = "picam_lores"
+PACKET_BUS = "picam_packets"
+LORES_SLOTS = 4
+PACKET_SLOTS = 256
+PACKET_DATA_BYTES = 8 * 1024 * 1024  # ~6 s at 10 Mbit/s, so a subscriber can start from the last IDR
+POLL_INTERVAL = 0.005
+
+HEADER = struct.Struct("<4sHHIIIQQ")  # magic, version, kind, slots, slot/data bytes, publisher pid, published, data total
+HEADER_BYTES = 64
+SLOT_HEADER = struct.Struct("<QQqIIII")  # seqlock, number, timestamp ns, width, height, stride, length
+SLOT_HEADER_BYTES = 64
+ENTRY = struct.Struct("<QQqQII")  # seqlock, number, timestamp, data offset (running total), length, keyframe
+ENTRY_BYTES = 48
+MAGIC = b"PCBS"
+VERSION = 1
+KIND_FRAMES = 1
+KIND_PACKETS = 2
+
+def attach(name):
+    # Subscribers must not let the resource tracker unlink the publisher's segment when they exit
+    shm = shared_memory.SharedMemory(name)
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+def as_bytes(data):
+    view = memoryview(data)
+    if not view.c_contiguous:
+        view = memoryview(view.tobytes())
+    return view.cast("B")
+
+class BusPublisher:
+    def __init__(self, name, kind, slots, slot_bytes, size):
+        try:
+            # Left behind by a recorder that did not shut down cleanly
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        self.buf = self.shm.buf
+        self.kind = kind
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.published = 0
+        self.data_total = 0
+        self._write_header()
+
+    def _write_header(self):
+        HEADER.pack_into(self.buf, 0, MAGIC, VERSION, self.kind, self.slots, self.slot_bytes, os.getpid(),
+                         self.published, self.data_total)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+class FramePublisher(BusPublisher):
+    # Ring of fixed slots, each guarded by a seqlock: odd while being written, bumped again when done
+    def __init__(self, name, slot_bytes, slots=LORES_SLOTS):
+        self.slot_size = SLOT_HEADER_BYTES + slot_bytes
+        super().__init__(name, KIND_FRAMES, slots, slot_bytes, HEADER_BYTES + slots * self.slot_size)
+        self.seqs = [0] * slots
+
+    def publish(self, data, width, height, stride, timestamp_ns):
+        data = as_bytes(data)
+        length = min(len(data), self.slot_bytes)
+        slot = self.published % self.slots
+        offset = HEADER_BYTES + slot * self.slot_size
+        seq = self.seqs[slot] + 1
+        SLOT_HEADER.pack_into(self.buf, offset, seq, self.published, timestamp_ns, width, height, stride, length)
+        self.buf[offset + SLOT_HEADER_BYTES:offset + SLOT_HEADER_BYTES + length] = data[:length]
+        self.seqs[slot] = seq + 1
+        struct.pack_into("<Q", self.buf, offset, seq + 1)
+        self.published += 1
+        self._write_header()
+
+class PacketPublisher(BusPublisher):
+    # Variable-size packets in a byte ring with a table of entries. A packet never straddles the end
+    # of the ring; a reader knows its bytes are intact while data_total - offset <= PACKET_DATA_BYTES.
+    def __init__(self, name, data_bytes=PACKET_DATA_BYTES, slots=PACKET_SLOTS):
+        self.data_start = HEADER_BYTES + slots * ENTRY_BYTES
+        super().__init__(name, KIND_PACKETS, slots, data_bytes, self.data_start + data_bytes)
+        self.seqs = [0] * slots
+        self.oversized = 0
+
+    def publish(self, packet, keyframe, timestamp):
+        packet = as_bytes(packet)
+        length = len(packet)
+        if length > self.slot_bytes:
+            self.oversized += 1
+            return
+        position = self.data_total % self.slot_bytes
+        if position + length > self.slot_bytes:
+            self.data_total += self.slot_bytes - position  # skip the tail so the packet stays contiguous
+            position = 0
+        slot = self.published % self.slots
+        offset = HEADER_BYTES + slot * ENTRY_BYTES
+        seq = self.seqs[slot] + 1
+        struct.pack_into("<Q", self.buf, offset, seq)
+        # Advertise the new total before overwriting, so readers of older packets see they were lapped
+        self.data_total += length
+        self._write_header()
+        start = self.data_start + position
+        self.buf[start:start + length] = packet
+        ENTRY.pack_into(self.buf, offset, seq, self.published, timestamp, self.data_total - length, length, int(keyframe))
+        self.seqs[slot] = seq + 1
+        struct.pack_into("<Q", self.buf, offset, seq + 1)
+        self.published += 1
+        self._write_header()
+
+class Frame:
+    # A zero-copy view of one slot. Check valid() after using the data: False means the publisher
+    # reused the slot meanwhile and whatever was computed from it should be thrown away.
+    def __init__(self, subscriber, offset, seq, number, timestamp_ns, width, height, stride, length):
+        self.subscriber = subscriber
+        self.offset = offset
+        self.seq = seq
+        self.number = number
+        self.timestamp_ns = timestamp_ns
+        self.width = width
+        self.height = height
+        self.stride = stride
+        start = offset + SLOT_HEADER_BYTES
+        self.data = subscriber.buf[start:start + length]
+
+    def array(self):
+        import numpy
+        return numpy.frombuffer(self.data, dtype=numpy.uint8).reshape(-1, self.stride)
+
+    def valid(self):
+        return struct.unpack_from("<Q", self.subscriber.buf, self.offset)[0] == self.seq
+
+    def release(self):
+        self.data.release()
+
+class BusSubscriber:
+    def __init__(self, name, kind):
+        self.shm = attach(name)
+        self.buf = self.shm.buf
+        magic, version, bus_kind, self.slots, self.slot_bytes, _, _, _ = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION or bus_kind != kind:
+            self.close()
+            raise ValueError(f"{name} is not a PiCam frame bus")
+
+    def header(self):
+        _, _, _, _, _, pid, published, data_total = HEADER.unpack_from(self.buf, 0)
+        return pid, published, data_total
+
+    def publisher_alive(self):
+        try:
+            os.kill(self.header()[0], 0)
+            return True
+        except PermissionError:
+            return True
+        except OSError:
+            return False
+
+    def close(self):
+        self.buf.release()
+        self.shm.close()
+
+class FrameSubscriber(BusSubscriber):
+    def __init__(self, name=LORES_BUS):
+        super().__init__(name, KIND_FRAMES)
+        self.slot_size = SLOT_HEADER_BYTES + self.slot_bytes
+
+    def latest(self):
+        # Newest complete frame, or None before the first one; a slot caught mid-write falls back one
+        published = self.header()[1]
+        for number in range(published - 1, max(-1, published - self.slots), -1):
+            offset = HEADER_BYTES + (number % self.slots) * self.slot_size
+            seq, found, timestamp_ns, width, height, stride, length = SLOT_HEADER.unpack_from(self.buf, offset)
+            if seq % 2 == 0 and found == number:
+                return Frame(self, offset, seq, number, timestamp_ns, width, height, stride, length)
+        return None
+
+    def wait(self, after=-1, timeout=1.0):
+        # Polls for a frame newer than `after`; subscribers set their own pace
+        deadline = time.monotonic() + timeout
+        while True:
+            frame = self.latest()
+            if frame is not None and frame.number > after:
+                return frame
+            if frame is not None:
+                frame.release()
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+
+class PacketSubscriber(BusSubscriber):
+    def __init__(self, name=PACKET_BUS):
+        super().__init__(name, KIND_PACKETS)
+        self.data_start = HEADER_BYTES + self.slots * ENTRY_BYTES
+        self.next = None
+        self.lost = 0
+
+    def _entry(self, number):
+        offset = HEADER_BYTES + (number % self.slots) * ENTRY_BYTES
+        return offset, ENTRY.unpack_from(self.buf, offset)
+
+    def start_at_keyframe(self):
+        # Positions the reader on the newest IDR still in the ring, where a decoder can join
+        published = self.header()[1]
+        for number in range(published - 1, max(-1, published - self.slots), -1):
+            _, (seq, found, _, _, _, keyframe) = self._entry(number)
+            if seq % 2 == 0 and found == number and keyframe:
+                self.next = number
+                return True
+        self.next = published
+        return False
+
+    def read(self):
+        # Returns (bytes, keyframe, timestamp) for the next packet, or None if there is nothing new.
+        # Packets are copied out here since the byte ring moves on quickly; frames are the zero-copy path.
+        _, published, _ = self.header()
+        if self.next is None:
+            self.next = published
+        if published - self.next > self.slots:
+            self.lost += published - self.slots - self.next
+            self.next = published - self.slots
+        while self.next < published:
+            number = self.next
+            self.next += 1
+            offset, (seq, found, timestamp, start, length, keyframe) = self._entry(number)
+            if seq % 2 or found != number:
+                self.lost += 1
+                continue
+            position = self.data_start + start % self.slot_bytes
+            data = bytes(self.buf[position:position + length])
+            _, _, data_total = self.header()
+            if struct.unpack_from("<Q", self.buf, offset)[0] != seq or data_total - start > self.slot_bytes:
+                self.lost += 1
+                continue
+            return data, bool(keyframe), timestamp
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Read from the recorder's shared-memory frame bus")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("info", help="publisher and ring state")
+    snapshot = sub.add_parser("snapshot", help="save the newest lores frame as a JPEG")
+    snapshot.add_argument("path")
+    tap = sub.add_parser("tap", help="write the live H.264 stream to a file, starting at a keyframe")
+    tap.add_argument("path")
+    tap.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.command == "info":
+        for name, subscriber in ((LORES_BUS, FrameSubscriber), (PACKET_BUS, PacketSubscriber)):
+            try:
+                bus = subscriber(name)
+            except FileNotFoundError:
+                print(f"{name}: not published")
+                continue
+            pid, published, data_total = bus.header()
+            print(f"{name}: pid {pid} ({'running' if bus.publisher_alive() else 'gone'}), {published} published, "
+                  f"{bus.slots} slots of {bus.slot_bytes} bytes")
+            bus.close()
+    elif args.command == "snapshot":
+        from thumbnails import encode_lores_jpeg
+        bus = FrameSubscriber()
+        frame = bus.wait(timeout=2)
+        if frame is None:
+            print("No frames published")
+            return 1
+        # Copied out first: encoding takes longer than the ring takes to come round again
+        data = bytes(frame.data)
+        valid = frame.valid()
+        frame.release()
+        bus.close()
+        if not valid:
+            print("Frame was overwritten while copying, try again")
+            return 1
+        import numpy
+        array = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, frame.stride)
+        jpeg = encode_lores_jpeg(array, (frame.width, frame.height), 90)
+        with open(args.path, "wb") as f:
+            f.write(jpeg)
+        print(f"Saved frame {frame.number} to {args.path}")
+    elif args.command == "tap":
+        bus = PacketSubscriber()
+        bus.start_at_keyframe()
+        written = 0
+        deadline = time.monotonic() + args.seconds
+        with open(args.path, "wb") as f:
+            while time.monotonic() < deadline:
+                packet = bus.read()
+                if packet is None:
+                    time.sleep(POLL_INTERVAL)
+                    continue
+                f.write(packet[0])
+                written += 1
+        print(f"Wrote {written} packets to {args.path}, {bus.lost} lost")
+        bus.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import logging
+from hardware import read_temperature, read_throttled
+
+GOVERNOR_INTERVAL = 10  # seconds between temperature and throttle samples
+STEP_DOWN_TEMP = 75.0  # the firmware starts soft-throttling the ARM at 80 C
+STEP_UP_TEMP = 65.0  # the gap to STEP_DOWN_TEMP is the hysteresis band
+HOT_SAMPLES = 3  # consecutive hot samples before each step down
+COOL_SAMPLES = 12  # consecutive cool samples before each step back up
+THROTTLED_NOW = 0x000F  # under-voltage, frequency capped, throttled, soft temperature limit (current, not sticky)
+
+# (largest frame size, highest frame rate, fraction of the configured bitrate), level 0 is as configured
+LEVELS = (
+    (None, None, 1.0),
+    ((1920, 1080), 20, 0.75),
+    ((1280, 720), 20, 0.5),
+    ((1280, 720), 15, 0.35),
+    ((960, 540), 10, 0.2)
+)
+
+class ThermalGovernor:
+    # Picks a quality level from the SoC temperature and firmware throttle flags. sample() only moves
+    # the target; the recorder applies it at the next segment boundary and then calls applied().
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.level = 0
+        self.target = 0
+        self.hot = 0
+        self.cool = 0
+        self.temp = None
+        self.throttled = 0
+        self.probe_failed = False
+        self.dropped_base = 0
+        self.changes = []
+
+    def sample(self):
+        try:
+            self.temp = read_temperature()
+            self.throttled = read_throttled()
+            self.probe_failed = False
+        except Exception as e:
+            if not self.probe_failed:
+                logging.warning(f"GOV001: Thermal probe failed, holding level {self.target}: {str(e)}")
+                self.probe_failed = True
+            return self.target
+        if not self.enabled:
+            self.target = 0
+        elif self.temp >= STEP_DOWN_TEMP or self.throttled & THROTTLED_NOW:
+            self.cool = 0
+            self.hot += 1
+            if self.hot >= HOT_SAMPLES and self.target < len(LEVELS) - 1:
+                self.target += 1
+                self.hot = 0
+        elif self.temp <= STEP_UP_TEMP:
+            self.hot = 0
+            self.cool += 1
+            # Back up one level at a time, and only once the last change has been applied
+            if self.cool >= COOL_SAMPLES and 0 < self.target == self.level:
+                self.target -= 1
+                self.cool = 0
+        else:
+            self.hot = 0
+            self.cool = 0
+        return self.target
+
+    def pending(self):
+        return self.target != self.level
+
+    def mode(self, frame_size, frame_rate, bitrate, level=None):
+        max_size, max_rate, fraction = LEVELS[self.level if level is None else level]
+        if max_size is not None and frame_size[0] * frame_size[1] > max_size[0] * max_size[1]:
+            frame_size = max_size
+        if max_rate is not None:
+            frame_rate = min(frame_rate, max_rate)
+        return frame_size, frame_rate, int(bitrate * fraction)
+
+    def applied(self, mode, dropped_total):
+        # dropped_total is the camera's running count; the log reports what the previous level lost
+        frame_size, frame_rate, bitrate = mode
+        dropped = dropped_total - self.dropped_base
+        self.dropped_base = dropped_total
+        previous, self.level = self.level, self.target
+        self.changes.append((previous, self.level, self.temp, self.throttled, dropped))
+        del self.changes[:-20]
+        temp = "?" if self.temp is None else f"{self.temp:.1f}"
+        logging.info(f"Thermal level {previous} -> {self.level} at {temp} C, throttled 0x{self.throttled:x}: "
+                     f"{frame_size[0]}x{frame_size[1]} at {frame_rate} fps, {bitrate / 1000000:.1f} Mbit/s; "
+                     f"{dropped} frames dropped at level {previous}")
+
+    def stats(self):
+        return {"level": self.level, "target": self.target, "temp_c": self.temp,
+                "throttled": hex(self.throttled), "last_change": self.changes[-1] if self.changes else None}
@@ -0,0 +1,52 @@
+import os
+import importlib
+import subprocess
+
+# "pi" uses picamera2, gpiozero and the firmware; "fake" swaps in fake_hardware so the recorder,
+# serial server and button control run (and can be benchmarked) on any Linux machine
+BACKEND = os.environ.get("PICAM_BACKEND", "pi")
+THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"
+THROTTLED_SYSFS = "/sys/devices/platform/soc/soc:firmware/get_throttled"
+
+PI_MODULES = {
+    "Picamera2": "picamera2",
+    "MappedArray": "picamera2",
+    "H264Encoder": "picamera2.encoders",
+    "Output": "picamera2.outputs",
+    "Button": "gpiozero",
+    "Buzzer": "gpiozero"
+}
+
+def __getattr__(name):
+    # Resolved on first use, so each process only imports the hardware libraries it actually touches
+    if name not in PI_MODULES:
+        raise AttributeError(f"module 'hardware' has no attribute '{name}'")
+    module = importlib.import_module("fake_hardware" if BACKEND == "fake" else PI_MODULES[name])
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+def read_throttled():
+    if BACKEND == "fake":
+        return importlib.import_module("fake_hardware").read_throttled()
+    # sysfs avoids spawning vcgencmd on kernels that expose the firmware flags
+    try:
+        with open(THROTTLED_SYSFS, "r") as f:
+            return int(f.read().strip(), 16)
+    except OSError:
+        return int(subprocess.check_output(["vcgencmd", "get_throttled"]).decode().strip().split("=")[1], 16)
+
+def read_temperature():
+    if BACKEND == "fake":
+        return importlib.import_module("fake_hardware").read_temperature()
+    try:
+        with open(THERMAL_ZONE, "r") as f:
+            return int(f.read().strip()) / 1000
+    except OSError:
+        return float(subprocess.check_output(["vcgencmd", "measure_temp"]).decode().split("=")[1].split("'")[0])
+
+def memory_percent():
+    if BACKEND == "fake":
+        return importlib.import_module("fake_hardware").memory_percent()
+    import psutil
+    return psutil.virtual_memory().percent
@@ -0,0 +1,113 @@
+import time
+import logging
+import threading
+import numpy
+from segment_writer import LatencyHistogram
+
+MOTION_FPS = 5  # analysed frames per second; motion in a parked car does not need more
+DOWNSCALE = 2  # every 2nd pixel of every 2nd row of the lores Y plane, 160x120 for a 320x240 lores
+BLOCK = 8  # block edge in downscaled pixels, a 20x15 grid at 160x120
+TRIGGER_FRAMES = 2  # consecutive frames with motion before it counts, filters single-frame sensor noise
+GLOBAL_CHANGE = 0.6  # more than this fraction of blocks changing at once is a lighting change, not motion
+HOLD_SECONDS = 30  # motion stays active this long after the last moving frame
+
+def sensitivity_thresholds(sensitivity):
+    # 1 (least sensitive) to 10: per-pixel luma change, and the fraction of a block that must change
+    return 40 - 3 * sensitivity, 0.30 - 0.025 * sensitivity
+
+class MotionDetector:
+    # Frame differencing on the lores luma, reduced to a block grid. Runs on the camera thread for
+    # MOTION_FPS frames a second, so everything is whole-array NumPy with no per-pixel Python.
+    def __init__(self, lores_size, on_change=None, sensitivity=5, mask=(), hold_seconds=HOLD_SECONDS,
+                 fps=MOTION_FPS):
+        self.lores_size = lores_size
+        self.on_change = on_change
+        self.enabled = False
+        self.hold_seconds = hold_seconds
+        self.interval = 1 / fps
+        self.next_due = 0
+        width, height = lores_size[0] // DOWNSCALE, lores_size[1] // DOWNSCALE
+        self.grid = (height // BLOCK, width // BLOCK)
+        self.crop = (self.grid[0] * BLOCK * DOWNSCALE, self.grid[1] * BLOCK * DOWNSCALE)
+        self.previous = None
+        self.lock = threading.Lock()
+        self.active = False
+        self.moving_frames = 0
+        self.last_motion = None
+        self.active_blocks = 0
+        self.events = 0
+        self.analysis_ms = LatencyHistogram()
+        self.configure(sensitivity, mask)
+
+    def configure(self, sensitivity, mask):
+        # mask: (x0, y0, x1, y1) rectangles in percent of the frame; blocks whose centre falls inside are ignored
+        rows, cols = self.grid
+        centre_y = (numpy.arange(rows) + 0.5) * 100 / rows
+        centre_x = (numpy.arange(cols) + 0.5) * 100 / cols
+        included = numpy.ones(self.grid, dtype=bool)
+        for x0, y0, x1, y1 in mask:
+            included &= ~(((centre_y >= y0) & (centre_y < y1))[:, None] & ((centre_x >= x0) & (centre_x < x1))[None, :])
+        pixel_threshold, block_fraction = sensitivity_thresholds(sensitivity)
+        with self.lock:
+            self.pixel_threshold = pixel_threshold
+            self.block_pixels = int(block_fraction * BLOCK * BLOCK)
+            self.included = included
+            self.included_blocks = max(1, int(included.sum()))
+
+    def set_enabled(self, enabled):
+        with self.lock:
+            self.enabled = enabled
+            self.previous = None
+            self.moving_frames = 0
+        if not enabled and self.active:
+            self._set_active(False)
+
+    def wants_frame(self):
+        return self.enabled and time.monotonic() >= self.next_due
+
+    def on_lores(self, array):
+        start = time.perf_counter()
+        self.next_due = time.monotonic() + self.interval
+        with self.lock:
+            moving = self.analyse(array)
+        now = time.monotonic()
+        if moving:
+            self.moving_frames += 1
+            if self.moving_frames >= TRIGGER_FRAMES:
+                self.last_motion = now
+                if not self.active:
+                    self._set_active(True)
+        else:
+            self.moving_frames = 0
+            if self.active and now - self.last_motion >= self.hold_seconds:
+                self._set_active(False)
+        self.analysis_ms.add((time.perf_counter() - start) * 1000)
+
+    def analyse(self, array):
+        # Strided view of the Y plane, widened to int16 so the difference cannot wrap
+        frame = array[:self.crop[0]:DOWNSCALE, :self.crop[1]:DOWNSCALE].astype(numpy.int16)
+        previous, self.previous = self.previous, frame
+        if previous is None:
+            return False
+        changed = numpy.abs(frame - previous) > self.pixel_threshold
+        counts = changed.reshape(self.grid[0], BLOCK, self.grid[1], BLOCK).sum(axis=(1, 3))
+        active = (counts >= self.block_pixels) & self.included
+        self.active_blocks = int(active.sum())
+        if self.active_blocks > GLOBAL_CHANGE * self.included_blocks:
+            return False  # headlights sweeping the scene or the exposure catching up
+        return self.active_blocks > 0
+
+    def _set_active(self, active):
+        self.active = active
+        if active:
+            self.events += 1
+            logging.info(f"Motion detected in {self.active_blocks} blocks")
+        else:
+            logging.info(f"No motion for {self.hold_seconds} s")
+        if self.on_change is not None:
+            self.on_change(active)
+
+    def stats(self):
+        return {"enabled": self.enabled, "active": self.active, "events": self.events,
+                "active_blocks": self.active_blocks, "grid": list(self.grid),
+                "analysis_ms": self.analysis_ms.snapshot()}
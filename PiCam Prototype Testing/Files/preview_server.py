@@ -0,0 +1,136 @@
+import time
+import queue
+import socket
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from thumbnails import encode_lores_jpeg
+from settings import HOTSPOT_IP
+
+PREVIEW_PORT = 8081
+PREVIEW_FPS = 10
+PREVIEW_QUALITY = 60
+MAX_PREVIEW_CLIENTS = 4
+BOUNDARY = "picamframe"
+IP_FREEBIND = 15  # Linux; not exported by the socket module
+
+class PreviewBroadcaster:
+    # Encodes each lores preview frame to JPEG once and shares the newest one with every client.
+    # Clients always jump to the latest frame, so a slow one skips frames instead of holding anyone up.
+    def __init__(self, lores_size, fps=PREVIEW_FPS):
+        self.lores_size = lores_size
+        self.interval = 1 / fps
+        self.condition = threading.Condition()
+        self.frame = None
+        self.sequence = 0
+        self.clients = 0
+        self.next_due = 0
+        self.frames_encoded = 0
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._run, name="preview-encoder", daemon=True)
+        self.thread.start()
+
+    def wants_frame(self):
+        # Nothing is copied or encoded while nobody is watching
+        return self.clients > 0 and time.monotonic() >= self.next_due
+
+    def on_lores(self, array):
+        self.next_due = time.monotonic() + self.interval
+        try:
+            self.queue.put_nowait(array)
+        except queue.Full:
+            pass  # encoder still busy with the previous frame
+
+    def _run(self):
+        while True:
+            array = self.queue.get()
+            try:
+                jpeg = encode_lores_jpeg(array, self.lores_size, PREVIEW_QUALITY)
+            except Exception as e:
+                logging.error(f"PRV001: Preview encode failed: {str(e)}")
+                continue
+            with self.condition:
+                self.frame = jpeg
+                self.sequence += 1
+                self.frames_encoded += 1
+                self.condition.notify_all()
+
+    def add_client(self):
+        with self.condition:
+            if self.clients >= MAX_PREVIEW_CLIENTS:
+                return False
+            self.clients += 1
+            return True
+
+    def remove_client(self):
+        with self.condition:
+            self.clients -= 1
+
+    def wait_frame(self, last_sequence, timeout=2):
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence != last_sequence, timeout)
+            return self.sequence, self.frame
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    broadcaster = None
+
+    def do_GET(self):
+        if self.path not in ("/preview.mjpg", "/preview.jpg"):
+            self.send_error(404)
+            return
+        if not self.broadcaster.add_client():
+            self.send_error(503, "Too many preview clients")
+            return
+        try:
+            if self.path == "/preview.jpg":
+                self.send_snapshot()
+            else:
+                self.send_stream()
+        except (ConnectionError, TimeoutError):
+            pass
+        finally:
+            self.broadcaster.remove_client()
+
+    def send_snapshot(self):
+        _, frame = self.broadcaster.wait_frame(self.broadcaster.sequence)
+        if frame is None:
+            self.send_error(503, "No preview frame yet")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(frame)))
+        self.end_headers()
+        self.wfile.write(frame)
+
+    def send_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={BOUNDARY}")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        sequence = 0
+        while True:
+            new_sequence, frame = self.broadcaster.wait_frame(sequence)
+            if new_sequence == sequence or frame is None:
+                continue
+            sequence = new_sequence
+            self.wfile.write(f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(frame)}\r\n\r\n".encode())
+            self.wfile.write(frame)
+            self.wfile.write(b"\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+class PreviewHTTPServer(ThreadingHTTPServer):
+    def server_bind(self):
+        # The live view is unauthenticated, so it only listens on the hotspot address, which may
+        # not be up yet when the recorder starts; FREEBIND lets the bind succeed ahead of it
+        self.socket.setsockopt(socket.IPPROTO_IP, IP_FREEBIND, 1)
+        super().server_bind()
+
+def start_preview_server(broadcaster, port=PREVIEW_PORT, host=HOTSPOT_IP):
+    handler = type("BoundPreviewHandler", (PreviewHandler,), {"broadcaster": broadcaster})
+    server = PreviewHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="preview-server", daemon=True).start()
+    logging.info(f"Preview server started on {host}:{port}")
+    return server
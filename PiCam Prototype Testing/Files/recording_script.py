@@ -1,107 +1,625 @@
 import os
 import time
+STARTUP_T0 = time.monotonic()  # before the heavy imports, so the startup report can include them
 import datetime
-import subprocess
 import logging
 import signal
-from picamera2 import Picamera2
-import psutil
+import json
+import threading
+import collections
+from hardware import Picamera2, H264Encoder, Output, MappedArray
+from remux_queue import RemuxQueue
+from fmp4_muxer import FragmentedMP4Writer, TIMESCALE
+from segment_writer import SegmentWriter, WriteStage, LatencyHistogram, SYNC_INTERVAL, unique_path
+from event_buffer import PreEventBuffer
+from wifi_presence import WifiPresenceMonitor
+from segment_catalog import SegmentCatalog, RetentionEngine
+from thumbnails import SegmentThumbnailer
+from control_server import ControlServer, CONTROL_SOCKET
+from scheduler import Scheduler
+from structured_logging import setup_logging
+from settings import load_settings, ConfigWatcher, CONFIG_FILE, VIDEO_DIR, LORES_SIZE
+from governor import ThermalGovernor, GOVERNOR_INTERVAL
+from motion import MotionDetector
+from telemetry import TelemetryRecorder, GpsReader, TELEMETRY_INTERVAL
+from frame_bus import FramePublisher, PacketPublisher, LORES_BUS, PACKET_BUS
+IMPORTS_DONE = time.monotonic()
 
 # Configuration
-COMMAND_PIPE = "/tmp/camera_commands"
 PID_FILE = "/tmp/recording_script.pid"
-VIDEO_DIR = "/home/picam/videos"
+LOG_FILE = "/home/picam/recording.log"
+ERROR_LOG_FILE = "/home/picam/recording_errors.log"  # warnings and errors only, as JSON lines for recentErrors
+STATUS_FILE = "/dev/shm/picam_status.json"  # tmpfs, so publishing costs no SD writes
+STATUS_INTERVAL = 5  # seconds between status publishes, well inside the health check's staleness limit
+LOW_SPACE_INTERVAL = 30  # seconds between free-space checks; 10 Mbit/s fills ~40 MB in that time
+RETENTION_INTERVAL = 3600  # seconds between age-based retention sweeps
+FRAME_SIZE = (1920, 1080)
+FRAME_RATE = 25
+BITRATE = 10000000
+KEYFRAME_SECONDS = 1  # time between IDRs, bounds how late a rotation can land
+PAUSE_TIMEOUT = 600  # seconds a pause lasts unless resumed sooner, so a crashed client cannot stop recording for good
+JITTER_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20)  # distance of each frame interval from the nominal one
+CAMERA_DEVICES = ("/dev/media", "/dev/video")
+CONFLICTING_PROCESSES = ("libcamera", "rpicam", "raspivid", "raspistill")  # killed if they hold the camera
+CAMERA_RETRY_DELAYS = (0.2, 0.5, 1.0)  # seconds before each retry of a failed camera open
 
 # Error Codes Dictionary
 ERROR_CODES = {
     "CFG001": "Settings file not found",
     "CFG002": "Invalid setting value in config",
-    "CFG003": "Missing required setting in config",
+    "CFG003": "Unknown setting in config",
+    "CFG004": "Setting needs a restart to take effect",
+    "CFG005": "Config file watch unavailable",
+    "GOV001": "Thermal probe failed",
+    "GPS001": "GPS receiver unavailable",
+    "TLM001": "Telemetry sidecar write failed",
+    "BUS001": "Frame bus unavailable",
     "WIFI001": "Wi-Fi scan failed",
+    "WIFI002": "Wi-Fi control socket unavailable",
     "VID001": "Failed to start recording",
     "VID002": "Failed to stop recording",
     "VID003": "Video conversion failed",
+    "VID004": "Remux queue full",
+    "VID005": "Segment write failed",
+    "VID006": "Slow SD card write",
     "DEL001": "File deletion failed",
+    "DEL002": "Retention blocked by locked clips",
+    "CAT001": "Segment catalog update failed",
+    "THM001": "Thumbnail generation failed",
+    "PRV001": "Preview encode failed",
+    "CTL001": "Control command failed",
+    "SNP001": "Snapshot failed",
+    "SCH001": "Scheduled job failed",
     "DIR001": "Directory creation failed",
-    "CAM001": "Camera initialization failed"
+    "CAM001": "Camera initialization failed",
+    "CAM002": "Camera held by another process",
+    "EVT001": "Event clip write failed",
+    "EVT002": "Event trigger ignored"
 }
 
 # Configure logging
-logging.basicConfig(
-    filename='/home/picam/recording.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Configure logging; records go through a queue so the recorder never waits on the card to log
+setup_logging(LOG_FILE, ERROR_LOG_FILE, "recorder")
 
-class CameraController:
+class BusOutput(Output):
+    # Encoder output that copies each packet into the shared-memory packet ring for other processes
+    def __init__(self, publisher):
+        super().__init__()
+        self.publisher = publisher
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        self.publisher.publish(frame, keyframe, timestamp or 0)
+
+class SegmentStats:
+    # Frame timing for one segment from the sensor timestamps the encoder passes through, logged at close
+    def __init__(self, path, frame_interval):
+        self.name = os.path.basename(path)
+        self.frame_interval = frame_interval
+        self.frames = 0
+        self.keyframes = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.jitter = LatencyHistogram(JITTER_BUCKETS_MS)
+        self.max_queue_depth = 0
+
+    def add(self, size, keyframe, timestamp):
+        if self.last_timestamp is not None:
+            interval = timestamp - self.last_timestamp
+            missed = round(interval / self.frame_interval) - 1
+            if missed > 0:
+                self.dropped += missed
+            else:
+                self.jitter.add(abs(interval - self.frame_interval) / 1000)
+        else:
+            self.first_timestamp = timestamp
+        self.last_timestamp = timestamp
+        self.frames += 1
+        self.keyframes += keyframe
+        self.bytes += size
+
+    def summary(self):
+        duration = 0.0
+        if self.first_timestamp is not None:
+            duration = (self.last_timestamp - self.first_timestamp + self.frame_interval) / 1000000
+        return {"segment": self.name, "frames": self.frames, "keyframes": self.keyframes, "seconds": round(duration, 3),
+                "fps": round(self.frames / duration, 2) if duration else 0.0, "dropped": self.dropped,
+                "bytes": self.bytes, "bytes_per_second": round(self.bytes / duration) if duration else 0,
+                "jitter_ms": self.jitter.snapshot(), "max_queue_depth": self.max_queue_depth}
+
+    def log(self):
+        summary = self.summary()
+        logging.info(f"Segment {self.name}: {self.frames} frames in {summary['seconds']:.1f} s ({summary['fps']:.2f} fps), "
+                     f"{self.dropped} dropped, jitter p50 <= {self.jitter.percentile(50)} ms p99 <= "
+                     f"{self.jitter.percentile(99)} ms max {self.jitter.max_ms:.2f} ms, "
+                     f"{summary['bytes_per_second'] * 8 / 1000000:.2f} Mbit/s, encoder queue max {self.max_queue_depth}")
+        return summary
+
+class SegmentOutput(Output):
+    # Encoder output that switches files on keyframes so the encoder never stops
+    def __init__(self, size=FRAME_SIZE, on_open=None, on_close=None, preallocate_bytes=0, sync_interval=SYNC_INTERVAL,
+                 frame_rate=FRAME_RATE):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.size = size
+        self.on_open = on_open
+        self.on_close = on_close
+        self.preallocate_bytes = preallocate_bytes
+        self.writer_stage = WriteStage(sync_interval)
+        self.file = None
+        self.muxer = None
+        self.path = None
+        self.pending_path = None
+        self.last_timestamp = None
+        self.frame_interval = 1000000 / frame_rate
+        self.closed_segments = collections.deque()
+        self.rotation_gaps = collections.deque(maxlen=100)
+        self.last_gap_ms = None
+        self.bytes_written = 0
+        self.segment_count = 0
+        self.frames_out = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.segment_stats = None
+        self.last_segment_stats = None
+
+    def observe_queue_depth(self, depth):
+        # Camera thread: frames handed to the encoder that have not come out yet, the current one included
+        self.queue_depth = depth
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        stats = self.segment_stats
+        if stats is not None and depth > stats.max_queue_depth:
+            stats.max_queue_depth = depth
+
+    def start_segment(self, path):
+        # Takes effect on the next keyframe, which is also the first frame of a fresh encoder
+        with self.lock:
+            self.pending_path = path
+
+    def close_segment(self):
+        with self.lock:
+            self.pending_path = None
+            self._close_file()
+
+    def _close_file(self):
+        if self.segment_stats is not None:
+            self.last_segment_stats = self.segment_stats.log()
+            self.segment_stats = None
+        if self.file is not None:
+            keyframes = []
+            if self.muxer is not None:
+                self.muxer.close()
+                keyframes = [(dts / TIMESCALE, offset) for dts, offset in self.muxer.fragment_offsets]
+            # The segment only counts as closed once the writer stage has flushed and truncated it
+            self.file.close(on_closed=lambda path=self.path: self._segment_closed(path, keyframes))
+            self.file = None
+            self.muxer = None
+            self.path = None
+
+    def _segment_closed(self, path, keyframes):
+        self.closed_segments.append((path, keyframes))
+        self.segment_count += 1
+        if self.on_close is not None:
+            self.on_close()
+
+    def _switch(self, timestamp):
+        rotating = self.file is not None
+        self._close_file()
+        self.file = SegmentWriter(self.pending_path, self.writer_stage, self.preallocate_bytes)
+        if self.pending_path.endswith('.mp4'):
+            self.muxer = FragmentedMP4Writer(self.file, *self.size)
+        self.path = self.pending_path
+        self.pending_path = None
+        self.segment_stats = SegmentStats(self.path, self.frame_interval)
+        if self.on_open is not None:
+            self.on_open(self.path)
+        if rotating and self.last_timestamp is not None:
+            # Anything beyond one frame interval between the last old frame and the first new one is lost footage
+            gap_us = (timestamp - self.last_timestamp) - self.frame_interval
+            self.last_gap_ms = max(0.0, gap_us / 1000)
+            self.rotation_gaps.append((self.path, self.last_gap_ms))
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        with self.lock:
+            if timestamp is None:
+                # Older encoders do not pass the sensor timestamp through; assume a steady frame rate
+                timestamp = 0 if self.last_timestamp is None else self.last_timestamp + self.frame_interval
+            self.frames_out += 1
+            if self.pending_path is not None and keyframe:
+                self._switch(timestamp)
+            if self.segment_stats is not None:
+                self.segment_stats.add(len(frame), keyframe, timestamp)
+            if self.muxer is not None:
+                self.muxer.write_frame(frame, keyframe, timestamp)
+                self.bytes_written += len(frame)
+            elif self.file is not None:
+                self.file.write(frame)
+                self.bytes_written += len(frame)
+            self.last_timestamp = timestamp
+
+    def stop(self):
+        super().stop()
+        self.close_segment()
+
+    def drain(self, timeout=None):
+        # Waits for every queued block and close to reach the card
+        self.writer_stage.stop(timeout)
+
+class FrameStats:
+    # Counts frames as the camera delivers them, fed from Picamera2's post_callback
+    def __init__(self):
+        self.frames = 0
+        self.dropped = 0
+        self.jitter = LatencyHistogram(JITTER_BUCKETS_MS)
+        self.max_interval_ms = 0.0
+        self.nominal_interval_ms = None
+        self.last_sensor_ns = None
+        self.last_frame_time = None
+        self.fps = 0.0
+        self.window_start = time.monotonic()
+        self.window_frames = 0
+
+    def on_request(self, request):
+        self.frames += 1
+        self.last_frame_time = time.time()
+        self.window_frames += 1
+        metadata = request.get_metadata()
+        timestamp = metadata.get("SensorTimestamp")
+        duration = metadata.get("FrameDuration")
+        if timestamp and duration and self.last_sensor_ns is not None:
+            # A gap of more than one frame duration means the sensor delivered frames nobody took
+            interval_ms = (timestamp - self.last_sensor_ns) / 1000000
+            self.nominal_interval_ms = duration / 1000
+            self.max_interval_ms = max(self.max_interval_ms, interval_ms)
+            missed = round(interval_ms / self.nominal_interval_ms) - 1
+            if missed > 0:
+                self.dropped += missed
+            else:
+                self.jitter.add(abs(interval_ms - self.nominal_interval_ms))
+        self.last_sensor_ns = timestamp
+        now = time.monotonic()
+        if now - self.window_start >= 1.0:
+            self.fps = self.window_frames / (now - self.window_start)
+            self.window_start = now
+            self.window_frames = 0
+
+    def snapshot(self):
+        return {"frames": self.frames, "dropped": self.dropped, "fps": round(self.fps, 2),
+                "nominal_interval_ms": self.nominal_interval_ms, "max_interval_ms": round(self.max_interval_ms, 2),
+                "jitter_ms": self.jitter.snapshot()}
+
+class StartupTimer:
+    # Phase durations from interpreter start to the first frame written to a segment
     def __init__(self):
+        self.phases = {"import": round(IMPORTS_DONE - STARTUP_T0, 3)}
+        self.last = IMPORTS_DONE
+        self.done = False
+
+    def mark(self, phase):
+        now = time.monotonic()
+        self.phases[phase] = round(now - self.last, 3)
+        self.last = now
+
+    def finish(self):
+        self.mark("first_frame")
+        self.phases["total"] = round(self.last - STARTUP_T0, 3)
+        try:
+            # /proc/uptime counts from kernel start, which is close to ignition on a dashcam
+            with open("/proc/uptime") as f:
+                self.phases["since_boot"] = round(float(f.read().split()[0]), 3)
+        except OSError:
+            pass
+        self.done = True
+
+    def report(self):
+        logging.info("Startup timing: " + ", ".join(f"{phase} {seconds:.3f} s" for phase, seconds in self.phases.items()))
+
+class CameraController:
+    def __init__(self, catalog, continuous=True, native_mp4=True, pre_event_seconds=0, post_event_seconds=20,
+                 event_buffer_mb=24, preview_port=0, control_path=CONTROL_SOCKET, segment_bytes=0,
+                 sync_interval=SYNC_INTERVAL, frame_size=FRAME_SIZE, frame_rate=FRAME_RATE,
+                 bitrate=BITRATE, thermal_governor=True):
+        self.catalog = catalog
+        self.governor = ThermalGovernor(thermal_governor)
+        self.frame_size = frame_size
+        self.frame_rate = frame_rate
+        self.bitrate = bitrate
+        self.reconfigure_started = None
+        self.last_reconfigure_ms = None
+        self.scheduler = Scheduler()
+        self.startup = StartupTimer()
         self.picam2 = None
+        self.encoder = None
+        self.encoding = False
+        self.encoder_frames_in = 0
+        self.thumbnailer = SegmentThumbnailer(VIDEO_DIR, LORES_SIZE)
+        self.motion = MotionDetector(LORES_SIZE)
+        self.telemetry = TelemetryRecorder()
+        self.gps = None
+        # Other processes (health check, tools) get frames from here instead of opening the camera
+        self.lores_bus = None
+        self.packet_bus = None
+        self.bus_failed = False
+        try:
+            self.lores_bus = FramePublisher(LORES_BUS, LORES_SIZE[0] * LORES_SIZE[1] * 3 // 2)
+            self.packet_bus = BusOutput(PacketPublisher(PACKET_BUS))
+        except OSError as e:
+            logging.error(f"BUS001: Frame bus unavailable: {str(e)}")
+            if self.lores_bus is not None:
+                self.lores_bus.close()
+                self.lores_bus = None
+        self.output = SegmentOutput(frame_size, on_open=self.segment_opened, preallocate_bytes=segment_bytes,
+                                    sync_interval=sync_interval, frame_rate=frame_rate)
+        self.preview = None
+        self.preview_port = preview_port
+        self.frame_stats = FrameStats()
+        self.event_buffer = None
+        if pre_event_seconds > 0:
+            self.event_buffer = PreEventBuffer(VIDEO_DIR, frame_size, pre_event_seconds, post_event_seconds,
+                                               event_buffer_mb * 1024 * 1024,
+                                               on_saved=lambda path: catalog.add(path, "event"))
+        self.extension = "mp4" if native_mp4 else "h264"
+        self.remux_queue = RemuxQueue(VIDEO_DIR, frame_rate, is_active=self.is_active_segment,
+                                      on_converted=self.catalog_segment)
+        self.continuous = continuous
         self.recording = False
         self.current_file = None
         self.start_time = None
+        self.segment_started = None  # monotonic, so rotation deadlines survive NTP steps on a Pi with no RTC
         self.running = True
+        self.last_closed = None
+        self.pending_locks = set()  # segment names (no extension) to lock once they reach the catalog
+        self.paused = False
+        self.pause_ready = False  # the last segment has closed and been catalogued since the pause
+        self.pause_generation = 0
+        self.recording_before_pause = False  # restored on resume while Wi-Fi presence is still unknown
+        self.pause_timer = None
+        self.on_resume = None
         self.setup_signal_handlers()
         self.initialize_camera()
-        self.setup_command_pipe()
+        self.control = ControlServer({
+            "stop": self.command_stop,
+            "status": self.command_status,
+            "rotate": self.command_rotate,
+            "lock-clip": self.command_lock_clip,
+            "snapshot": self.command_snapshot,
+            "event": self.command_event,
+            "timing": self.command_timing,
+            "pause": self.command_pause,
+            "resume": self.command_resume
+        }, path=control_path, selector=self.scheduler.selector)
+
+    def start_deferred(self):
+        # Everything the first recorded frame does not depend on starts once it has been written
+        if self.preview_port:
+            from preview_server import PreviewBroadcaster, start_preview_server
+            self.preview = PreviewBroadcaster(LORES_SIZE)
+            try:
+                start_preview_server(self.preview, self.preview_port)
+            except OSError as e:
+                logging.error(f"PRV001: Preview server failed to start: {str(e)}")
+                self.preview = None
+        self.remux_queue.start()
+        self.remux_queue.recover()
+
+    def segment_opened(self, path):
+        # Encoder thread; the report and deferred startup run on the main loop
+        self.thumbnailer.open_segment(path)
+        self.scheduler.call_soon_threadsafe(lambda: self.telemetry_segment_opened(path))
+        if self.reconfigure_started is not None:
+            gap_ms = (time.monotonic() - self.reconfigure_started) * 1000
+            self.reconfigure_started = None
+            logging.info(f"Recording resumed {gap_ms:.0f} ms after the reconfigure started")
+        if not self.startup.done:
+            self.startup.finish()
+            self.scheduler.call_soon_threadsafe(self.startup_complete)
+
+    def telemetry_segment_opened(self, path):
+        # Main loop; skipped if recording stopped before the cut-over was seen here
+        if self.recording:
+            self.telemetry.open_segment(path)
+
+    def startup_complete(self):
+        self.startup.report()
+        self.publish_status()
+        self.start_deferred()
 
     def setup_signal_handlers(self):
         signal.signal(signal.SIGINT, self.signal_handler)
         signal.signal(signal.SIGTERM, self.signal_handler)
-        signal.signal(signal.SIGUSR1, self.signal_handler)
 
-    def setup_command_pipe(self):
-        if not os.path.exists(COMMAND_PIPE):
-            os.mkfifo(COMMAND_PIPE)
-            
-    def check_commands(self):
+    def command_stop(self, args):
+        logging.info("SHU002 Received stop command")
+        # The main loop finishes the shutdown once this reply has been queued
+        self.running = False
+        self.scheduler.stop()
+        return {}
+
+    def command_status(self, args):
+        return self.status()
+
+    def command_pause(self, args):
+        # Used by bulk deletes: stops writing to VIDEO_DIR until resumed or the timeout passes
+        seconds = float(args) if args else PAUSE_TIMEOUT
+        if not self.paused:
+            self.recording_before_pause = self.recording
+        self.paused = True
+        self.pause_ready = False
+        self.pause_generation += 1
+        generation = self.pause_generation
+        self.stop_recording()
+        # The last segment finishes closing on the writer thread; callers poll status for pause_ready
+        # before touching the files, so this reply never waits on the card
+        self.output.writer_stage.after(lambda: self.scheduler.call_soon_threadsafe(lambda: self.pause_drained(generation)))
+        if self.pause_timer is not None:
+            self.pause_timer.cancel()
+        self.pause_timer = self.scheduler.call_later(seconds, self.resume, "pause-timeout")
+        logging.info(f"Recording paused for up to {seconds:.0f} s")
+        return {"paused": seconds, "ready": False}
+
+    def pause_drained(self, generation):
+        # A drain from an earlier pause must not mark a newer one ready
+        if self.paused and generation == self.pause_generation:
+            self.process_closed_segments()
+            self.pause_ready = True
+
+    def command_resume(self, args):
+        if not self.paused:
+            raise RuntimeError("Not paused")
+        return {"removed": self.resume()}
+
+    def resume(self):
+        if self.pause_timer is not None:
+            self.pause_timer.cancel()
+            self.pause_timer = None
+        self.paused = False
+        self.pause_ready = False
+        # Files may have been deleted while paused; the catalog forgets those before retention runs again
+        removed = self.catalog.resync()
+        logging.info(f"Recording resumed, {removed} deleted clips dropped from the catalog")
+        if self.on_resume is not None:
+            self.on_resume()
+        return removed
+
+    def command_timing(self, args):
+        return self.frame_timing()
+
+    def command_rotate(self, args):
+        if not self.recording:
+            raise RuntimeError("Not recording")
+        self.rotate_recording()
+        return {"file": self.current_file}
+
+    def command_lock_clip(self, args):
+        if args:
+            path = os.path.join(VIDEO_DIR, os.path.basename(args))
+            if not self.catalog.set_locked(path):
+                raise RuntimeError(f"No such clip: {args}")
+            return {"file": path}
+        # No name locks the segment being recorded, or the last one if we are idle
+        path = self.current_file or self.last_closed
+        if path is None:
+            raise RuntimeError("No segment to lock")
+        if not self.catalog.set_locked(path):
+            self.pending_locks.add(os.path.splitext(os.path.basename(path))[0])
+        return {"file": path}
+
+    def command_snapshot(self, args):
+        if self.picam2 is None:
+            raise RuntimeError("Camera not running")
+        path = datetime.datetime.now().strftime(f"{VIDEO_DIR}/Snapshot_%d-%m-%y_%H-%M-%S.jpg")
+        # JPEG encoding a full frame takes a while on a Pi Zero, so it runs off the recorder loop
+        threading.Thread(target=self.take_snapshot, args=(path,), name="snapshot", daemon=True).start()
+        return {"file": path}
+
+    def command_event(self, args):
+        path = self.trigger_event()
+        if path is None:
+            raise RuntimeError("Pre-event buffer not ready")
+        return {"file": path}
+
+    def take_snapshot(self, path):
         try:
-            if os.path.exists(COMMAND_PIPE):
-                with open(COMMAND_PIPE, 'r') as pipe:
-                    command = pipe.read().strip()
-                    if command == "stop":
-                        logging.info("SHU002 Received stop command")
-                        self.graceful_shutdown()
+            request = self.picam2.capture_request()
+            try:
+                request.save("main", path)
+            finally:
+                request.release()
+            logging.info(f"Saved snapshot {path}")
         except Exception as e:
-            logging.error(f"UNE001Error reading command pipe: {str(e)}")
+            logging.error(f"SNP001: Snapshot failed: {str(e)}")
 
-    def graceful_shutdown(self):
+    def shutdown(self):
         self.stop_recording()
         self.close_camera()
+        # Let the writer stage finish the last segment so it is catalogued before we exit
+        self.output.drain(timeout=10)
+        self.process_closed_segments()
         self.cleanup_resources()
         logging.info("SHU001 Script stopped gracefully")
-        exit(0)
 
     def signal_handler(self, signum, frame):
+        # Only ends the loop; main() shuts down once, outside the handler, like the stop command
         if signum in [signal.SIGINT, signal.SIGTERM]:
-            self.graceful_shutdown()
-        elif signum == signal.SIGUSR1:
-            self.check_commands()
+            self.running = False
+            self.scheduler.stop()
+            self.scheduler.wakeup()
+
+    def configure_camera(self):
+        config = self.picam2.create_video_configuration(
+            main={"size": self.frame_size},
+            lores={"size": LORES_SIZE, "format": "YUV420"},
+            controls={"FrameRate": self.frame_rate}
+        )
+        self.picam2.configure(config)
+        self.picam2.post_callback = self.on_request
+        # repeat=True puts SPS/PPS in front of every IDR so each segment decodes on its own
+        self.encoder = H264Encoder(bitrate=self.bitrate, repeat=True, iperiod=max(1, round(self.frame_rate * KEYFRAME_SECONDS)))
+        self.picam2.start()
+        if self.event_buffer is not None:
+            # The pre-event buffer needs encoded frames even while nothing is written to the card
+            self.start_encoder()
 
     def initialize_camera(self):
-        max_retries = 3
-        for attempt in range(max_retries):
+        # No up-front process sweep: open straight away and only look for a conflicting owner if that fails
+        for attempt in range(len(CAMERA_RETRY_DELAYS) + 1):
             try:
-                kill_camera_processes()
                 self.picam2 = Picamera2()
-                config = self.picam2.create_video_configuration(
-                    main={"size": (1920, 1080)},
-                    controls={"FrameRate": 25}
-                )
-                self.picam2.configure(config)
-                self.picam2.start()
+                self.startup.mark("camera_open")
+                self.configure_camera()
+                self.startup.mark("configure")
                 logging.info("Camera initialized successfully")
                 return
             except Exception as e:
-                if attempt == max_retries - 1:
+                if self.picam2 is not None:
+                    try:
+                        self.picam2.close()
+                    except Exception:
+                        pass
+                    self.picam2 = None
+                if attempt == len(CAMERA_RETRY_DELAYS):
                     logging.error(f"CAM001: Camera initialization failed: {str(e)}")
                     raise
-                logging.warning(f"Camera init failed (attempt {attempt+1}), retrying...")
-                time.sleep(2)
-                kill_camera_processes()
+                logging.warning(f"Camera init failed (attempt {attempt+1}): {str(e)}, retrying...")
+                release_camera(find_camera_holders())
+                time.sleep(CAMERA_RETRY_DELAYS[attempt])
+
+    def reconfigure(self, frame_size, frame_rate, bitrate=None):
+        # Resolution, frame rate and bitrate need the camera restarted; the camera stays open throughout
+        if self.picam2 is None:
+            return
+        start = time.monotonic()
+        was_recording = self.recording
+        self.stop_recording()
+        self.stop_encoder()
+        self.picam2.stop()
+        self.frame_size = frame_size
+        self.frame_rate = frame_rate
+        self.bitrate = bitrate or self.bitrate
+        self.output.size = frame_size
+        self.output.frame_interval = 1000000 / frame_rate
+        self.remux_queue.framerate = frame_rate
+        if self.event_buffer is not None:
+            self.event_buffer.size = frame_size
+        try:
+            self.configure_camera()
+        except Exception as e:
+            logging.error(f"CAM001: Camera reconfigure failed: {str(e)}")
+            raise
+        self.last_reconfigure_ms = round((time.monotonic() - start) * 1000, 1)
+        if was_recording:
+            # segment_opened reports the full gap once the first frame lands in the new segment
+            self.reconfigure_started = start
+            self.start_recording()
+        logging.info(f"Camera reconfigured to {frame_size[0]}x{frame_size[1]} at {frame_rate} fps, "
+                     f"{self.bitrate / 1000000:.1f} Mbit/s in {self.last_reconfigure_ms:.0f} ms")
 
     def close_camera(self):
         if self.picam2 is not None:
             try:
+                self.stop_encoder()
                 self.picam2.stop()
                 self.picam2.close()
                 logging.info("Camera resources released")
@@ -113,17 +631,125 @@ class CameraController:
     def cleanup_resources(self):
         if os.path.exists(PID_FILE):
             os.remove(PID_FILE)
-        if os.path.exists(COMMAND_PIPE):
-            os.remove(COMMAND_PIPE)
+        if os.path.exists(STATUS_FILE):
+            os.remove(STATUS_FILE)
+        if getattr(self, "control", None) is not None:
+            self.control.close()
+            self.control = None
+            self.scheduler.close()
+        if self.lores_bus is not None:
+            self.lores_bus.close()
+            self.packet_bus.publisher.close()
+            self.lores_bus = None
+            self.packet_bus = None
+
+    def on_request(self, request):
+        # Runs on the camera thread for every frame, so consumers only take a copy when they need one
+        self.frame_stats.on_request(request)
+        if self.encoding:
+            self.encoder_frames_in += 1
+            self.output.observe_queue_depth(self.encoder_frames_in - self.output.frames_out)
+        consumers = [consumer for consumer in (self.thumbnailer, self.preview, self.motion)
+                     if consumer is not None and consumer.wants_frame()]
+        if consumers:
+            lores = request.make_array("lores")
+            for consumer in consumers:
+                consumer.on_lores(lores)
+        if self.lores_bus is not None:
+            try:
+                with MappedArray(request, "lores") as mapped:
+                    self.lores_bus.publish(mapped.array, LORES_SIZE[0], LORES_SIZE[1], mapped.array.shape[1],
+                                           self.frame_stats.last_sensor_ns or time.monotonic_ns())
+            except Exception as e:
+                if not self.bus_failed:
+                    logging.error(f"BUS001: Lores publish failed: {str(e)}")
+                    self.bus_failed = True
+
+    def frame_timing(self):
+        current = self.output.segment_stats
+        return {
+            "camera": self.frame_stats.snapshot(),
+            "encoder_queue": {"depth": self.output.queue_depth, "max": self.output.max_queue_depth},
+            "current_segment": current.summary() if current is not None else None,
+            "last_segment": self.output.last_segment_stats
+        }
+
+    def status(self):
+        return {
+            "pid": os.getpid(),
+            "time": time.time(),
+            "recording": self.recording,
+            "encoding": self.encoding,
+            "current_file": self.current_file,
+            "frames": self.frame_stats.frames,
+            "fps": round(self.frame_stats.fps, 2),
+            "dropped_frames": self.frame_stats.dropped,
+            "timing": self.frame_timing(),
+            "last_frame_time": self.frame_stats.last_frame_time,
+            "bytes_written": self.output.bytes_written,
+            "segments": self.output.segment_count,
+            "paused": self.paused,
+            "pause_ready": self.pause_ready,
+            "resolution": list(self.frame_size),
+            "framerate": self.frame_rate,
+            "bitrate": self.bitrate,
+            "last_reconfigure_ms": self.last_reconfigure_ms,
+            "governor": self.governor.stats(),
+            "motion": self.motion.stats(),
+            "telemetry_records": self.telemetry.records,
+            "bus": {"frames": self.lores_bus.published, "packets": self.packet_bus.publisher.published,
+                    "oversized_packets": self.packet_bus.publisher.oversized} if self.lores_bus is not None else None,
+            "gps": self.gps.stats() if self.gps is not None else None,
+            "startup": self.startup.phases,
+            "writer": self.output.writer_stage.stats(),
+            "scheduler": self.scheduler.stats()
+        }
+
+    def publish_status(self):
+        # Lets the health check see camera state without opening the device itself
+        try:
+            tmp_path = STATUS_FILE + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.status(), f)
+            os.replace(tmp_path, STATUS_FILE)
+        except Exception as e:
+            logging.error(f"Status publish failed: {str(e)}")
+
+    def start_encoder(self):
+        if not self.encoding:
+            self.encoder_frames_in = self.output.frames_out
+            outputs = [output for output in (self.output, self.event_buffer, self.packet_bus) if output is not None]
+            self.picam2.start_encoder(self.encoder, outputs)
+            self.encoding = True
+
+    def stop_encoder(self):
+        if self.encoding:
+            self.encoding = False
+            self.picam2.stop_encoder()
+
+    def trigger_event(self):
+        if self.paused:
+            logging.warning("EVT002: Event trigger ignored, recording paused")
+            return None
+        if self.event_buffer is None:
+            logging.warning("EVT002: Event trigger ignored, pre-event buffer disabled")
+            return None
+        return self.event_buffer.trigger()
+
+    def new_segment_path(self):
+        stem = datetime.datetime.now().strftime("Recording_%d-%m-%y_%H-%M-%S")
+        return unique_path(VIDEO_DIR, stem, self.extension,
+                           (self.current_file, self.output.path, self.output.pending_path))
 
     def start_recording(self):
         if not self.recording and self.picam2 is not None:
             try:
-                timestamp = datetime.datetime.now().strftime("Recording_%d-%m-%y_%H-%M-%S")
-                self.current_file = f"{VIDEO_DIR}/{timestamp}.h264"
-                self.picam2.start_recording(self.current_file)
+                self.current_file = self.new_segment_path()
+                self.output.start_segment(self.current_file)
+                self.start_encoder()
                 self.recording = True
                 self.start_time = time.time()
+                self.segment_started = time.monotonic()
                 logging.info(f"Started recording: {self.current_file}")
             except Exception as e:
                 logging.error(f"VID001: Failed to start recording: {str(e)}")
@@ -132,89 +758,98 @@ class CameraController:
     def stop_recording(self):
         if self.recording and self.picam2 is not None:
             try:
-                self.picam2.stop_recording()
+                if self.event_buffer is not None:
+                    self.output.close_segment()
+                else:
+                    self.stop_encoder()
                 self.recording = False
-                self.convert_to_mp4()
+                self.telemetry.close_segment()
+                self.process_closed_segments()
                 self.current_file = None
                 self.start_time = None
+                self.segment_started = None
                 logging.info("Stopped recording")
             except Exception as e:
                 logging.error(f"VID002: Failed to stop recording: {str(e)}")
 
-    def convert_to_mp4(self):
-        if self.current_file and os.path.exists(self.current_file):
-            try:
-                mp4_path = self.current_file.replace('.h264', '.mp4')
-                cmd = ["ffmpeg", "-y", "-i", self.current_file, "-c", "copy", mp4_path]
-                subprocess.run(cmd, check=True)
-                os.remove(self.current_file)
-                logging.info(f"Converted {self.current_file} to MP4")
-            except Exception as e:
-                logging.error(f"VID003: Conversion failed: {str(e)}")
+    def rotate_recording(self):
+        if not self.continuous:
+            self.stop_recording()
+            self.start_recording()
+            return
+        if self.recording:
+            # The encoder keeps running; the output cuts over on the next keyframe
+            self.current_file = self.new_segment_path()
+            self.output.start_segment(self.current_file)
+            self.start_time = time.time()
+            self.segment_started = time.monotonic()
+            logging.info(f"Rotating recording to: {self.current_file}")
 
-def kill_camera_processes():
-    try:
-        for proc in psutil.process_iter():
+    def process_closed_segments(self):
+        while self.output.rotation_gaps:
+            path, gap_ms = self.output.rotation_gaps.popleft()
+            logging.info(f"Rotated to {path} with {gap_ms:.1f} ms gap")
+        closed = 0
+        while self.output.closed_segments:
+            path, keyframes = self.output.closed_segments.popleft()
+            self.thumbnailer.close_segment(path, keyframes)
+            if path.endswith('.h264'):
+                self.remux_queue.submit(path)
+            else:
+                self.catalog_segment(path)
+            self.last_closed = path
+            closed += 1
+        return closed
+
+    def catalog_segment(self, path):
+        self.catalog.add(path)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if stem in self.pending_locks:
+            self.pending_locks.discard(stem)
+            self.catalog.set_locked(path)
+            logging.info(f"Locked clip {path}")
+
+    def is_active_segment(self, path):
+        return path in (self.current_file, self.output.path, self.output.pending_path)
+
+def find_camera_holders():
+    # Walks /proc/*/fd for open camera device nodes; much cheaper than psutil on a Pi Zero
+    holders = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        try:
+            for fd in os.listdir(f"/proc/{pid}/fd"):
+                if os.readlink(f"/proc/{pid}/fd/{fd}").startswith(CAMERA_DEVICES):
+                    with open(f"/proc/{pid}/comm") as f:
+                        holders[int(pid)] = f.read().strip()
+                    break
+        except OSError:
+            continue
+    return holders
+
+def release_camera(holders):
+    killed = []
+    for pid, name in holders.items():
+        if any(conflict in name for conflict in CONFLICTING_PROCESSES):
             try:
-                if "libcamera" in proc.name():
-                    proc.kill()
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                os.kill(pid, signal.SIGKILL)
+                killed.append(pid)
+            except OSError:
                 pass
-        time.sleep(1)
-    except Exception as e:
-        logging.error(f"Error killing camera processes: {str(e)}")
-
-def load_settings():
-    settings = {
-        "record_length": 10,
-        "delete_after_days": 7,
-        "wifi_ssid": "FoxtelHub3677"
-    }
-    try:
-        with open("/home/picam/config.txt", "r") as f:
-            for line in f:
-                line = line.strip()
-                if line and '=' in line:
-                    key, value = line.split('=', 1)
-                    key = key.strip().lower().replace(' ', '_')
-                    value = value.strip()
-                    if key == "record_length":
-                        settings[key] = int(value)
-                    elif key == "delete_after_days":
-                        settings[key] = int(value)
-                    elif key == "wifi_ssid":
-                        settings[key] = value
-        logging.info("Config loaded successfully")
-    except FileNotFoundError:
-        logging.error("CFG001: Config file not found, using defaults")
-    except ValueError as e:
-        logging.error(f"CFG002: Invalid value in config: {str(e)}")
-    except Exception as e:
-        logging.error(f"CFG003: Config error: {str(e)}")
-    return settings
-
-def delete_old_videos(days, video_dir):
-    now = time.time()
-    cutoff = now - (days * 86400)
-    try:
-        for filename in os.listdir(video_dir):
-            if filename.startswith("Recording_") and filename.endswith(".mp4"):
-                file_path = os.path.join(video_dir, filename)
-                try:
-                    file_time = os.path.getmtime(file_path)
-                    if file_time < cutoff:
-                        os.remove(file_path)
-                        logging.info(f"Deleted old file: {filename}")
-                except Exception as e:
-                    logging.error(f"DEL001: Failed to delete {filename}: {str(e)}")
-    except Exception as e:
-        logging.error(f"DEL001: Directory scan failed: {str(e)}")
+        else:
+            logging.error(f"CAM002: Camera held by {name} (pid {pid})")
+    # Wait only as long as it takes the killed processes to go away
+    deadline = time.monotonic() + 1
+    while killed and time.monotonic() < deadline:
+        killed = [pid for pid in killed if os.path.exists(f"/proc/{pid}")]
+        time.sleep(0.05)
 
 def main():
     with open(PID_FILE, 'w') as f:
         f.write(str(os.getpid()))
     
-    settings = load_settings()
+    settings = load_settings(CONFIG_FILE)
     
     try:
         os.makedirs(VIDEO_DIR, exist_ok=True)
@@ -222,60 +857,223 @@ def main():
         logging.error(f"DIR001: Could not create directory: {str(e)}")
         return
 
-    camera = CameraController()
-    last_scan = time.time()
-    last_cleanup = time.time()
+    def segment_bytes(record_length):
+        # Preallocate a whole segment's worth (plus headroom) so each one lands in few extents
+        return int(BITRATE / 8 * record_length * 60 * 1.1)
+
+    def evicted(path):
+        camera.thumbnailer.remove(path)
+        camera.telemetry.remove(path)
+
+    catalog = SegmentCatalog(VIDEO_DIR)
+    camera = CameraController(
+        catalog,
+        continuous=settings["continuous_recording"],
+        native_mp4=settings["native_mp4"],
+        pre_event_seconds=settings["pre_event_seconds"],
+        post_event_seconds=settings["post_event_seconds"],
+        event_buffer_mb=settings["event_buffer_mb"],
+        preview_port=settings["preview_port"],
+        segment_bytes=segment_bytes(settings["record_length"]),
+        sync_interval=settings["sync_interval"],
+        frame_size=settings["resolution"],
+        frame_rate=settings["framerate"],
+        thermal_governor=settings["thermal_governor"]
+    )
+    retention = RetentionEngine(
+        catalog,
+        settings["delete_after_days"],
+        max_bytes=settings["max_video_gb"] * 1024 ** 3,
+        min_free_bytes=settings["min_free_mb"] * 1024 ** 2,
+        on_evict=evicted
+    )
+    scheduler = camera.scheduler
+    record_seconds = settings["record_length"] * 60
+    segment_length = {}  # segment start -> length it was armed with, so a new record_length waits for the next segment
+    rotation = None
+
+    def enforce_retention():
+        try:
+            retention.enforce()
+        except Exception as e:
+            logging.error(f"DEL001: Cleanup failed: {str(e)}")
+
+    def check_rotation():
+        # Re-arms itself for whatever is left, so a rotation from the control socket just pushes the deadline out
+        nonlocal rotation
+        rotation = None
+        if not camera.recording:
+            return
+        if camera.segment_started not in segment_length:
+            segment_length.clear()
+            segment_length[camera.segment_started] = record_seconds
+        remaining = camera.segment_started + segment_length[camera.segment_started] - time.monotonic()
+        if remaining <= 0:
+            logging.info("Maximum duration reached, rotating recording")
+            if camera.governor.pending():
+                # Restarting the camera in the new mode is itself the rotation
+                apply_governor()
+            else:
+                camera.rotate_recording()
+            camera.publish_status()
+            remaining = record_seconds
+        rotation = scheduler.call_later(remaining, check_rotation, "rotation")
+
+    def reconfigure(mode):
+        try:
+            camera.reconfigure(*mode)
+            return True
+        except Exception:
+            # The camera is stopped; exit through the normal shutdown path so the service restarts
+            scheduler.stop()
+            return False
+
+    def apply_governor():
+        mode = camera.governor.mode(settings["resolution"], settings["framerate"], BITRATE, camera.governor.target)
+        if reconfigure(mode):
+            camera.governor.applied(mode, camera.frame_stats.dropped)
+
+    def govern():
+        camera.governor.sample()
+        if camera.governor.pending() and not camera.recording:
+            # Nothing is being written, so any moment is a segment boundary
+            apply_governor()
+
+    def update_recording():
+        # Runs on every Wi-Fi presence or motion change (presence is None until the monitor's first observation)
+        wifi_available = wifi.present
+        parked = settings["parking_mode"] == "always" or (settings["parking_mode"] == "home" and wifi_available is True)
+        if parked != camera.motion.enabled:
+            camera.motion.set_enabled(parked)
+        if camera.paused:
+            reason, want = "Paused", False
+        elif parked:
+            # Parking mode: record only while the lores stream shows motion
+            reason = "motion" if camera.motion.active else "no motion"
+            want = camera.motion.active
+        elif wifi_available is None:
+            # Keep the current state; after a pause that is the state from before it (e.g. fast start)
+            reason, want = "Resumed", camera.recording or camera.recording_before_pause
+        else:
+            reason = "Wi-Fi available" if wifi_available else "Wi-Fi unavailable"
+            want = wifi_available is False
+        if not camera.paused:
+            camera.recording_before_pause = False
+        if camera.recording and not want:
+            logging.info(f"{reason}, stopping recording")
+            camera.stop_recording()
+            enforce_retention()
+        elif want and not camera.recording:
+            logging.info(f"{reason}, starting recording")
+            camera.start_recording()
+        if camera.recording and rotation is None:
+            check_rotation()
+        camera.publish_status()
+
+    def motion_changed(active):
+        if active and camera.event_buffer is not None:
+            # The segment only starts at the next keyframe; the event clip keeps the seconds before detection
+            camera.trigger_event()
+        update_recording()
+
+    def sample_telemetry():
+        # Temperature and throttle flags come from the governor's last sample rather than a second probe
+        governor = camera.governor
+        camera.telemetry.add_system(governor.temp, governor.throttled, camera.frame_stats.dropped,
+                                    camera.frame_stats.fps, governor.level, camera.motion.active)
+        camera.telemetry.flush()
+
+    def finish_segments():
+        # Woken by the encoder thread when a keyframe cut-over closes a segment
+        camera.process_closed_segments()
+        enforce_retention()
+
+    def check_free_space():
+        if retention.low_space():
+            enforce_retention()
+
+    def apply_settings(new, changed):
+        # Called by the config watcher with only the settings whose values changed
+        nonlocal record_seconds, settings
+        settings = new
+        if "record_length" in changed:
+            record_seconds = new["record_length"] * 60
+            camera.output.preallocate_bytes = segment_bytes(new["record_length"])
+        if changed.keys() & {"delete_after_days", "max_video_gb", "min_free_mb"}:
+            retention.max_age = new["delete_after_days"] * 86400
+            retention.max_bytes = new["max_video_gb"] * 1024 ** 3
+            retention.min_free_bytes = new["min_free_mb"] * 1024 ** 2
+            retention.stuck = False
+            enforce_retention()
+        if "wifi_ssid" in changed:
+            wifi.ssid = new["wifi_ssid"]
+        if "continuous_recording" in changed:
+            camera.continuous = new["continuous_recording"]
+        if "native_mp4" in changed:
+            # Picked up by the next segment's file name and muxer
+            camera.extension = "mp4" if new["native_mp4"] else "h264"
+        if "sync_interval" in changed:
+            camera.output.writer_stage.sync_interval = new["sync_interval"]
+        if changed.keys() & {"pre_event_seconds", "post_event_seconds", "event_buffer_mb"}:
+            if camera.event_buffer is not None and new["pre_event_seconds"] > 0:
+                camera.event_buffer.pre_us = new["pre_event_seconds"] * 1000000
+                camera.event_buffer.post_us = new["post_event_seconds"] * 1000000
+                camera.event_buffer.max_bytes = new["event_buffer_mb"] * 1024 * 1024
+            else:
+                changed = dict(changed, event_buffer=None)
+        if changed.keys() & {"motion_sensitivity", "motion_mask"}:
+            camera.motion.configure(new["motion_sensitivity"], new["motion_mask"])
+        if "parking_hold_seconds" in changed:
+            camera.motion.hold_seconds = new["parking_hold_seconds"]
+        if "parking_mode" in changed:
+            update_recording()
+        if "thermal_governor" in changed:
+            # Turning it off drops the target to level 0, applied at the next boundary like any other step
+            camera.governor.enabled = new["thermal_governor"]
+        if "resolution" in changed or "framerate" in changed:
+            if not reconfigure(camera.governor.mode(new["resolution"], new["framerate"], BITRATE)):
+                return
+            if camera.recording and rotation is None:
+                check_rotation()
+        for name in changed.keys() & {"preview_port", "fast_start", "event_buffer", "gps_device", "gps_baud"}:
+            logging.warning(f"CFG004: {name} change takes effect after a restart")
+        camera.publish_status()
+
+    camera.motion.configure(settings["motion_sensitivity"], settings["motion_mask"])
+    camera.motion.hold_seconds = settings["parking_hold_seconds"]
+    camera.motion.on_change = lambda active: scheduler.call_soon_threadsafe(lambda: motion_changed(active))
+    camera.on_resume = update_recording
+    camera.output.on_close = lambda: scheduler.call_soon_threadsafe(finish_segments)
+    wifi = WifiPresenceMonitor(settings["wifi_ssid"], on_change=lambda seen: scheduler.call_soon_threadsafe(update_recording))
+    scheduler.call_every(STATUS_INTERVAL, camera.publish_status, "status", first=0)
+    scheduler.call_every(LOW_SPACE_INTERVAL, check_free_space, "free-space")
+    scheduler.call_every(RETENTION_INTERVAL, enforce_retention, "retention", first=0)
+    scheduler.call_every(GOVERNOR_INTERVAL, govern, "governor")
+    scheduler.call_every(TELEMETRY_INTERVAL, sample_telemetry, "telemetry")
+    if settings["gps_device"] != "none":
+        camera.gps = GpsReader(camera.telemetry.add_gps, settings["gps_device"], settings["gps_baud"])
+        camera.gps.start()
+    if settings["fast_start"]:
+        # Record from ignition; update_recording stops again if the home network turns out to be in range
+        logging.info("Fast start, recording before Wi-Fi presence is known")
+        camera.start_recording()
+        check_rotation()
+    wifi.start()
+    update_recording()  # arms motion detection straight away when parking mode is "always"
+    watcher = ConfigWatcher(scheduler, settings, apply_settings, CONFIG_FILE)
 
     try:
-        while camera.running:
-            current_time = time.time()
-            
-            # Check for external commands
-            camera.check_commands()
-
-            # Check Wi-Fi status
-            if current_time - last_scan > 30:
-                try:
-                    result = subprocess.run(
-                        ["iwlist", "wlan0", "scan"],
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        text=True,
-                        timeout=15
-                    )
-                    wifi_available = settings["wifi_ssid"] in result.stdout
-                    
-                    if wifi_available and camera.recording:
-                        logging.info("Wi-Fi available, stopping recording")
-                        camera.stop_recording()
-                    elif not wifi_available and not camera.recording:
-                        logging.info("Wi-Fi unavailable, starting recording")
-                        camera.start_recording()
-                    
-                    last_scan = current_time
-                except Exception as e:
-                    logging.error(f"WIFI001: Scan failed: {str(e)}")
-
-            # Check recording duration
-            if camera.recording and (current_time - camera.start_time) > (settings["record_length"] * 60):
-                logging.info("Maximum duration reached, rotating recording")
-                camera.stop_recording()
-                camera.start_recording()
-
-            # Cleanup old files
-            if current_time - last_cleanup > 3600:
-                try:
-                    delete_old_videos(settings["delete_after_days"], VIDEO_DIR)
-                    last_cleanup = current_time
-                except Exception as e:
-                    logging.error(f"DEL001: Cleanup failed: {str(e)}")
-
-            time.sleep(1)
+        # Sleeps until the next due job, a control command or a wakeup from another thread
+        scheduler.run()
 
     except Exception as e:
         logging.error(f"Fatal error: {str(e)}")
     finally:
-        camera.cleanup_resources()
+        watcher.close()
+        wifi.stop(timeout=2)
+        if camera.gps is not None:
+            camera.gps.stop(timeout=2)
+        camera.shutdown()
         if os.path.exists(PID_FILE):
             os.remove(PID_FILE)
 
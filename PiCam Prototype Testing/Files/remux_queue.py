@@ -0,0 +1,90 @@
+import os
+import glob
+import queue
+import shutil
+import logging
+import threading
+import subprocess
+
+REMUX_QUEUE_SIZE = 8
+
+class RemuxQueue:
+    # Remuxes finished .h264 segments to MP4 on a background thread so the recorder never waits on ffmpeg
+    def __init__(self, video_dir, framerate, maxsize=REMUX_QUEUE_SIZE, is_active=None, on_converted=None):
+        self.video_dir = video_dir
+        self.on_converted = on_converted
+        self.framerate = framerate
+        self.queue = queue.Queue(maxsize)
+        self.is_active = is_active or (lambda path: False)
+        self.overflowed = False
+        self.thread = threading.Thread(target=self._run, name="remux", daemon=True)
+        # Lowest CPU and idle-class IO priority so remuxing only uses what recording leaves over
+        self.prefix = ["nice", "-n", "19"]
+        if shutil.which("ionice"):
+            self.prefix += ["ionice", "-c", "3"]
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+
+    def submit(self, path):
+        try:
+            self.queue.put_nowait(path)
+            return True
+        except queue.Full:
+            # Left on disk; recover() picks it up once the queue has drained
+            self.overflowed = True
+            logging.warning(f"VID004: Remux queue full, deferring {path}")
+            return False
+
+    def recover(self):
+        for part in glob.glob(os.path.join(self.video_dir, "Recording_*.mp4.part")):
+            try:
+                os.remove(part)
+            except OSError as e:
+                logging.error(f"DEL001: Failed to delete {part}: {str(e)}")
+        orphans = sorted(glob.glob(os.path.join(self.video_dir, "Recording_*.h264")), key=os.path.getmtime)
+        queued = 0
+        for path in orphans:
+            if self.is_active(path):
+                continue
+            if not self.submit(path):
+                break
+            queued += 1
+        if queued:
+            logging.info(f"Queued {queued} orphaned recordings for conversion")
+
+    def _run(self):
+        while True:
+            path = self.queue.get()
+            if path is None:
+                return
+            self.remux(path)
+            if self.overflowed and self.queue.empty():
+                self.overflowed = False
+                self.recover()
+
+    def remux(self, path):
+        if not os.path.exists(path):
+            return
+        mp4_path = path[:-len(".h264")] + ".mp4"
+        part_path = mp4_path + ".part"
+        try:
+            cmd = self.prefix + ["ffmpeg", "-y", "-loglevel", "error", "-framerate", str(self.framerate),
+                                 "-i", path, "-c", "copy", "-f", "mp4", part_path]
+            subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL)
+            os.replace(part_path, mp4_path)
+            os.remove(path)
+            logging.info(f"Converted {path} to MP4")
+            if self.on_converted is not None:
+                self.on_converted(mp4_path)
+        except Exception as e:
+            logging.error(f"VID003: Conversion failed: {str(e)}")
+            if os.path.exists(part_path):
+                os.remove(part_path)
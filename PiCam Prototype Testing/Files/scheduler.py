@@ -0,0 +1,141 @@
+import os
+import time
+import heapq
+import threading
+import logging
+import itertools
+import selectors
+import collections
+
+LATENCY_SAMPLES = 512  # recent job latencies kept for percentiles
+
+class Timer:
+    def __init__(self, when, callback, name, interval=None):
+        self.when = when
+        self.callback = callback
+        self.name = name
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class Scheduler:
+    # Single-threaded event loop for the recorder: one select() call sleeps until the next timer
+    # is due or a registered socket is readable, so an idle recorder wakes only when there is work.
+    # Other threads hand work over with call_soon_threadsafe, which writes to a wakeup pipe.
+    def __init__(self, selector=None):
+        self.selector = selector or selectors.DefaultSelector()
+        self.timers = []  # heap of (when, sequence, Timer)
+        self.sequence = itertools.count()
+        self.pending = collections.deque()
+        self.wake_read, self.wake_write = os.pipe()
+        os.set_blocking(self.wake_read, False)
+        os.set_blocking(self.wake_write, False)
+        self.selector.register(self.wake_read, selectors.EVENT_READ, self._drain_wakeup)
+        self.running = False
+        self.stopping = False  # set by stop(), even before run() starts
+        self.wake_lock = threading.Lock()  # keeps late call_soon_threadsafe writes off a closed pipe
+        self.wakeups = 0
+        self.jobs_run = 0
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.max_latency = 0.0
+        self.job_latency = {}  # job name -> latency of its last run
+
+    def call_at(self, when, callback, name=None):
+        # when is on the time.monotonic() clock
+        timer = Timer(when, callback, name or callback.__name__)
+        heapq.heappush(self.timers, (when, next(self.sequence), timer))
+        return timer
+
+    def call_later(self, delay, callback, name=None):
+        return self.call_at(time.monotonic() + delay, callback, name)
+
+    def call_every(self, interval, callback, name=None, first=None):
+        timer = Timer(time.monotonic() + (interval if first is None else first), callback,
+                      name or callback.__name__, interval)
+        heapq.heappush(self.timers, (timer.when, next(self.sequence), timer))
+        return timer
+
+    def call_soon_threadsafe(self, callback):
+        self.pending.append(callback)
+        with self.wake_lock:
+            self.wakeup()
+
+    def wakeup(self):
+        # Also called from signal handlers, which run on the loop's own thread, so it takes no lock
+        if self.wake_write is None:
+            return  # closed; whatever was queued is dropped with the loop
+        try:
+            os.write(self.wake_write, b"\0")
+        except BlockingIOError:
+            pass  # the pipe is already full of wakeups, the loop will see this callback anyway
+
+    def _drain_wakeup(self, fileobj, mask):
+        try:
+            while os.read(self.wake_read, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def run(self):
+        self.running = not self.stopping
+        while self.running:
+            self.run_once()
+
+    def run_once(self):
+        timeout = None
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+        if self.timers:
+            timeout = max(0.0, self.timers[0][0] - time.monotonic())
+        events = self.selector.select(timeout)
+        self.wakeups += 1
+        for key, mask in events:
+            key.data(key.fileobj, mask)
+        while self.pending:
+            self._run_job(self.pending.popleft(), "pending")
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            when, _, timer = heapq.heappop(self.timers)
+            if timer.cancelled:
+                continue
+            latency = time.monotonic() - when
+            self.latencies.append(latency)
+            self.max_latency = max(self.max_latency, latency)
+            self.job_latency[timer.name] = latency
+            self._run_job(timer.callback, timer.name)
+            if timer.interval is not None and not timer.cancelled:
+                # Keep a fixed cadence, but skip missed runs rather than firing them back to back
+                timer.when = max(when + timer.interval, time.monotonic())
+                heapq.heappush(self.timers, (timer.when, next(self.sequence), timer))
+
+    def _run_job(self, callback, name):
+        self.jobs_run += 1
+        try:
+            callback()
+        except Exception as e:
+            logging.error(f"SCH001: Scheduled job {name} failed: {str(e)}")
+
+    def stop(self):
+        self.stopping = True
+        self.running = False
+
+    def stats(self):
+        ordered = sorted(self.latencies)
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000, 3) if ordered else 0.0
+        return {
+            "wakeups": self.wakeups,
+            "jobs_run": self.jobs_run,
+            "timers": len(self.timers),
+            "job_latency_ms": {"p50": pct(50), "p99": pct(99), "max": round(self.max_latency * 1000, 3)},
+            "last_latency_ms": {name: round(latency * 1000, 3) for name, latency in self.job_latency.items()}
+        }
+
+    def close(self):
+        self.selector.unregister(self.wake_read)
+        with self.wake_lock:
+            os.close(self.wake_read)
+            os.close(self.wake_write)
+            self.wake_write = None
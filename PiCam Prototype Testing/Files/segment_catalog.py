@@ -0,0 +1,146 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+CATALOG_NAME = ".catalog.sqlite"
+SEGMENT_PREFIXES = {"Recording_": "segment", "Event_": "event"}
+
+class SegmentCatalog:
+    # Persistent record of finished clips so retention never has to list and stat VIDEO_DIR
+    def __init__(self, video_dir, path=None):
+        self.video_dir = video_dir
+        self.path = path or os.path.join(video_dir, CATALOG_NAME)
+        self.lock = threading.Lock()
+        fresh = not os.path.exists(self.path)
+        self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        # WAL with relaxed syncing keeps catalog updates to a few small appends on the card
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS segments (
+            path TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            closed REAL NOT NULL,
+            locked INTEGER NOT NULL DEFAULT 0)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS segments_evict ON segments (locked, closed)")
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM segments").fetchone()[0]
+        if fresh:
+            self.import_directory()
+
+    def add(self, path, kind="segment", locked=False):
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            logging.error(f"CAT001: Cannot catalog {path}: {str(e)}")
+            return
+        with self.lock:
+            row = self.db.execute("SELECT size FROM segments WHERE path = ?", (path,)).fetchone()
+            if row:
+                self.total_bytes -= row[0]
+            self.db.execute("INSERT OR REPLACE INTO segments (path, kind, size, closed, locked) VALUES (?, ?, ?, ?, ?)",
+                            (path, kind, st.st_size, st.st_mtime, int(locked or kind == "event")))
+            self.total_bytes += st.st_size
+
+    def remove(self, path):
+        with self.lock:
+            row = self.db.execute("SELECT size FROM segments WHERE path = ?", (path,)).fetchone()
+            if row:
+                self.db.execute("DELETE FROM segments WHERE path = ?", (path,))
+                self.total_bytes -= row[0]
+
+    def set_locked(self, path, locked=True):
+        with self.lock:
+            cursor = self.db.execute("UPDATE segments SET locked = ? WHERE path = ?", (int(locked), path))
+            return cursor.rowcount > 0
+
+    def is_locked(self, path):
+        with self.lock:
+            row = self.db.execute("SELECT locked FROM segments WHERE path = ?", (path,)).fetchone()
+            return bool(row and row[0])
+
+    def oldest_unlocked(self):
+        # Served straight off the (locked, closed) index, so eviction cost does not grow with the catalog
+        with self.lock:
+            return self.db.execute(
+                "SELECT path, size, closed FROM segments WHERE locked = 0 ORDER BY closed LIMIT 1").fetchone()
+
+    def count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+
+    def import_directory(self):
+        # Scan for clips the catalog does not know yet: all of them the first time, new ones on a resync
+        with self.lock:
+            known = {row[0] for row in self.db.execute("SELECT path FROM segments")}
+        imported = 0
+        for entry in os.scandir(self.video_dir):
+            for prefix, kind in SEGMENT_PREFIXES.items():
+                if entry.name.startswith(prefix) and entry.name.endswith(".mp4") and entry.path not in known \
+                        and entry.is_file():
+                    self.add(entry.path, kind)
+                    imported += 1
+        if imported:
+            logging.info(f"Catalogued {imported} existing clips")
+        return imported
+
+    def resync(self):
+        # After files were deleted (or copied in) behind the catalog's back; returns the rows dropped
+        with self.lock:
+            paths = [row[0] for row in self.db.execute("SELECT path FROM segments")]
+        missing = [path for path in paths if not os.path.exists(path)]
+        for path in missing:
+            self.remove(path)
+        self.import_directory()
+        return len(missing)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+class RetentionEngine:
+    # Evicts the oldest unlocked clips until age, byte quota and free-space watermark are all satisfied
+    def __init__(self, catalog, max_age_days, max_bytes=0, min_free_bytes=1024 ** 3, on_evict=None):
+        self.catalog = catalog
+        self.on_evict = on_evict
+        self.max_age = max_age_days * 86400
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.stuck = False
+
+    def free_bytes(self):
+        stat = os.statvfs(self.catalog.video_dir)
+        return stat.f_bavail * stat.f_frsize
+
+    def low_space(self):
+        return self.free_bytes() < self.min_free_bytes
+
+    def enforce(self):
+        cutoff = time.time() - self.max_age
+        evicted = 0
+        while True:
+            oldest = self.catalog.oldest_unlocked()
+            over_quota = self.max_bytes and self.catalog.total_bytes > self.max_bytes
+            if oldest is None:
+                if (over_quota or self.low_space()) and not self.stuck:
+                    logging.error("DEL002: Retention cannot free space, only locked clips remain")
+                    self.stuck = True
+                break
+            path, size, closed = oldest
+            if not (closed < cutoff or over_quota or self.low_space()):
+                break
+            try:
+                os.remove(path)
+                logging.info(f"Deleted old file: {os.path.basename(path)}")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logging.error(f"DEL001: Failed to delete {os.path.basename(path)}: {str(e)}")
+                break
+            self.catalog.remove(path)
+            if self.on_evict is not None:
+                self.on_evict(path)
+            self.stuck = False
+            evicted += 1
+        return evicted
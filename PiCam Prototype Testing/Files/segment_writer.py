@@ -0,0 +1,201 @@
+import os
+import time
+import queue
+import ctypes
+import logging
+import threading
+
+BLOCK_SIZE = 1024 * 1024  # every write is a whole, aligned block except the tail pushed at a sync
+MAX_PENDING_BLOCKS = 16  # ~13 s at 10 Mbit/s of card stall absorbed before the encoder thread waits
+SYNC_INTERVAL = 5  # seconds between fdatasync calls, bounds what a power cut can lose
+SLOW_WRITE_MS = 500
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+FALLOC_FL_KEEP_SIZE = 1
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _fallocate = _libc.fallocate
+    _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+except (OSError, AttributeError):
+    _fallocate = None
+
+def preallocate(fd, length):
+    # fallocate(2) rather than os.posix_fallocate: glibc's posix_fallocate falls back to writing zeros
+    # on filesystems without support (vfat), which is exactly the I/O this is meant to avoid.
+    # KEEP_SIZE leaves the file length at what has been written, so a crash never exposes a zero tail.
+    if _fallocate is None or length <= 0:
+        return False
+    return _fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, length) == 0
+
+def unique_path(directory, stem, extension, in_use=()):
+    # Names only have one-second resolution, so a rotate, pause/resume or restart inside the same
+    # second would reopen (and truncate) the previous file. A counter suffix keeps them apart; the
+    # remuxed and partial forms of a name count as taken too.
+    candidate = stem
+    number = 1
+    while True:
+        path = os.path.join(directory, f"{candidate}.{extension}")
+        base = os.path.join(directory, candidate)
+        if path not in in_use and not any(os.path.exists(base + suffix) for suffix in (".h264", ".mp4", ".mp4.part")):
+            return path
+        number += 1
+        candidate = f"{stem}_{number}"
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.max_ms = 0.0
+        self.total = 0
+
+    def add(self, ms):
+        index = 0
+        while index < len(self.buckets) and ms > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.max_ms = max(self.max_ms, ms)
+        self.total += 1
+
+    def percentile(self, pct):
+        # Upper bound of the bucket holding the pct-th percentile (the maximum for the overflow bucket)
+        target = self.total * pct / 100
+        seen = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target and seen:
+                return bucket
+        return round(self.max_ms, 2)
+
+    def snapshot(self):
+        labels = [f"<={bucket}" for bucket in self.buckets] + [f">{self.buckets[-1]}"]
+        return {"buckets": {label: count for label, count in zip(labels, self.counts) if count},
+                "count": self.total, "max_ms": round(self.max_ms, 2)}
+
+class WriteStage:
+    # One thread that owns all segment file I/O, so the encoder thread only ever copies into memory
+    def __init__(self, sync_interval=SYNC_INTERVAL, max_pending=MAX_PENDING_BLOCKS):
+        self.sync_interval = sync_interval
+        self.queue = queue.Queue(max_pending)
+        self.write_latency = LatencyHistogram()
+        self.sync_latency = LatencyHistogram()
+        self.backpressure_waits = 0
+        self.thread = threading.Thread(target=self._run, name="segment-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, job):
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            self.backpressure_waits += 1
+            self.queue.put(job)
+
+    def stop(self, timeout=None):
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def after(self, callback):
+        # Calls callback on the writer thread once everything submitted so far, closes included, is done
+        self.submit((None, "after", 0, callback))
+
+    def stats(self):
+        return {"write_ms": self.write_latency.snapshot(), "sync_ms": self.sync_latency.snapshot(),
+                "pending_blocks": self.queue.qsize(), "backpressure_waits": self.backpressure_waits}
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            writer, op, offset, data = job
+            if writer is None:
+                data()
+                continue
+            if writer.failed and op != "close":
+                continue
+            try:
+                getattr(writer, f"_do_{op}")(self, offset, data)
+            except Exception as e:
+                writer.failed = True
+                logging.error(f"VID005: Segment write failed for {writer.path}: {str(e)}")
+
+    def timed_write(self, fd, data, offset):
+        start = time.perf_counter()
+        os.pwrite(fd, data, offset)
+        ms = (time.perf_counter() - start) * 1000
+        self.write_latency.add(ms)
+        if ms > SLOW_WRITE_MS:
+            logging.warning(f"VID006: SD write of {len(data)} bytes took {ms:.0f} ms")
+
+    def timed_sync(self, fd):
+        start = time.perf_counter()
+        os.fdatasync(fd)
+        self.sync_latency.add((time.perf_counter() - start) * 1000)
+
+class SegmentWriter:
+    # File-like sink for one segment. write() appends to a block buffer on the caller's thread;
+    # full blocks, periodic tail syncs and the final truncate all happen on the WriteStage thread.
+    def __init__(self, path, stage, preallocate_bytes=0):
+        self.path = path
+        self.stage = stage
+        self.buffer = bytearray()
+        self.buffer_offset = 0  # file offset of buffer[0], always block aligned
+        self.position = 0
+        self.last_sync = time.monotonic()
+        self.fd = None
+        self.failed = False
+        self.closed = False
+        stage.submit((self, "open", preallocate_bytes, None))
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        full = len(self.buffer) // BLOCK_SIZE * BLOCK_SIZE
+        if full:
+            self.stage.submit((self, "write", self.buffer_offset, bytes(self.buffer[:full])))
+            del self.buffer[:full]
+            self.buffer_offset += full
+        now = time.monotonic()
+        if now - self.last_sync >= self.stage.sync_interval:
+            # The partial tail is written now and again once its block fills, keeping later writes aligned
+            self.last_sync = now
+            self.stage.submit((self, "sync", self.buffer_offset, bytes(self.buffer)))
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass  # durability comes from the stage's periodic fdatasync, not per-fragment flushes
+
+    def close(self, on_closed=None):
+        if not self.closed:
+            self.closed = True
+            self.stage.submit((self, "close", self.buffer_offset, (bytes(self.buffer), on_closed)))
+            self.buffer = bytearray()
+
+    def _do_open(self, stage, preallocate_bytes, data):
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        preallocate(self.fd, preallocate_bytes)
+
+    def _do_write(self, stage, offset, data):
+        stage.timed_write(self.fd, data, offset)
+
+    def _do_sync(self, stage, offset, data):
+        if data:
+            stage.timed_write(self.fd, data, offset)
+        stage.timed_sync(self.fd)
+
+    def _do_close(self, stage, offset, data):
+        tail, on_closed = data
+        try:
+            if self.fd is not None:
+                if tail:
+                    stage.timed_write(self.fd, tail, offset)
+                # Hands back whatever preallocation the segment did not use
+                os.ftruncate(self.fd, self.position)
+                stage.timed_sync(self.fd)
+                os.close(self.fd)
+                self.fd = None
+        finally:
+            if on_closed is not None:
+                on_closed()
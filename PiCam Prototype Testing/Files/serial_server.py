@@ -1,100 +1,244 @@
 import os
-import socket
+import asyncio
 import threading
-import subprocess
+import collections
 import time
 import json
+import inspect
 import logging
-from gpiozero import Buzzer
-from picamera2 import Picamera2
-import psutil
+from concurrent.futures import ThreadPoolExecutor
+import hardware
+from hardware import read_throttled, read_temperature, memory_percent
+from control_script import control_request
+from wifi_presence import WifiPresenceMonitor
+from clip_server import start_clip_server
+from settings import VIDEO_DIR, HOTSPOT_IP
+from structured_logging import setup_logging, read_recent_errors
+from frame_bus import FrameSubscriber, LORES_BUS
 
 # Configuration
 SERIAL_FILE = "/home/pi/serialnumber.txt"
-SERVER_IP = "192.168.4.1"
+SERVER_IP = HOTSPOT_IP
 PORT = 4545
 BUZZER_PIN = 11
 HEALTH_CHECK_PATTERN = [0.2, 0.2, 0.5, 0.2, 0.2, 0.5]  # AirTag pattern
-VIDEO_DIR = "/home/pi/videos"
+PREFERRED_SSID = "Preferred_SSID"  # Replace with your SSID
+SESSION_HELLO = "PICAM/1"  # first line of a persistent session
+MAX_LINE = 4096
+MAX_INFLIGHT = 4  # requests one client may have running at once
+MAX_PIPELINE = 32  # replies queued for one client before we stop reading from it
+IDLE_TIMEOUT = 300  # seconds a connection may sit without sending a request
+RECORDER_STATUS_FILE = "/dev/shm/picam_status.json"
+LOG_FILE = "/home/pi/serial_server.log"
+ERROR_LOG_FILE = "/home/pi/serial_server_errors.log"
+ERROR_LOGS = ["/home/picam/recording_errors.log", ERROR_LOG_FILE]
+MAX_ERRORS = 100
+RECORDER_STALE_SECONDS = 10
+CAMERA_STALL_SECONDS = 2
+TELEMETRY_INTERVAL = 2  # seconds between samples
+TELEMETRY_HISTORY = 300  # samples kept in memory, 10 minutes at the default interval
+SUBSCRIBER_BACKLOG = 8  # samples queued for a slow subscriber before the oldest is dropped
+CHECK_TTL = {"camera": 5, "storage": 30, "power": 10, "thermal": 10, "memory": 10}  # seconds each result is reused
 
 # Configure logging
-logging.basicConfig(
-    filename='/home/pi/serial_server.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+setup_logging(LOG_FILE, ERROR_LOG_FILE, "server")
+
+
+def read_recorder_status():
+    # The recorder republishes this every loop; None means no recorder is running
+    try:
+        with open(RECORDER_STATUS_FILE, "r") as f:
+            status = json.load(f)
+        os.kill(status["pid"], 0)
+        return status
+    except PermissionError:
+        return status
+    except (OSError, ValueError, KeyError):
+        return None
 
 class HealthChecker:
+    # Subchecks run concurrently and each result is reused for its TTL, so repeated
+    # health checks from the app cost almost nothing
     def __init__(self):
-        self.buzzer = Buzzer(BUZZER_PIN)
-        self.camera = Picamera2()
-        self.errors = []
-        
+        self.cache = {}
+        self.locks = {name: threading.Lock() for name in CHECK_TTL}
+        self.pool = ThreadPoolExecutor(max_workers=len(CHECK_TTL), thread_name_prefix="health")
+        self.buzzer_lock = threading.Lock()
+        self.buzzer_errors = []
+        self.frame_bus = None
+
+    def _cached(self, name, check):
+        # One caller refreshes a stale result while concurrent callers wait for it
+        with self.locks[name]:
+            cached = self.cache.get(name)
+            if cached and time.monotonic() - cached[0] < CHECK_TTL[name]:
+                return cached[1]
+            errors = check()
+            self.cache[name] = (time.monotonic(), errors)
+            return errors
+
+    def play_buzzer_pattern(self):
+        if not self.buzzer_lock.acquire(blocking=False):
+            return
+        threading.Thread(target=self._play_buzzer_pattern, name="health-buzzer", daemon=True).start()
+
     def _play_buzzer_pattern(self):
+        buzzer = None
         try:
+            buzzer = hardware.Buzzer(BUZZER_PIN)
             for duration in HEALTH_CHECK_PATTERN:
-                self.buzzer.on()
+                buzzer.on()
                 time.sleep(duration)
-                self.buzzer.off()
+                buzzer.off()
                 time.sleep(0.1)
+            self.buzzer_errors = []
         except Exception as e:
-            self.errors.append("BUZ001: Buzzer test failed")
+            # Reported with the next health check since this one has already answered
+            self.buzzer_errors = ["BUZ001: Buzzer test failed"]
             logging.error(f"Buzzer error: {str(e)}")
         finally:
-            self.buzzer.close()
+            if buzzer is not None:
+                buzzer.close()
+            self.buzzer_lock.release()
 
     def check_camera(self):
+        # The recorder owns the camera; judge it by what it publishes instead of opening the device again
+        status = read_recorder_status()
+        if status is None:
+            return ["CAM003: Recorder not running"]
+        if time.time() - status["time"] > RECORDER_STALE_SECONDS:
+            return ["CAM003: Recorder not responding"]
         try:
-            config = self.camera.create_still_configuration()
-            self.camera.configure(config)
-            self.camera.start()
-            self.camera.capture_file("/tmp/healthcheck.jpg")
-            os.remove("/tmp/healthcheck.jpg")
-            self.camera.stop()
-        except Exception as e:
-            self.errors.append("CAM002: Camera test failed")
-            logging.error(f"Camera check failed: {str(e)}")
-        finally:
-            self.camera.close()
+            if self.frame_bus is None or self.frame_bus.header()[0] != status.get("pid"):
+                # First check, or the recorder restarted and created a new segment
+                if self.frame_bus is not None:
+                    self.frame_bus.close()
+                    self.frame_bus = None
+                self.frame_bus = FrameSubscriber(LORES_BUS)
+            frame = self.frame_bus.latest()
+        except (OSError, ValueError) as e:
+            logging.error(f"Frame bus error: {str(e)}")
+            return ["CAM004: Camera not delivering frames"]
+        if frame is None:
+            return ["CAM004: Camera not delivering frames"]
+        age = (time.monotonic_ns() - frame.timestamp_ns) / 1e9
+        frame.release()
+        if age > CAMERA_STALL_SECONDS:
+            return ["CAM004: Camera not delivering frames"]
+        return []
 
     def check_storage(self):
         try:
             stat = os.statvfs(VIDEO_DIR)
             available_gb = (stat.f_bavail * stat.f_frsize) / (1024**3)
             if available_gb < 1:  # 1GB minimum
-                self.errors.append("STR001: Low storage ({:.1f}GB)".format(available_gb))
+                return ["STR001: Low storage ({:.1f}GB)".format(available_gb)]
+            return []
         except Exception as e:
-            self.errors.append("STR002: Storage check failed")
             logging.error(f"Storage error: {str(e)}")
+            return ["STR002: Storage check failed"]
 
-    def check_system(self):
+    def check_power(self):
         try:
-            # Check voltage
-            throttled = subprocess.check_output(["vcgencmd", "get_throttled"]).decode().strip()
-            if "0x50000" in throttled:
-                self.errors.append("SYS001: Under-voltage detected")
-                
-            # Check temperature
-            temp = float(subprocess.check_output(["vcgencmd", "measure_temp"])
-                .decode().split("=")[1].split("'")[0])
+            if read_throttled() & 0x50000 == 0x50000:
+                return ["SYS001: Under-voltage detected"]
+            return []
+        except Exception as e:
+            logging.error(f"System check error: {str(e)}")
+            return ["SYS004: System check failed"]
+
+    def check_thermal(self):
+        try:
+            temp = read_temperature()
             if temp > 85:
-                self.errors.append("SYS002: High temperature ({:.1f}°C)".format(temp))
-                
-            # Check memory
-            mem = psutil.virtual_memory()
-            if mem.percent > 90:
-                self.errors.append("SYS003: High memory usage ({:.1f}%)".format(mem.percent))
-                
+                return ["SYS002: High temperature ({:.1f}°C)".format(temp)]
+            return []
+        except Exception as e:
+            logging.error(f"System check error: {str(e)}")
+            return ["SYS004: System check failed"]
+
+    def check_memory(self):
+        try:
+            percent = memory_percent()
+            if percent > 90:
+                return ["SYS003: High memory usage ({:.1f}%)".format(percent)]
+            return []
         except Exception as e:
-            self.errors.append("SYS004: System check failed")
             logging.error(f"System check error: {str(e)}")
+            return ["SYS004: System check failed"]
 
-    def perform_full_check(self):
-        self.check_camera()
-        self._play_buzzer_pattern()
-        self.check_storage()
-        self.check_system()
-        return self.errors
+    def perform_full_check(self, buzz=True):
+        if buzz:
+            self.play_buzzer_pattern()
+        futures = [self.pool.submit(self._cached, name, getattr(self, f"check_{name}")) for name in CHECK_TTL]
+        errors = []
+        for future in futures:
+            for error in future.result():
+                if error not in errors:
+                    errors.append(error)
+        return errors + self.buzzer_errors
+
+class TelemetrySampler:
+    # Samples system and recorder stats into a fixed-size ring buffer and fans each
+    # sample out to subscribers, so the app can watch live stats without health checks
+    def __init__(self, interval=TELEMETRY_INTERVAL, history=TELEMETRY_HISTORY):
+        self.interval = interval
+        self.samples = collections.deque(maxlen=history)
+        self.subscribers = set()
+        self.last_bytes = None
+
+    async def run(self):
+        while True:
+            try:
+                sample = await run_blocking(self.take_sample)
+                self.samples.append(sample)
+                for queue in self.subscribers:
+                    if queue.full():
+                        queue.get_nowait()
+                    queue.put_nowait(sample)
+            except Exception as e:
+                logging.error(f"Telemetry sample failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def take_sample(self):
+        sample = {"t": round(time.time(), 1)}
+        try:
+            sample["temp_c"] = round(read_temperature(), 1)
+            sample["throttled"] = read_throttled()
+        except Exception:
+            pass
+        sample["mem_percent"] = memory_percent()
+        try:
+            stat = os.statvfs(VIDEO_DIR)
+            sample["free_gb"] = round(stat.f_bavail * stat.f_frsize / 1024 ** 3, 2)
+        except OSError:
+            pass
+        status = read_recorder_status()
+        if status is not None:
+            sample["recording"] = status["recording"]
+            sample["fps"] = status["fps"]
+            sample["segments"] = status.get("segments", 0)
+            written = status.get("bytes_written", 0)
+            if self.last_bytes is not None and written >= self.last_bytes[1]:
+                elapsed = status["time"] - self.last_bytes[0]
+                if elapsed > 0:
+                    sample["bitrate_kbps"] = round((written - self.last_bytes[1]) * 8 / elapsed / 1000)
+            self.last_bytes = (status["time"], written)
+        else:
+            sample["recording"] = None
+            self.last_bytes = None
+        return sample
+
+    def subscribe(self):
+        queue = asyncio.Queue(SUBSCRIBER_BACKLOG)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+health_checker = HealthChecker()
+telemetry = TelemetrySampler()
 
 def get_serial_number():
     try:
@@ -104,62 +248,220 @@ def get_serial_number():
         logging.error(f"Serial number error: {str(e)}")
         return "UNKNOWN"
 
-def handle_client(conn):
+def run_health_check(buzz=True):
+    errors = health_checker.perform_full_check(buzz)
+    return json.dumps({
+        "status": "OK" if not errors else "ERROR",
+        "errors": errors
+    })
+
+async def run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+async def cmd_serial_number(session, args):
+    return await run_blocking(get_serial_number)
+
+async def cmd_health_check(session, args):
+    # "performHealthCheck quiet" skips the buzzer pattern
+    return await run_blocking(run_health_check, args.strip() != "quiet")
+
+async def cmd_trigger_event(session, args):
     try:
-        request = conn.recv(1024).decode().strip()
-        logging.info(f"Received command: {request}")
-
-        if request == "sendserialnumber":
-            serial = get_serial_number()
-            conn.send(serial.encode())
-            
-        elif request == "performHealthCheck":
-            checker = HealthChecker()
-            errors = checker.perform_full_check()
-            response = json.dumps({
-                "status": "OK" if not errors else "ERROR",
-                "errors": errors
-            })
-            conn.send(response.encode())
-            
+        response = await run_blocking(control_request, "event")
+    except (FileNotFoundError, ConnectionRefusedError):
+        return json.dumps({"status": "ERROR", "error": "recorder not running"})
+    except (OSError, RuntimeError) as e:
+        return json.dumps({"status": "ERROR", "error": str(e)})
+    return json.dumps({"status": "OK", "file": response.get("file")})
+
+async def cmd_recent_errors(session, args):
+    # "recentErrors [CODE] [limit]", newest first from the recorder's and this server's error logs
+    code = None
+    limit = 20
+    for arg in args.split():
+        if arg.isdigit():
+            limit = min(int(arg), MAX_ERRORS)
         else:
-            conn.send(b"Invalid command")
-            
+            code = arg.upper()
+    errors = await run_blocking(read_recent_errors, ERROR_LOGS, code, limit)
+    return json.dumps({"status": "OK", "errors": errors})
+
+async def cmd_subscribe(session, args):
+    # Streams a full snapshot, then one line per sample with only the fields that changed
+    queue = telemetry.subscribe()
+    try:
+        last = dict(telemetry.samples[-1]) if telemetry.samples else {}
+        yield json.dumps({"type": "snapshot", "history": len(telemetry.samples), **last})
+        while True:
+            sample = await queue.get()
+            delta = {key: value for key, value in sample.items() if last.get(key) != value}
+            last = sample
+            yield json.dumps({"type": "delta", **delta})
+    finally:
+        telemetry.unsubscribe(queue)
+
+COMMANDS = {
+    "sendserialnumber": cmd_serial_number,
+    "performHealthCheck": cmd_health_check,
+    "triggerEvent": cmd_trigger_event,
+    "recentErrors": cmd_recent_errors,
+    "subscribe": cmd_subscribe,
+}
+
+async def dispatch(session, request):
+    logging.info(f"Received command: {request}")
+    name, _, args = request.partition(" ")
+    handler = COMMANDS.get(name)
+    if handler is None:
+        return "Invalid command"
+    if inspect.isasyncgenfunction(handler):
+        # Streaming commands hand back their generator; the session writes each line in turn
+        return handler(session, args)
+    try:
+        return await handler(session, args)
     except Exception as e:
         logging.error(f"Client handling error: {str(e)}")
-    finally:
-        conn.close()
+        return json.dumps({"status": "ERROR", "errors": [f"SRV001: {name} failed"]})
 
-def network_monitor():
-    while True:
+class ClientSession:
+    # A client that opens with SESSION_HELLO gets a persistent, newline-framed session where
+    # requests can be pipelined and replies come back in order. "subscribe" streams until the
+    # next request arrives on the session, which ends it with a {"type": "end"} line before that
+    # request's reply. Anything else is the original one-shot protocol: one command, a raw reply,
+    # then close.
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = b""
+        self.inflight = asyncio.Semaphore(MAX_INFLIGHT)
+        self.responses = asyncio.Queue(MAX_PIPELINE)
+        self.stream = None  # task writing a subscription, cancelled by the next request
+
+    async def run(self):
         try:
-            # Check for preferred network availability
-            scan = subprocess.check_output(["iwlist", "wlan0", "scan"], timeout=10)
-            if b"Preferred_SSID" not in scan:  # Replace with your SSID
-                logging.warning("Primary network unavailable")
-        except Exception as e:
-            logging.error(f"Network monitor error: {str(e)}")
-        time.sleep(60)
-
-def main():
-    # Start network monitoring thread
-    threading.Thread(target=network_monitor, daemon=True).start()
-    
-    # Set up TCP server
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((SERVER_IP, PORT))
-        s.listen(5)
-        logging.info(f"Server started on {SERVER_IP}:{PORT}")
-        
-        while True:
-            conn, addr = s.accept()
-            logging.info(f"Connection from {addr}")
-            threading.Thread(target=handle_client, args=(conn,)).start()
+            first = await asyncio.wait_for(self.reader.read(MAX_LINE), IDLE_TIMEOUT)
+            line, _, rest = first.partition(b"\n")
+            if line.strip() != SESSION_HELLO.encode():
+                request = first.decode(errors="replace").strip()
+                if request:
+                    response = await dispatch(self, request)
+                    if not isinstance(response, str):
+                        # Streams need a session to frame their lines
+                        await response.aclose()
+                        response = "Invalid command"
+                    self.writer.write(response.encode())
+                    await self.writer.drain()
+                return
+            self.pending = rest
+            await self.send_line(f"{SESSION_HELLO} OK")
+            await self.serve_session()
+        except (asyncio.TimeoutError, ConnectionError, ValueError) as e:
+            logging.info(f"Session ended: {type(e).__name__}")
+        finally:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def serve_session(self):
+        writer_task = asyncio.create_task(self.write_responses())
+        try:
+            while not writer_task.done():
+                line = await asyncio.wait_for(self.readline(), IDLE_TIMEOUT)
+                if not line:
+                    break
+                request = line.decode(errors="replace").strip()
+                if not request:
+                    continue
+                if self.stream is not None:
+                    self.stream.cancel()
+                # Both waits push back on the client: past MAX_INFLIGHT running or MAX_PIPELINE
+                # unsent replies we stop reading and let the TCP window fill up
+                await self.inflight.acquire()
+                await self.responses.put(asyncio.create_task(self.run_request(request)))
+        finally:
+            if self.stream is not None:
+                self.stream.cancel()
+            if not writer_task.done():
+                await self.responses.put(None)
+            await writer_task
+
+    async def readline(self):
+        if b"\n" in self.pending:
+            line, _, self.pending = self.pending.partition(b"\n")
+            return line + b"\n"
+        line = await self.reader.readline()
+        line, self.pending = self.pending + line, b""
+        return line
+
+    async def run_request(self, request):
+        try:
+            return await dispatch(self, request)
+        finally:
+            self.inflight.release()
+
+    async def write_responses(self):
+        try:
+            while True:
+                task = await self.responses.get()
+                if task is None:
+                    return
+                response = await task
+                if isinstance(response, str):
+                    await self.send_line(response)
+                    continue
+                self.stream = asyncio.create_task(self.send_stream(response))
+                await asyncio.wait([self.stream])
+                stream, self.stream = self.stream, None
+                if not stream.cancelled():
+                    stream.result()  # a connection error ends the session
+                await self.send_line(json.dumps({"type": "end"}))
+        except ConnectionError:
+            self.writer.close()
+
+    async def send_stream(self, response):
+        try:
+            async for line in response:
+                await self.send_line(line)
+                if not self.responses.empty():
+                    return  # requested before the stream started; it would otherwise never be answered
+        finally:
+            await response.aclose()
+
+    async def send_line(self, text):
+        self.writer.write(text.encode() + b"\n")
+        await self.writer.drain()
+
+async def handle_connection(reader, writer):
+    logging.info(f"Connection from {writer.get_extra_info('peername')}")
+    await ClientSession(reader, writer).run()
+
+async def start_server(host=SERVER_IP, port=PORT):
+    server = await asyncio.start_server(handle_connection, host, port, limit=MAX_LINE, reuse_address=True)
+    logging.info(f"Server started on {host}:{port}")
+    return server
+
+def network_changed(present):
+    if not present:
+        logging.warning("Primary network unavailable")
+
+async def main():
+    # Start network monitoring
+    WifiPresenceMonitor(PREFERRED_SSID, on_change=network_changed).start()
+
+    # Start telemetry sampling
+    sampler = asyncio.create_task(telemetry.run())
+
+    # Set up TCP server and clip downloads alongside it
+    server = await start_server()
+    clips = await start_clip_server(VIDEO_DIR, SERVER_IP)
+    async with server, clips:
+        await asyncio.gather(server.serve_forever(), clips.serve_forever())
 
 if __name__ == "__main__":
     try:
-        main()
+        asyncio.run(main())
     except KeyboardInterrupt:
         logging.info("Server stopped by user")
     except Exception as e:
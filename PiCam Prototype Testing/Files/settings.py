@@ -0,0 +1,215 @@
+import os
+import struct
+import ctypes
+import logging
+import selectors
+
+CONFIG_FILE = "/home/picam/config.txt"
+VIDEO_DIR = "/home/picam/videos"  # shared by the recorder, clip server and button wipe
+LORES_SIZE = (320, 240)  # stride equals width at this size, so the YUV420 planes slice cleanly
+HOTSPOT_IP = "192.168.4.1"  # the Pi's own address on its hotspot; the network servers listen only here
+RELOAD_DEBOUNCE = 0.5  # seconds to let an editor finish writing before the file is re-read
+POLL_INTERVAL = 5  # seconds between mtime checks when inotify is unavailable
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+FALSE_VALUES = ("0", "false", "no", "off")
+
+def parse_int(value):
+    return int(value)
+
+def parse_bool(value):
+    value = value.lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f"expected one of {', '.join(TRUE_VALUES + FALSE_VALUES)}")
+
+def parse_str(value):
+    if not value:
+        raise ValueError("must not be empty")
+    return value
+
+def parse_size(value):
+    width, _, height = value.lower().partition("x")
+    size = (int(width), int(height))
+    if size[0] % 2 or size[1] % 2:
+        raise ValueError("width and height must be even")
+    return size
+
+def parse_rects(value):
+    # "x0,y0,x1,y1; ..." in percent of the frame, or "none"
+    if value.lower() in ("", "none"):
+        return ()
+    rects = []
+    for part in value.split(";"):
+        x0, y0, x1, y1 = (float(n) for n in part.split(","))
+        if not 0 <= x0 < x1 <= 100 or not 0 <= y0 < y1 <= 100:
+            raise ValueError(f"bad rectangle {part.strip()}")
+        rects.append((x0, y0, x1, y1))
+    return tuple(rects)
+
+def parse_choice(*choices):
+    def parse(value):
+        value = value.lower()
+        if value not in choices:
+            raise ValueError(f"expected one of {', '.join(choices)}")
+        return value
+    return parse
+
+# name -> (parser, default, minimum, maximum); sizes are checked per dimension
+SCHEMA = {
+    "record_length": (parse_int, 10, 1, 120),
+    "delete_after_days": (parse_int, 7, 1, 3650),
+    "wifi_ssid": (parse_str, "FoxtelHub3677", None, None),
+    "continuous_recording": (parse_bool, True, None, None),
+    "native_mp4": (parse_bool, True, None, None),
+    "pre_event_seconds": (parse_int, 10, 0, 60),
+    "post_event_seconds": (parse_int, 20, 1, 600),
+    "event_buffer_mb": (parse_int, 24, 4, 512),
+    "max_video_gb": (parse_int, 0, 0, 4096),
+    "min_free_mb": (parse_int, 1024, 0, 1048576),
+    "preview_port": (parse_int, 8081, 0, 65535),
+    "fast_start": (parse_bool, True, None, None),
+    "sync_interval": (parse_int, 5, 1, 60),
+    "resolution": (parse_size, (1920, 1080), LORES_SIZE, (4056, 3040)),  # the main stream cannot be smaller than lores
+    "framerate": (parse_int, 25, 1, 120),
+    "thermal_governor": (parse_bool, True, None, None),
+    "parking_mode": (parse_choice("off", "home", "always"), "off", None, None),
+    "motion_sensitivity": (parse_int, 5, 1, 10),
+    "motion_mask": (parse_rects, (), None, None),
+    "parking_hold_seconds": (parse_int, 30, 5, 600),
+    "gps_device": (parse_str, "none", None, None),
+    "gps_baud": (parse_int, 9600, 4800, 115200)
+}
+
+def default_settings():
+    return {name: spec[1] for name, spec in SCHEMA.items()}
+
+def parse_settings(text, current=None):
+    # Keys missing from the file take their defaults; a bad value keeps the current value (or the
+    # default at startup) for that key only, instead of throwing away the rest of the file
+    settings = default_settings()
+    errors = []
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        key = key.strip().lower().replace(" ", "_")
+        value = value.strip()
+        if key not in SCHEMA:
+            errors.append(f"CFG003: Unknown setting {key} on line {number}")
+            continue
+        parser, _, minimum, maximum = SCHEMA[key]
+        try:
+            parsed = parser(value)
+            if minimum is not None:
+                values = parsed if isinstance(parsed, tuple) else (parsed,)
+                lows = minimum if isinstance(minimum, tuple) else (minimum,)
+                highs = maximum if isinstance(maximum, tuple) else (maximum,)
+                if any(v < low or v > high for v, low, high in zip(values, lows, highs)):
+                    raise ValueError(f"must be between {minimum} and {maximum}")
+        except ValueError as e:
+            errors.append(f"CFG002: Invalid value for {key} on line {number}: {value!r} ({str(e)})")
+            if current is not None:
+                settings[key] = current[key]
+            continue
+        settings[key] = parsed
+    return settings, errors
+
+def load_settings(path=CONFIG_FILE, current=None):
+    try:
+        with open(path, "r") as f:
+            text = f.read()
+    except FileNotFoundError:
+        logging.error("CFG001: Config file not found, using defaults")
+        return dict(current or default_settings())
+    settings, errors = parse_settings(text, current)
+    for error in errors:
+        logging.error(error)
+    logging.info("Config loaded successfully" if not errors else f"Config loaded with {len(errors)} errors")
+    return settings
+
+class ConfigWatcher:
+    # Re-reads the config when it changes and reports only the settings whose values changed.
+    # Watches the directory rather than the file, since editors usually save by renaming a new file over it.
+    def __init__(self, scheduler, settings, on_change, path=CONFIG_FILE):
+        self.scheduler = scheduler
+        self.settings = settings
+        self.on_change = on_change
+        self.path = path
+        self.name = os.path.basename(path).encode()
+        self.pending = None
+        self.fd = None
+        self.mtime = self._mtime()
+        self.reloads = 0
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+            if libc.inotify_add_watch(fd, os.path.dirname(path).encode() or b".", mask) < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+            self.fd = fd
+            scheduler.selector.register(fd, selectors.EVENT_READ, self._on_readable)
+        except (OSError, AttributeError) as e:
+            logging.warning(f"CFG005: inotify unavailable ({str(e)}), polling the config every {POLL_INTERVAL} s")
+            scheduler.call_every(POLL_INTERVAL, self._poll, "config-poll")
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _on_readable(self, fileobj, mask):
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        offset = 0
+        touched = False
+        while offset + INOTIFY_EVENT.size <= len(data):
+            _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b"\0")
+            offset += INOTIFY_EVENT.size + length
+            touched = touched or name == self.name
+        if touched:
+            # Coalesce the burst of events a single save produces into one reload
+            if self.pending is not None:
+                self.pending.cancel()
+            self.pending = self.scheduler.call_later(RELOAD_DEBOUNCE, self.reload, "config-reload")
+
+    def _poll(self):
+        mtime = self._mtime()
+        if mtime != self.mtime:
+            self.mtime = mtime
+            self.reload()
+
+    def reload(self):
+        self.pending = None
+        self.reloads += 1
+        settings = load_settings(self.path, self.settings)
+        changed = {name: (self.settings[name], value) for name, value in settings.items()
+                   if self.settings[name] != value}
+        self.settings = settings
+        if changed:
+            logging.info("Config changed: " + ", ".join(f"{name} {old} -> {new}" for name, (old, new) in changed.items()))
+            self.on_change(settings, changed)
+
+    def close(self):
+        if self.fd is not None:
+            self.scheduler.selector.unregister(self.fd)
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,122 @@
+import os
+import re
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+
+LOG_MAX_BYTES = 2 * 1024 * 1024
+LOG_BACKUPS = 3
+ERROR_LOG_MAX_BYTES = 128 * 1024  # small enough that a query reads it from the tail in a few blocks
+ERROR_LOG_BACKUPS = 1
+LOG_QUEUE_SIZE = 1000  # records held for the writer thread before new ones are dropped
+LOG_FORMAT = "%(asctime)s %(levelname).1s %(error_code)s %(threadName)s %(message)s"
+CODE_PATTERN = re.compile(r"^([A-Z]{2,4}\d{3}):?\s+")
+TAIL_BLOCK = 8192
+
+class ErrorCodeFilter(logging.Filter):
+    # Lifts a leading "VID003: " style code out of the message into record.error_code
+    def filter(self, record):
+        if not hasattr(record, "error_code"):
+            message = record.getMessage()
+            match = CODE_PATTERN.match(message)
+            record.error_code = match.group(1) if match else "-"
+            if match:
+                record.msg = message[match.end():]
+                record.args = None
+        return True
+
+class ErrorRecordFormatter(logging.Formatter):
+    # One JSON object per line, so a query can parse lines read backwards from the tail
+    def __init__(self, source):
+        super().__init__()
+        self.source = source
+
+    def format(self, record):
+        entry = {"t": round(record.created, 3), "level": record.levelname, "code": record.error_code,
+                 "src": self.source, "msg": record.getMessage()}
+        return json.dumps(entry, separators=(",", ":"))
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # A full queue means the card is stalled; losing a log line beats stalling the caller
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        if self.dropped:
+            record.msg = f"{record.msg} ({self.dropped} earlier log records dropped)"
+            self.dropped = 0
+        return record
+
+def setup_logging(path, errors_path, source, level=logging.INFO):
+    # Like basicConfig, leaves an already configured root logger alone
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+    main_handler = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+    main_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    error_handler = logging.handlers.RotatingFileHandler(errors_path, maxBytes=ERROR_LOG_MAX_BYTES,
+                                                         backupCount=ERROR_LOG_BACKUPS)
+    error_handler.setLevel(logging.WARNING)
+    error_handler.setFormatter(ErrorRecordFormatter(source))
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(log_queue)
+    # The code is extracted on the calling thread so both files see the same fields
+    handler.addFilter(ErrorCodeFilter())
+    root.addHandler(handler)
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(log_queue, main_handler, error_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+def read_tail_lines(path):
+    # Yields lines newest first, reading backwards one block at a time
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return
+    with f:
+        position = f.seek(0, os.SEEK_END)
+        remainder = b""
+        while position > 0:
+            size = min(TAIL_BLOCK, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + remainder).split(b"\n")
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line
+        if remainder:
+            yield remainder
+
+def read_recent_errors(paths, code=None, limit=20):
+    # Newest first across all error logs; stops reading as soon as each file has supplied enough matches
+    errors = []
+    for path in paths:
+        found = 0
+        for candidate in (path, path + ".1"):
+            for line in read_tail_lines(candidate):
+                if code is not None and f'"code":"{code}"' not in line.decode(errors="replace"):
+                    continue
+                try:
+                    errors.append(json.loads(line))
+                except ValueError:
+                    continue
+                found += 1
+                if found >= limit:
+                    break
+            if found >= limit:
+                break
+    errors.sort(key=lambda entry: entry.get("t", 0), reverse=True)
+    return errors[:limit]
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import tty
+import struct
+import select
+import logging
+import termios
+import argparse
+import threading
+
+GPS_DEVICE = "/dev/serial0"
+GPS_BAUD = 9600
+GPS_RETRY = 10  # seconds between attempts to open a missing or failed receiver
+TELEMETRY_INTERVAL = 2  # seconds between system samples, which also flush the sidecar
+INDEX_STRIDE = 64  # one sparse index entry per this many records
+SIDECAR_EXTENSION = ".tlm"
+
+# Sidecar layout: header, fixed-size records in time order, then (once closed cleanly) a sparse
+# index of every INDEX_STRIDE-th record's time and a trailer. Times are CLOCK_MONOTONIC ns, the clock
+# libcamera stamps SensorTimestamp with, so records line up with frames without any conversion.
+HEADER = struct.Struct("<4sHHqq")  # magic, version, record size, monotonic ns and wall-clock ns at open
+RECORD = struct.Struct("<qB3x20s")  # time ns, kind, payload
+GPS_PAYLOAD = struct.Struct("<iiiHHHBB")  # lat/lon 1e-7 deg, altitude dm, speed cm/s, course and hdop in 1/100, sats, fix quality
+SYSTEM_PAYLOAD = struct.Struct("<hIIHBB6x")  # temp 1/10 C, throttled flags, dropped frames, fps 1/100, thermal level, motion
+INDEX_ENTRY = struct.Struct("<qI")
+TRAILER = struct.Struct("<4sII")  # magic, index entries, records
+MAGIC = b"PTLM"
+TRAILER_MAGIC = b"PTLX"
+VERSION = 1
+KIND_GPS = 1
+KIND_SYSTEM = 2
+KNOTS_TO_CMS = 51.4444
+
+def sidecar_path(segment_path):
+    return os.path.splitext(segment_path)[0] + SIDECAR_EXTENSION
+
+def nmea_fields(line):
+    # Returns the fields of a checksummed sentence ("$GPRMC,...*hh"), or None if it is damaged
+    if not line.startswith("$") or "*" not in line:
+        return None
+    body, _, checksum = line[1:].partition("*")
+    calculated = 0
+    for byte in body.encode("ascii", "replace"):
+        calculated ^= byte
+    try:
+        if int(checksum[:2], 16) != calculated:
+            return None
+    except ValueError:
+        return None
+    return body.split(",")
+
+def nmea_degrees(value, hemisphere):
+    value = float(value)
+    degrees = int(value / 100)
+    degrees += (value - degrees * 100) / 60
+    return -degrees if hemisphere in ("S", "W") else degrees
+
+class SidecarWriter:
+    # Append-only; records are buffered in memory and written by flush() on the recorder's main loop
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, time.monotonic_ns(), time.time_ns()))
+        self.buffer = bytearray()
+        self.records = 0
+        self.index = []
+
+    def add(self, t_ns, kind, payload):
+        if self.records % INDEX_STRIDE == 0:
+            self.index.append((t_ns, self.records))
+        self.buffer += RECORD.pack(t_ns, kind, payload)
+        self.records += 1
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.buffer = bytearray()
+
+    def close(self):
+        self.flush()
+        for t_ns, number in self.index:
+            self.file.write(INDEX_ENTRY.pack(t_ns, number))
+        self.file.write(TRAILER.pack(TRAILER_MAGIC, len(self.index), self.records))
+        self.file.close()
+
+class SidecarReader:
+    # Record by position is one read; record by time is a bisect over the sparse index and then
+    # over at most INDEX_STRIDE records. A sidecar without a trailer (power cut) is bisected directly.
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        magic, version, record_size, self.open_ns, self.open_wall_ns = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC or record_size != RECORD.size:
+            raise ValueError(f"{path} is not a telemetry sidecar")
+        size = self.file.seek(0, os.SEEK_END)
+        self.index = None
+        if size >= HEADER.size + TRAILER.size:
+            self.file.seek(size - TRAILER.size)
+            trailer_magic, entries, records = TRAILER.unpack(self.file.read(TRAILER.size))
+            if trailer_magic == TRAILER_MAGIC:
+                self.count = records
+                self.file.seek(size - TRAILER.size - entries * INDEX_ENTRY.size)
+                data = self.file.read(entries * INDEX_ENTRY.size)
+                self.index = [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(entries)]
+        if self.index is None:
+            self.count = (size - HEADER.size) // RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.file.close()
+
+    def record(self, number):
+        self.file.seek(HEADER.size + number * RECORD.size)
+        t_ns, kind, payload = RECORD.unpack(self.file.read(RECORD.size))
+        return decode_record(t_ns, kind, payload)
+
+    def _time(self, number):
+        self.file.seek(HEADER.size + number * RECORD.size)
+        return struct.unpack("<q", self.file.read(8))[0]
+
+    def find(self, t_ns):
+        # Position of the last record at or before t_ns, or None if t_ns is before the first one
+        low, high = 0, self.count
+        if self.index:
+            entry = 0
+            lo, hi = 0, len(self.index)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.index[mid][0] <= t_ns:
+                    entry, lo = mid, mid + 1
+                else:
+                    hi = mid
+            low = self.index[entry][1]
+            high = min(self.count, low + INDEX_STRIDE)
+        found = None
+        while low < high:
+            mid = (low + high) // 2
+            if self._time(mid) <= t_ns:
+                found, low = mid, mid + 1
+            else:
+                high = mid
+        return found
+
+    def at(self, t_ns, kind=None):
+        # Newest record (of a kind) at or before t_ns, looking back no further than two index strides
+        number = self.find(t_ns)
+        oldest = 0 if number is None else max(0, number - 2 * INDEX_STRIDE)
+        while number is not None and number >= oldest:
+            record = self.record(number)
+            if kind is None or record["kind"] == kind:
+                return record
+            number -= 1
+        return None
+
+def decode_record(t_ns, kind, payload):
+    if kind == KIND_GPS:
+        lat, lon, alt_dm, speed_cms, course, hdop, sats, quality = GPS_PAYLOAD.unpack(payload)
+        return {"t_ns": t_ns, "kind": "gps", "lat": lat / 1e7, "lon": lon / 1e7, "alt_m": alt_dm / 10,
+                "speed_kmh": round(speed_cms * 0.036, 2), "course": course / 100, "hdop": hdop / 100,
+                "sats": sats, "fix": quality}
+    if kind == KIND_SYSTEM:
+        temp, throttled, dropped, fps, level, motion = SYSTEM_PAYLOAD.unpack(payload)
+        return {"t_ns": t_ns, "kind": "system", "temp_c": temp / 10, "throttled": throttled, "dropped": dropped,
+                "fps": fps / 100, "thermal_level": level, "motion": bool(motion)}
+    return {"t_ns": t_ns, "kind": kind}
+
+class TelemetryRecorder:
+    # One sidecar per segment. The GPS thread and the main loop add records; all file I/O is on the main loop.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.writer = None
+        self.last_ns = 0
+        self.records = 0
+
+    def add(self, t_ns, kind, payload):
+        with self.lock:
+            # Keep the file sorted even if a GPS line was stamped just before a system sample was added
+            t_ns = max(t_ns, self.last_ns)
+            self.last_ns = t_ns
+            if self.writer is not None:
+                self.writer.add(t_ns, kind, payload)
+                self.records += 1
+
+    def add_gps(self, t_ns, fix):
+        self.add(t_ns, KIND_GPS, GPS_PAYLOAD.pack(
+            round(fix["lat"] * 1e7), round(fix["lon"] * 1e7), round(fix["alt_m"] * 10),
+            min(65535, round(fix["speed_knots"] * KNOTS_TO_CMS)), round(fix["course"] * 100) % 36000,
+            min(65535, round(fix["hdop"] * 100)), min(255, fix["sats"]), fix["quality"]))
+
+    def add_system(self, temp_c, throttled, dropped, fps, level, motion):
+        self.add(time.monotonic_ns(), KIND_SYSTEM, SYSTEM_PAYLOAD.pack(
+            round((temp_c or 0) * 10), throttled & 0xFFFFFFFF, dropped & 0xFFFFFFFF, min(65535, round(fps * 100)),
+            level, int(motion)))
+
+    def open_segment(self, segment_path):
+        self.close_segment()
+        try:
+            writer = SidecarWriter(sidecar_path(segment_path))
+        except OSError as e:
+            logging.error(f"TLM001: Could not create telemetry sidecar: {str(e)}")
+            return
+        with self.lock:
+            self.writer = writer
+
+    def flush(self):
+        with self.lock:
+            writer = self.writer
+            if writer is None or not writer.buffer:
+                return
+            data, writer.buffer = writer.buffer, bytearray()
+        try:
+            writer.file.write(data)
+            writer.file.flush()
+        except OSError as e:
+            logging.error(f"TLM001: Telemetry write failed for {writer.path}: {str(e)}")
+
+    def close_segment(self):
+        self.flush()
+        with self.lock:
+            writer, self.writer = self.writer, None
+        if writer is not None:
+            try:
+                writer.close()
+            except OSError as e:
+                logging.error(f"TLM001: Could not finish telemetry sidecar {writer.path}: {str(e)}")
+
+    def remove(self, segment_path):
+        try:
+            os.remove(sidecar_path(segment_path))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"DEL001: Failed to delete {sidecar_path(segment_path)}: {str(e)}")
+
+class GpsReader:
+    # Reads NMEA from a serial receiver on its own thread. One fix is reported per RMC sentence,
+    # merged with the latest GGA (altitude, satellites, hdop); a void RMC is still reported as fix 0.
+    def __init__(self, on_fix, device=GPS_DEVICE, baud=GPS_BAUD):
+        self.on_fix = on_fix
+        self.device = device
+        self.baud = baud
+        self.gga = {"alt_m": 0.0, "sats": 0, "hdop": 0.0, "quality": 0}
+        self.fixes = 0
+        self.bad_sentences = 0
+        self.last_fix = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="gps", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        self.thread.join(timeout)
+
+    def open_port(self):
+        fd = os.open(self.device, os.O_RDONLY | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            if os.isatty(fd):
+                tty.setraw(fd)
+                attrs = termios.tcgetattr(fd)
+                speed = getattr(termios, f"B{self.baud}")
+                attrs[2] |= termios.CLOCAL | termios.CREAD
+                attrs[4] = attrs[5] = speed
+                termios.tcsetattr(fd, termios.TCSANOW, attrs)
+        except (termios.error, AttributeError):
+            os.close(fd)
+            raise
+        return fd
+
+    def _run(self):
+        failed = False
+        while not self.stop_event.is_set():
+            try:
+                fd = self.open_port()
+            except (OSError, termios.error, AttributeError) as e:
+                if not failed:
+                    logging.warning(f"GPS001: Cannot open GPS receiver {self.device}: {str(e)}")
+                    failed = True
+                self.stop_event.wait(GPS_RETRY)
+                continue
+            if failed:
+                logging.info(f"GPS receiver {self.device} opened")
+                failed = False
+            try:
+                self._read(fd)
+            except OSError as e:
+                logging.warning(f"GPS001: GPS receiver {self.device} read failed: {str(e)}")
+                failed = True
+            finally:
+                os.close(fd)
+            self.stop_event.wait(GPS_RETRY)
+
+    def _read(self, fd):
+        pending = b""
+        while not self.stop_event.is_set():
+            readable, _, _ = select.select([fd], [], [], 1)
+            if not readable:
+                continue
+            received_ns = time.monotonic_ns()
+            data = os.read(fd, 1024)
+            if not data:
+                raise OSError("receiver closed")
+            lines = (pending + data).split(b"\n")
+            pending = lines.pop()[-256:]
+            for line in lines:
+                self.handle_sentence(line.strip().decode("ascii", "replace"), received_ns)
+
+    def handle_sentence(self, line, received_ns):
+        fields = nmea_fields(line)
+        if fields is None:
+            if line:
+                self.bad_sentences += 1
+            return
+        kind = fields[0][2:]
+        try:
+            if kind == "GGA" and len(fields) >= 10:
+                self.gga = {"quality": int(fields[6] or 0), "sats": int(fields[7] or 0),
+                            "hdop": float(fields[8] or 0), "alt_m": float(fields[9] or 0)}
+            elif kind == "RMC" and len(fields) >= 9:
+                valid = fields[2] == "A" and fields[3] and fields[5]
+                fix = dict(self.gga,
+                           lat=nmea_degrees(fields[3], fields[4]) if valid else 0.0,
+                           lon=nmea_degrees(fields[5], fields[6]) if valid else 0.0,
+                           speed_knots=float(fields[7] or 0), course=float(fields[8] or 0))
+                if not valid:
+                    fix["quality"] = 0
+                elif not fix["quality"]:
+                    fix["quality"] = 1  # a valid RMC before any GGA is still a fix
+                self.fixes += 1
+                self.last_fix = fix
+                self.on_fix(received_ns, fix)
+        except ValueError:
+            self.bad_sentences += 1
+
+    def stats(self):
+        return {"device": self.device, "fixes": self.fixes, "bad_sentences": self.bad_sentences,
+                "fix": self.last_fix["quality"] if self.last_fix else None}
+
+def main():
+    parser = argparse.ArgumentParser(description="Dump or query a segment's telemetry sidecar")
+    parser.add_argument("path", help="segment or .tlm file")
+    parser.add_argument("--at", type=float, help="seconds from the start of the segment")
+    args = parser.parse_args()
+    reader = SidecarReader(sidecar_path(args.path))
+    if args.at is not None:
+        for kind in ("gps", "system"):
+            print(reader.at(reader.open_ns + int(args.at * 1e9), kind))
+    else:
+        for number in range(len(reader)):
+            print(reader.record(number))
+    reader.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
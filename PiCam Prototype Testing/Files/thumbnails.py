@@ -0,0 +1,115 @@
+import os
+import json
+import glob
+import time
+import queue
+import logging
+import threading
+
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None  # fake backend on a machine without the Pi packages; thumbnails are switched off
+
+THUMB_DIR_NAME = ".thumbs"
+THUMB_INTERVAL = 30  # seconds between thumbnails within a segment
+THUMB_QUALITY = 70
+
+def encode_lores_jpeg(array, size, quality):
+    # YUV420 lores: full-size Y plane followed by quarter-size U and V planes
+    width, height = size
+    y = array[:height, :width]
+    u = array[height:height + height // 4].reshape(height // 2, width // 2)
+    v = array[height + height // 4:height + height // 2].reshape(height // 2, width // 2)
+    if simplejpeg is None:
+        raise RuntimeError("simplejpeg is not installed")
+    return simplejpeg.encode_jpeg_yuv_planes(y, u, v, quality=quality)
+
+def thumb_stem(segment_path):
+    return os.path.splitext(os.path.basename(segment_path))[0]
+
+class SegmentThumbnailer:
+    # Grabs small JPEGs from the lores stream at segment open and every THUMB_INTERVAL, and
+    # writes a per-segment index of thumbnails and keyframe byte offsets for the gallery
+    def __init__(self, video_dir, lores_size, interval=THUMB_INTERVAL):
+        self.thumb_dir = os.path.join(video_dir, THUMB_DIR_NAME)
+        os.makedirs(self.thumb_dir, exist_ok=True)
+        self.lores_size = lores_size
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.segment = None
+        self.segment_start = None
+        self.next_due = None
+        self.thumbs = {}  # segment stem -> [(offset seconds, file name)]
+        self.queue = queue.Queue(maxsize=4)
+        self.enabled = simplejpeg is not None
+        if not self.enabled:
+            logging.warning("THM001: Thumbnails disabled, simplejpeg is not installed")
+        self.thread = threading.Thread(target=self._run, name="thumbnails", daemon=True)
+        self.thread.start()
+
+    def open_segment(self, path):
+        with self.lock:
+            self.segment = thumb_stem(path)
+            self.segment_start = time.monotonic()
+            self.next_due = self.segment_start
+            self.thumbs[self.segment] = []
+
+    def wants_frame(self):
+        return self.enabled and self.segment is not None and time.monotonic() >= self.next_due
+
+    def on_lores(self, array):
+        with self.lock:
+            if self.segment is None:
+                return
+            now = time.monotonic()
+            offset = now - self.segment_start
+            name = f"{self.segment}_{len(self.thumbs[self.segment]):03d}.jpg"
+            self.next_due = now + self.interval
+            try:
+                self.queue.put_nowait((self.segment, offset, name, array))
+            except queue.Full:
+                # Skip rather than hold up the camera thread; the next interval gets another try
+                return
+            self.thumbs[self.segment].append((round(offset, 2), name))
+
+    def close_segment(self, path, keyframes):
+        # keyframes: [(offset seconds, byte offset)] for seeking inside the MP4 without parsing it
+        stem = thumb_stem(path)
+        with self.lock:
+            if self.segment == stem:
+                self.segment = None
+            thumbs = self.thumbs.pop(stem, [])
+        index = {
+            "segment": os.path.basename(path),
+            "thumbnails": [{"t": offset, "file": name} for offset, name in thumbs],
+            "keyframes": [[round(offset, 3), byte] for offset, byte in keyframes]
+        }
+        try:
+            tmp_path = os.path.join(self.thumb_dir, f"{stem}.json.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(index, f, separators=(",", ":"))
+            os.replace(tmp_path, os.path.join(self.thumb_dir, f"{stem}.json"))
+        except Exception as e:
+            logging.error(f"THM001: Failed to write index for {stem}: {str(e)}")
+
+    def remove(self, segment_path):
+        # Exact names only: Recording_X_2 (see unique_path) is a different, possibly live, segment
+        stem = glob.escape(thumb_stem(segment_path))
+        paths = glob.glob(os.path.join(self.thumb_dir, f"{stem}_[0-9][0-9][0-9].jpg"))
+        paths += glob.glob(os.path.join(self.thumb_dir, f"{stem}.json"))
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.error(f"DEL001: Failed to delete {path}: {str(e)}")
+
+    def _run(self):
+        while True:
+            segment, offset, name, array = self.queue.get()
+            try:
+                jpeg = encode_lores_jpeg(array, self.lores_size, THUMB_QUALITY)
+                with open(os.path.join(self.thumb_dir, name), "wb") as f:
+                    f.write(jpeg)
+            except Exception as e:
+                logging.error(f"THM001: Thumbnail failed for {segment}: {str(e)}")
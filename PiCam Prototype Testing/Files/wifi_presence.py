@@ -0,0 +1,161 @@
+import os
+import time
+import socket
+import select
+import logging
+import itertools
+import threading
+import subprocess
+
+WPA_CTRL_DIR = "/var/run/wpa_supplicant"
+REFRESH_INTERVAL = 30  # seconds between re-reads of wpa_supplicant's cached state when no events arrive
+PRESENT_HOLD = 5  # seconds an SSID must keep being seen before it counts as present
+ABSENT_HOLD = 60  # seconds it must stay missing before it counts as gone
+WATCHED_EVENTS = ("CTRL-EVENT-SCAN-RESULTS", "CTRL-EVENT-CONNECTED", "CTRL-EVENT-DISCONNECTED",
+                  "CTRL-EVENT-NETWORK-NOT-FOUND", "CTRL-EVENT-BSS-REMOVED")
+
+_client_ids = itertools.count()
+
+class WpaControl:
+    # Minimal client for the wpa_supplicant control interface (a Unix datagram socket)
+    def __init__(self, path, timeout=2):
+        self.local_path = f"/tmp/wpa_ctrl_{os.getpid()}_{next(_client_ids)}"
+        if os.path.exists(self.local_path):
+            os.remove(self.local_path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self.sock.bind(self.local_path)
+            self.sock.connect(path)
+        except OSError:
+            self.close()
+            raise
+        self.sock.settimeout(timeout)
+
+    def request(self, command):
+        self.sock.send(command.encode())
+        while True:
+            reply = self.sock.recv(8192).decode(errors="replace")
+            # Unsolicited events start with a "<level>" prefix; skip them while waiting for the reply
+            if not reply.startswith("<"):
+                return reply.strip()
+
+    def receive(self):
+        return self.sock.recv(8192).decode(errors="replace")
+
+    def close(self):
+        self.sock.close()
+        if os.path.exists(self.local_path):
+            os.remove(self.local_path)
+
+class WifiPresenceMonitor:
+    # Tracks whether an SSID is around from wpa_supplicant events instead of running iwlist scans.
+    # present is None until the first observation, then only flips after the hold time passes.
+    def __init__(self, ssid, interface="wlan0", ctrl_dir=WPA_CTRL_DIR, present_hold=PRESENT_HOLD,
+                 absent_hold=ABSENT_HOLD, refresh_interval=REFRESH_INTERVAL, on_change=None):
+        self.ssid = ssid
+        self.interface = interface
+        self.ctrl_path = os.path.join(ctrl_dir, interface)
+        self.present_hold = present_hold
+        self.absent_hold = absent_hold
+        self.refresh_interval = refresh_interval
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.present = None
+        self.candidate_since = None
+        self.source = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="wifi-presence", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+    def observe(self, seen, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.present is not None and seen == self.present:
+                self.candidate_since = None
+                return
+            if self.present is not None:
+                if self.candidate_since is None:
+                    self.candidate_since = now
+                hold = self.present_hold if seen else self.absent_hold
+                if now - self.candidate_since < hold:
+                    return
+            self.present = seen
+            self.candidate_since = None
+        logging.info(f"Wi-Fi '{self.ssid}' {'present' if seen else 'absent'} (via {self.source})")
+        if self.on_change is not None:
+            self.on_change(seen)
+
+    def _next_timeout(self):
+        with self.lock:
+            if self.candidate_since is None:
+                return self.refresh_interval
+            hold = self.absent_hold if self.present else self.present_hold
+            remaining = self.candidate_since + hold - time.monotonic()
+        return max(0.1, min(self.refresh_interval, remaining))
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self._run_wpa()
+            except OSError as e:
+                if self.source != "iwlist":
+                    logging.warning(f"WIFI002: wpa_supplicant control socket unavailable ({str(e)}), falling back to iwlist")
+                self.source = "iwlist"
+                self._scan_iwlist()
+                self.stop_event.wait(self._next_timeout())
+
+    def _run_wpa(self):
+        ctrl = WpaControl(self.ctrl_path)
+        try:
+            events = WpaControl(self.ctrl_path)
+        except OSError:
+            ctrl.close()
+            raise
+        try:
+            if events.request("ATTACH") != "OK":
+                raise OSError("ATTACH rejected")
+            self.source = "wpa_supplicant"
+            self._refresh(ctrl)
+            while not self.stop_event.is_set():
+                readable, _, _ = select.select([events.sock], [], [], self._next_timeout())
+                if readable:
+                    # One datagram per readable wakeup; reading again would block on an empty socket
+                    message = events.receive()
+                    if not any(event in message for event in WATCHED_EVENTS):
+                        continue
+                self._refresh(ctrl)
+        finally:
+            ctrl.close()
+            events.close()
+
+    def _refresh(self, ctrl):
+        # Both replies come from wpa_supplicant's cache, so this never touches the radio
+        status = dict(line.split("=", 1) for line in ctrl.request("STATUS").splitlines() if "=" in line)
+        seen = status.get("wpa_state") == "COMPLETED" and status.get("ssid") == self.ssid
+        if not seen:
+            for line in ctrl.request("SCAN_RESULTS").splitlines()[1:]:
+                fields = line.split("\t")
+                if len(fields) >= 5 and fields[4] == self.ssid:
+                    seen = True
+                    break
+        self.observe(seen)
+
+    def _scan_iwlist(self):
+        try:
+            result = subprocess.run(
+                ["iwlist", self.interface, "scan"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                timeout=15
+            )
+            self.observe(f'ESSID:"{self.ssid}"' in result.stdout)
+        except Exception as e:
+            logging.error(f"WIFI001: Scan failed: {str(e)}")